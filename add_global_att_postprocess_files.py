@@ -7,6 +7,10 @@ Four new global attributes are added:
  - version number
  - version date in the repo
  
+The attributes are GLOBATT_CHANGES of postprocess_modules.py (also written by
+postprocess_NARCliM.py to the new files) and they are added with
+patch_global_atts.py: several files at a time, only to the files that do not have
+them yet, and the changes are written to patch_global_atts.log.
 
 Author: Alejandro Di Luca @ CCRC, UNSW. Sydney (Australia)
 email: a.diluca@unsw.edu.au
@@ -15,11 +19,9 @@ Modified: 13/06/2014
     - I added the version number and I added variable for the global attributes and their values.
 
 """
-import netCDF4 as nc
-import numpy as np
-import sys
 import os
-import glob
+import postprocess_modules as pm
+import patch_global_atts as pga
 import ccrc_utils as cu
 
 
@@ -28,11 +30,8 @@ RCM_names=['R1','R2','R3']
 Period_names=['1990-2010','2020-2040','2060-2080']
 Domain_names=['d01','d02']
 
-# Names and values of global att to be added
-gatt_name=['Conventions','Comments_on_Conventions','version']
-gatt_value={'Conventions':'CF-1.6',\
-              'Comments_on_Conventions':'Some variables do not strictly follow CF-1.6 conventions (e.g., precipitation is given as an accumulated quantity rather than as a flux quantity).',\
-'version':'2.1'}
+# Files patched at the same time
+jobs=8
 
 
 for g in xrange(len(GCM_names)):
@@ -46,34 +45,7 @@ for g in xrange(len(GCM_names)):
         # Retrieving the location where postprocessed data are stored
         pathin=cu.get_postproc_location(GCM_names[g],RCM_names[r],Period_names[p])[0]
 
-        # Output files are going to the same directory...
-        pathout=pathin
-
         # Check if we have permissions to write in output folder
         if os.access(pathin, os.W_OK)==True:
-
-          # List files to modify
-          files_in=sorted(glob.glob('%s/%s/*.nc' % (pathin,Domain_names[d])))
-
-          for file in files_in:
-              print ' --->> Adding attributes in: ', file
-
-              # Open and read file
-              fout = nc.Dataset(file,mode='a')
-
-              # Read global atts in the file
-              globatt={}
-              for attname in fout.ncattrs():
-                globatt[attname]=getattr(fout, attname)
-
-              for gatt in gatt_name:
-
-                # Check if the attribute already exists
-                if np.any(np.asarray(globatt.keys())==gatt)==False:
-                  setattr(fout,gatt,gatt_value[gatt])   
-                else:
-                  if globatt[gatt]!=gatt_value[gatt]:
-                    setattr(fout,gatt,gatt_value[gatt])   
-
-              fout.close()
-
+          files_in=pga.get_files(['%s/%s' % (pathin,Domain_names[d])])
+          pga.patch_files(files_in,pm.GLOBATT_CHANGES,jobs,'patch_global_atts.log')
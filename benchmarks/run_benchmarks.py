@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+"""run_benchmarks.py
+   Times the main steps of the postprocessing on synthetic WRF outputs
+   (see synthetic_wrf.py): read_list, each compute_* function, create_netcdf,
+   create_dailyfiles and create_monthlyfiles. The whole high-frequency stage is
+   also timed with the files written directly (highfreq_stage/sync) and by the
+   writer process of writerpool (highfreq_stage/async, as with async_write=True).
+
+   The steps are run as in postprocess_NARCliM.py, one variable at a time, and the
+   timings are written to a JSON file, together with the commit, the grid size and
+   the versions of the libraries. Two JSON files (e.g. from two commits) can be
+   compared with --compare. The synthetic files are written to the work directory
+   the first time and reused afterwards.
+
+   Usage (from the folder of postprocess_NARCliM.py):
+     python benchmarks/run_benchmarks.py -w /scratch/bench/ -o bench_new.json
+     python benchmarks/run_benchmarks.py -w /scratch/bench/ --ny 100 --nx 120 -v tas,pracc,wss
+     python benchmarks/run_benchmarks.py --compare bench_old.json bench_new.json
+"""
+import os
+import sys
+import copy
+import time
+import json
+import shutil
+import platform
+import subprocess
+import datetime as dt
+import calendar as cal
+from optparse import OptionParser
+import numpy as np
+import netCDF4 as nc
+
+repodir=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0,repodir)
+import postprocess_modules as pm
+import compute_vars as comv
+import variables_info as cfg
+import synthetic_wrf as synth
+
+# Variables timed by default: one or more of each type of WRF file and of
+# each kind of computation (accumulated, rotated winds, static fields...)
+DEFAULT_VARIABLES=['tas','pracc','wss','uas','evspsbl','rsds','mrso','sst',
+                   'tasmaxtstep','tasmintstep','pr5maxtstep']
+
+# A slow-down larger than this ratio is reported as a regression by --compare
+REGRESSION_RATIO=1.2
+
+
+# *************************************************************************************
+def get_gvars(pathin,pathout,syear,eyear,options=None):
+  """ Global variables of the postprocess, as read from an input file by read_input
+  """
+  inputinf={'pathin':pathin,'pathout':pathout,'GCM':'MIROC3.2','RCM':'R1',
+            'syear':str(syear),'eyear':str(eyear),'domain':'d02',
+            'outfile_patt':'CCRC_NARCliM_','overwrite':'True'}
+  if options is not None:
+    inputinf.update(options)
+  return pm.gvar(inputinf)
+
+
+# *************************************************************************************
+def timed(timings,name,func,*args):
+  """ Calls func(*args) and adds its duration in seconds to timings[name]
+  """
+  tstart=time.time()
+  result=func(*args)
+  timings[name]=timings.get(name,0.)+time.time()-tstart
+  return result
+
+
+# *************************************************************************************
+def run_highfreq(gvars,varinfo,filet,per,per_f,variables,timings,writer=None):
+  """ High-frequency stage of postprocess_NARCliM.py for the variables of one
+  type of file and period. Each variable is read on its own, except the variables
+  from 3-D fields, that are computed together in chunks (process_chunked). The files
+  are written with create_netcdf, or submitted to writer (a writerpool) if it is given.
+  """
+  fullpathout=pm.create_outdir(gvars)
+  file_info=pm.get_filefreq(filet)
+  time_step=file_info['time_step']
+  n_files=file_info['n_files']
+  if n_files==-1:
+    n_files=sum([365+int(cal.isleap(pp) and gvars.GCM_calendar!='no_leap') for pp in xrange(per,per_f+1)])
+  files_list=pm.file_list(gvars,per,per_f,filet,n_files)
+
+  def get_file_out(var):
+    return '%s%s%s_%s-%s_%s.nc' %(fullpathout,gvars.outfile_patt,file_info['file_freq'],per,per_f,var)
+
+  def get_period_dates(time_old):
+    year_i,month_i,day_i,hour_i=pm.get_wrfdate(time_old[0,:])
+    n_days=dt.datetime(per_f+1,month_i,day_i,hour_i)-dt.datetime(per,month_i,day_i,hour_i)
+    date=pm.get_dates(year_i,month_i,day_i,hour_i,0,time_step,n_days.days*int(24./time_step))
+    if gvars.GCM_calendar=='no_leap':
+      return date,[dd for dd in date if not (dd.month==2 and dd.day==29)]
+    return date,date
+
+  chunked=[var for var in variables if varinfo.is_chunked(var)]
+  if len(chunked)>0:
+    date,date_var=get_period_dates(pm.read_times(files_list))
+    timed(timings,'process_chunked',pm.process_chunked,[[get_file_out(var),var,None,file_info['tbounds']] for var in chunked],
+          files_list,date,date_var,pm.date2hours(date,gvars.ref_date),pm.const.missingval,gvars)
+
+  for var in [var for var in variables if var not in chunked]:
+    file_out=get_file_out(var)
+    wrfvar=varinfo.get_inputs(var)
+    time_old,varvals=timed(timings,'read_list/%s' %(var),pm.read_list,files_list,var,gvars)
+
+    date,date_var=get_period_dates(time_old)
+    time_out=pm.date2hours(date,gvars.ref_date)
+    time_bounds=file_info['tbounds']
+    time_bnds=pm.const.missingval
+
+    if varinfo.is_accumulated(var):
+      time_bounds=True
+      if filet=='wrfhrly' or filet=='wrfout':
+        time_out=pm.create_outtime(date,gvars)
+        time_bnds=pm.create_timebnds(time_out)
+        varvals=pm.add_timestep_acc(wrfvar,varvals,per_f,gvars,filet)
+    if filet=='wrfxtrm' or filet=='wrfdly':
+      time_out=[tt+time_step/2 for tt in pm.date2hours(date,gvars.ref_date)]
+      time_bnds=pm.create_timebnds(time_out)
+      varvals=pm.mv_timestep(wrfvar,varvals,per_f,gvars,filet)
+
+    compute=getattr(comv,'compute_'+var)
+    varval,varatt=timed(timings,'compute_%s' %(var),compute,varvals,date_var,gvars)
+    if gvars.GCM_calendar=='no_leap':
+      varval=pm.add_leapdays(varval,date)
+    if writer is None:
+      timed(timings,'create_netcdf/%s' %(var),pm.create_netcdf,[file_out,var,varatt,time_bounds],gvars,varval,time_out,time_bnds)
+    else:
+      timed(timings,'submit/%s' %(var),writer.submit,[file_out,var,varatt,time_bounds],varval,time_out,time_bnds)
+
+
+# *************************************************************************************
+def run_highfreq_stage(gvars,varinfo,variables,timings,writer=None):
+  """ High-frequency stage for all types of files and periods
+  """
+  for filet in varinfo.get_wrf_file_types():
+    varset=[var for var in variables if var in varinfo.get_variables(filet)]
+    if len(varset)==0:
+      continue
+    period=pm.get_filefreq(filet)['period']
+    for per in xrange(gvars.syear,gvars.eyear+1,period):
+      run_highfreq(gvars,varinfo,filet,per,per+period-1,varset,timings,writer)
+
+
+def run_highfreq_async(gvars,varinfo,variables):
+  """ High-frequency stage with the files written by the writer process of
+  writerpool (async_write=True), until the last file is written
+  """
+  gvars_async=copy.copy(gvars)
+  gvars_async.async_write=True
+  writer=pm.writerpool(gvars_async)
+  run_highfreq_stage(gvars_async,varinfo,variables,{},writer)
+  writer.close()
+
+
+# *************************************************************************************
+def run(gvars,variables,logfile):
+  """ Runs all stages for the requested variables. Returns the timings in seconds
+  """
+  varinfo=cfg.VariablesInfo()
+  timings={}
+  tstart=time.time()
+  stdout=sys.stdout
+  sys.stdout=open(logfile,'w')
+  try:
+    timed(timings,'highfreq_stage/sync',run_highfreq_stage,gvars,varinfo,variables,timings)
+    # The same stage writing in the background (the files are written again)
+    timed(timings,'highfreq_stage/async',run_highfreq_async,gvars,varinfo,variables)
+
+    for filet in varinfo.get_wrf_file_types():
+      if filet!='wrfxtrm' and filet!='wrfdly':
+        for varname in varinfo.get_daily_variables(filet):
+          if varname in variables:
+            stat_all=varinfo.get_daily_variable_stats(filet,varname)
+            timed(timings,'create_dailyfiles/%s' %(varname),pm.create_dailyfiles,gvars,varname,stat_all,varinfo)
+    for filet in varinfo.get_wrf_file_types():
+      for varname in varinfo.get_monthly_variables(filet):
+        if varname in variables:
+          stat_all=varinfo.get_monthly_variable_stats(filet,varname)
+          timed(timings,'create_monthlyfiles/%s' %(varname),pm.create_monthlyfiles,gvars,varname,stat_all,varinfo)
+  finally:
+    sys.stdout.close()
+    sys.stdout=stdout
+  timings['total']=time.time()-tstart
+  return timings
+
+
+# *************************************************************************************
+def get_commit():
+  """ Short hash of the commit of the scripts (with '+' if there are local changes)
+  """
+  try:
+    commit=subprocess.check_output(['git','rev-parse','--short','HEAD'],cwd=repodir,stderr=subprocess.STDOUT).strip()
+    changes=subprocess.check_output(['git','status','--porcelain','--untracked-files=no'],cwd=repodir,stderr=subprocess.STDOUT)
+  except (OSError,subprocess.CalledProcessError):
+    return 'unknown'
+  if changes.strip():
+    commit=commit+'+'
+  return commit
+
+
+# *************************************************************************************
+def compare(fileold,filenew):
+  """ Prints the timings of two benchmark files side by side. Returns the number of
+  steps that are more than REGRESSION_RATIO times slower in filenew
+  """
+  old=json.load(open(fileold,'r'))
+  new=json.load(open(filenew,'r'))
+  print 'OLD: %s (%s, grid %s)' %(fileold,old['commit'],old['grid'])
+  print 'NEW: %s (%s, grid %s)' %(filenew,new['commit'],new['grid'])
+  if old['grid']!=new['grid'] or old['years']!=new['years']:
+    print 'WARNING: the benchmarks were run with different grids or years'
+  nregress=0
+  print '%-40s %10s %10s %8s' %('step','old (s)','new (s)','new/old')
+  for name in sorted(set(old['timings'].keys())|set(new['timings'].keys())):
+    if (name not in old['timings']) or (name not in new['timings']):
+      print '%-40s %10s %10s' %(name,'%.3f' %(old['timings'][name]) if name in old['timings'] else '-',
+                                '%.3f' %(new['timings'][name]) if name in new['timings'] else '-')
+      continue
+    ratio=new['timings'][name]/max(old['timings'][name],1e-6)
+    flag=''
+    if ratio>REGRESSION_RATIO:
+      flag='  <-- SLOWER'
+      nregress=nregress+1
+    print '%-40s %10.3f %10.3f %8.2f%s' %(name,old['timings'][name],new['timings'][name],ratio,flag)
+  return nregress
+
+
+# *************************************************************************************
+if __name__ == "__main__":
+  parser = OptionParser()
+  parser.add_option("-w", "--workdir", dest="workdir", default='./benchmark_work/',
+  help="directory for the synthetic WRF files and the postprocessed files", metavar="PATH")
+  parser.add_option("-o", "--outfile", dest="outfile", default=None,
+  help="JSON file with the timings (workdir/benchmark_<commit>.json by default)", metavar="FILE")
+  parser.add_option("-v", "--variables", dest="variables", default=','.join(DEFAULT_VARIABLES),
+  help="comma separated list of variables", metavar="VARS")
+  parser.add_option("-s", "--syear", dest="syear", type="int", default=1990)
+  parser.add_option("-e", "--eyear", dest="eyear", type="int", default=1994)
+  parser.add_option("--ny", dest="ny", type="int", default=20)
+  parser.add_option("--nx", dest="nx", type="int", default=30)
+  parser.add_option("--nz", dest="nz", type="int", default=10)
+  parser.add_option("--no_leap", dest="no_leap", action="store_true", default=False,
+  help="synthetic files without 29 February (postprocessed as CCCMA3.1)")
+  parser.add_option("--3d", dest="with3d", action="store_true", default=False,
+  help="write the 3-D fields in wrfout (needed by psl and pressure level variables)")
+  parser.add_option("-l", "--label", dest="label", default='',
+  help="free text stored with the timings", metavar="TEXT")
+  parser.add_option("--compare", dest="compare", action="store_true", default=False,
+  help="compare two JSON files given as arguments (old new)")
+  (opts, args) = parser.parse_args()
+
+  if opts.compare:
+    if len(args)!=2:
+      parser.error('--compare needs two JSON files: old new')
+    sys.exit(min(compare(args[0],args[1]),1))
+
+  if (opts.eyear-opts.syear+1)%5!=0:
+    parser.error('The number of years must be a multiple of 5 (the period of the wrfout files)')
+  variables=opts.variables.split(',')
+  varinfo=cfg.VariablesInfo()
+  for var in variables:
+    if not varinfo.is_supported(var):
+      parser.error('The variable %s is not valid' %(var))
+
+  workdir=os.path.abspath(opts.workdir)
+  outfile=opts.outfile
+  if outfile is not None:
+    outfile=os.path.abspath(outfile)
+  # The postprocess reads WRF_schemes.inf from the working directory
+  os.chdir(repodir)
+  calendar=opts.no_leap and 'noleap' or 'standard'
+  pathin='%s/wrf_%sx%sx%s_%s-%s_%s%s/' %(workdir,opts.ny,opts.nx,opts.nz,opts.syear,opts.eyear,calendar,opts.with3d and '_3d' or '')
+  pathout='%s/postprocess/' %(workdir)
+  if not os.path.exists(pathin):
+    print 'Writing synthetic WRF files to %s' %(pathin)
+    tstart=time.time()
+    nfiles=synth.generate(pathin[:-1]+'.tmp',opts.syear,opts.eyear,opts.ny,opts.nx,opts.nz,
+                          no_leap=opts.no_leap,with3d=opts.with3d)
+    os.rename(pathin[:-1]+'.tmp',pathin)
+    print '  %s files written in %.1f s' %(nfiles,time.time()-tstart)
+  if os.path.exists(pathout):
+    shutil.rmtree(pathout)
+
+  options={}
+  if opts.no_leap:
+    options['GCM']='CCCMA3.1'
+  gvars=get_gvars(pathin,pathout,opts.syear,opts.eyear,options)
+  logfile='%s/benchmark.log' %(workdir)
+  print 'Running the benchmark (log in %s)' %(logfile)
+  timings=run(gvars,variables,logfile)
+
+  results={'label':opts.label,'commit':get_commit(),'date':dt.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+           'grid':[opts.ny,opts.nx,opts.nz],'years':[opts.syear,opts.eyear],'no_leap':opts.no_leap,
+           'variables':variables,'host':platform.node(),'python':platform.python_version(),
+           'numpy':np.__version__,'netCDF4':nc.__version__,'timings':timings}
+  if outfile is None:
+    outfile='%s/benchmark_%s.json' %(workdir,results['commit'])
+  json.dump(results,open(outfile,'w'),indent=1,sort_keys=True)
+  for name in sorted(timings.keys()):
+    print '%-40s %10.3f s' %(name,timings[name])
+  print 'Timings written to %s' %(outfile)
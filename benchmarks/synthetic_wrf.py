@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+"""synthetic_wrf.py
+   Writes a synthetic set of WRF outputs (wrfhrly, wrfout, wrfxtrm, wrfdly)
+   that postprocess_NARCliM.py can read. Used to benchmark the postprocessing
+   without access to the raw NARCliM archive (see run_benchmarks.py).
+
+   The files have the NARCliM names and frequencies (wrfhrly and wrfxtrm/wrfdly:
+   monthly files with hourly and daily steps; wrfout: daily files with 3-hourly
+   steps), Times, XLAT/XLONG, the static fields, the physics options used in the
+   global attributes and accumulated fields (RAINC, RAINNC...) that grow from the
+   start of the simulation. The values are random, so only the sizes and the
+   structure of the files are realistic.
+
+   Usage:
+     python benchmarks/synthetic_wrf.py -o /scratch/synthetic/ -s 1990 -e 1994 --ny 100 --nx 120
+     python benchmarks/synthetic_wrf.py -o /scratch/synthetic/ --no_leap --3d
+"""
+import netCDF4 as nc
+import numpy as np
+import datetime as dt
+import calendar as cal
+import os
+import sys
+from optparse import OptionParser
+
+# Fields written in each type of file. 3-D fields are only written when
+# requested (they dominate the size of the wrfout files).
+FIELDS = {
+  'wrfhrly': ['T2','Q2','PSFC','U10','V10','RAINC','RAINNC'],
+  'wrfout' : ['SFCEVP','SMSTOT','SST','POTEVP','SWDOWN','GLW','LH','HFX',
+              'ALBEDO','EMISS','TSK','CLDFRA','ACSNOM','SNOWC','SNOW','SNOWH',
+              'U10','V10','T2','Q2','PSFC'],
+  'wrfxtrm': ['T2MEAN','T2MIN','T2MAX','SPDUV10MAX'],
+  'wrfdly' : ['PRMAX5','PRMAX10','PRMAX20','PRMAX30','PRMAX1H',
+              'UV10MAX5','UV10MAX10','UV10MAX20','UV10MAX30','UV10MAX1H'],
+  }
+FIELDS_3D = ['T','P','PB','PH','PHB','QVAPOR','U','V']
+ACCUMULATED = ['RAINC','RAINNC','SFCEVP','POTEVP','ACSNOM']
+
+SCHEMES = {'RA_LW_PHYSICS':1,'SF_SFCLAY_PHYSICS':1,'CU_PHYSICS':1,
+           'BL_PBL_PHYSICS':1,'RA_SW_PHYSICS':1,'MP_PHYSICS':4,
+           'SF_SURFACE_PHYSICS':2}
+
+
+def get_file_dates(filet,syear,eyear,no_leap=False):
+  """ List of (file start date, list of time steps) for every file of a type
+  """
+  files=[]
+  if filet=='wrfout':
+    day=dt.datetime(syear,1,1)
+    while day.year<=eyear:
+      if not (no_leap and day.month==2 and day.day==29):
+        files.append((day,[day+dt.timedelta(hours=3*i) for i in xrange(8)]))
+      day=day+dt.timedelta(days=1)
+  else:
+    step={'wrfhrly':1,'wrfxtrm':24,'wrfdly':24}[filet]
+    for year in xrange(syear,eyear+1):
+      for month in xrange(1,13):
+        ndays=cal.monthrange(year,month)[1]
+        if no_leap and month==2 and ndays==29:
+          ndays=28
+        start=dt.datetime(year,month,1)
+        files.append((start,[start+dt.timedelta(hours=step*i) for i in xrange(ndays*24/step)]))
+  return files
+
+
+def write_wrf_file(filename,dates,fields,ny,nx,nz,tstart,rng):
+  """ Writes a single WRF-like file with the given fields and time steps
+  """
+  fout=nc.Dataset(filename,'w',format='NETCDF4_CLASSIC')
+  fout.createDimension('Time',None)
+  fout.createDimension('DateStrLen',19)
+  fout.createDimension('south_north',ny)
+  fout.createDimension('west_east',nx)
+  fout.createDimension('south_north_stag',ny+1)
+  fout.createDimension('west_east_stag',nx+1)
+  fout.createDimension('bottom_top',nz)
+  fout.createDimension('bottom_top_stag',nz+1)
+
+  times=fout.createVariable('Times','S1',('Time','DateStrLen'))
+  times[:]=nc.stringtochar(np.array([d.strftime('%Y-%m-%d_%H:%M:%S') for d in dates],dtype='S19'))
+
+  nt=len(dates)
+  lat,lon=np.meshgrid(np.linspace(-45.,-10.,ny),np.linspace(110.,155.,nx),indexing='ij')
+  for name,val in (('XLAT',lat),('XLONG',lon)):
+    var=fout.createVariable(name,'f4',('Time','south_north','west_east'))
+    var[:]=np.tile(val,(nt,1,1))
+  static={'LANDMASK':(lon>130.).astype('f4'),'SINALPHA':np.sin(np.radians(lon-135.)/10.),
+          'COSALPHA':np.cos(np.radians(lon-135.)/10.)}
+  # Accumulation rate of each grid point (larger in the north-east)
+  rate=0.05+0.1*(lat-lat.min())/(lat.max()-lat.min()+1.)+0.05*(lon-lon.min())/(lon.max()-lon.min()+1.)
+
+  # Hours since start of the run, so that accumulated fields grow monotonically
+  hours=np.asarray([(d-tstart).total_seconds()/3600. for d in dates])
+  for name in fields:
+    if name in FIELDS_3D:
+      dims,shape=['Time','bottom_top','south_north','west_east'],[nt,nz,ny,nx]
+      if name=='PH' or name=='PHB':
+        dims[1],shape[1]='bottom_top_stag',nz+1
+      if name=='U':
+        dims[3],shape[3]='west_east_stag',nx+1
+      if name=='V':
+        dims[2],shape[2]='south_north_stag',ny+1
+      var=fout.createVariable(name,'f4',dims)
+      var[:]=get_3dfield(name,shape,rng)
+      continue
+    var=fout.createVariable(name,'f4',('Time','south_north','west_east'))
+    if name in ACCUMULATED:
+      var[:]=hours[:,None,None]*rate[None,:,:]
+    elif name.startswith('T'):
+      var[:]=285.+10.*rng.random_sample((nt,ny,nx))
+    elif name=='PSFC':
+      var[:]=95000.+5000.*rng.random_sample((nt,ny,nx))
+    else:
+      var[:]=rng.random_sample((nt,ny,nx))
+  # Static fields, repeated at each time step as in WRF
+  for name in ('LANDMASK','SINALPHA','COSALPHA'):
+    var=fout.createVariable(name,'f4',('Time','south_north','west_east'))
+    var[:]=np.tile(static[name],(nt,1,1))
+
+  fout.TITLE=' OUTPUT FROM WRF V3.3 MODEL (SYNTHETIC)'
+  fout.SIMULATION_START_DATE=tstart.strftime('%Y-%m-%d_%H:%M:%S')
+  fout.DX=50000.
+  fout.DY=50000.
+  fout.CEN_LAT=-27.5
+  fout.CEN_LON=132.5
+  fout.POLE_LAT=90.
+  fout.POLE_LON=0.
+  fout.STAND_LON=132.5
+  for sch in SCHEMES.keys():
+    setattr(fout,sch,SCHEMES[sch])
+  fout.close()
+
+
+def get_3dfield(name,shape,rng):
+  """ Roughly realistic vertical profiles for the 3-D WRF fields
+  """
+  nz=shape[1]
+  eta=np.linspace(1.,0.,nz)[None,:,None,None]*np.ones(shape)
+  noise=rng.random_sample(shape)
+  if name=='PB':
+    return (100000.*eta**1.5+1000.)*np.ones(shape)
+  if name=='P':
+    return 100.*noise
+  if name=='PHB':
+    return 9.81*np.linspace(0.,16000.,nz)[None,:,None,None]*np.ones(shape)
+  if name=='PH':
+    return 10.*noise
+  if name=='T':
+    return 10.*eta+2.*noise
+  if name=='QVAPOR':
+    return 0.01*eta**3+0.0001*noise
+  return 10.*noise
+
+
+def generate(pathout,syear,eyear,ny=20,nx=30,nz=10,domain='d02',no_leap=False,filetypes=None,with3d=False,seed=0):
+  """ Writes all synthetic files to pathout. Returns the number of files written
+  """
+  if not os.path.exists(pathout):
+    os.makedirs(pathout)
+  rng=np.random.RandomState(seed)
+  tstart=dt.datetime(syear,1,1)
+  nfiles=0
+  if filetypes==None:
+    filetypes=FIELDS.keys()
+  for filet in filetypes:
+    fields=FIELDS[filet]
+    if filet=='wrfout' and with3d:
+      fields=fields+FIELDS_3D
+    # One more year, so that accumulated variables can be closed at the end of each period
+    for start,dates in get_file_dates(filet,syear,eyear+1,no_leap):
+      if start.year>eyear and (start.month!=1 or start.day!=1):
+        continue
+      filename='%s/%s_%s_%s' %(pathout,filet,domain,start.strftime('%Y-%m-%d_%H:%M:%S'))
+      write_wrf_file(filename,dates,fields,ny,nx,nz,tstart,rng)
+      nfiles=nfiles+1
+  return nfiles
+
+
+if __name__ == "__main__":
+  parser = OptionParser()
+  parser.add_option("-o", "--pathout", dest="pathout", help="output directory", metavar="PATH")
+  parser.add_option("-s", "--syear", dest="syear", type="int", default=1990)
+  parser.add_option("-e", "--eyear", dest="eyear", type="int", default=1994)
+  parser.add_option("--ny", dest="ny", type="int", default=20)
+  parser.add_option("--nx", dest="nx", type="int", default=30)
+  parser.add_option("--nz", dest="nz", type="int", default=10)
+  parser.add_option("-d", "--domain", dest="domain", default='d02')
+  parser.add_option("--no_leap", dest="no_leap", action="store_true", default=False)
+  parser.add_option("--3d", dest="with3d", action="store_true", default=False)
+  (opts, args) = parser.parse_args()
+  if opts.pathout is None:
+    parser.error('The output directory (-o) is required')
+  n=generate(opts.pathout,opts.syear,opts.eyear,opts.ny,opts.nx,opts.nz,opts.domain,opts.no_leap,with3d=opts.with3d)
+  print 'Written %s files in %s' %(n,opts.pathout)
@@ -1,26 +1,42 @@
 #!/usr/bin/env python
-## 
-# python script to launch the ncl script calculate_mslp_arguments.ncl that extract 
+##
+# python script to launch the ncl script calculate_mslp_arguments.ncl that extract
 # mean sea level pressure from wrfout files using command line
 # arguments.
-# This script goes through all NARCliM simulations. If the mslp field already 
+# This script goes through all NARCliM simulations. If the mslp field already
 # exists then it goes to the next one.
 #
-# The way the ncl script is called is better explained here: 
+# The way the ncl script is called is better explained here:
 #    https://wiki.c2sm.ethz.ch/Wiki/VisNCLBasicExamples
 #
 # Author: Alejandro Di Luca
 # Created: 30/04/2014
+#
+# Modified: the months of all simulations are listed first (work units) and run
+# by a pool of -n processes. Each finished unit is added to a manifest
+# (outdir_root/mslp_manifest.txt, one line per unit with its status and duration),
+# so a new run skips the units that are already done. Output files that are not in
+# the manifest (e.g. written before it existed) are only skipped if they can be read
+# and have all the time steps of their month.
+#
+# Usage:
+#   python launch_ncl.py -n 8
+#   python launch_ncl.py -n 8 -g MIROC3.2,ECHAM5 -r R1 --dry-run
+#
+# NOTE: psl can also be computed directly by the postprocess (compute_mslp.py).
+# It is read and computed in chunks of wrfout files together with the pressure-level
+# variables (see process_chunked), in a pass separate from the 2-D wrfout variables.
 
-from netCDF4 import Dataset as ncdf
-from netCDF4 import num2date, date2num
 import numpy as np
-import glob
+import netCDF4 as nc
+import calendar as cal
 import os
-import copy
-import sys		
+import sys
+import time
+import subprocess
+import multiprocessing
+from optparse import OptionParser
 import ccrc_utils as cu
-import postprocess_modules as pm
 
 # Loop parameters
 domain='d02'
@@ -28,27 +44,146 @@ GCM_names=['MIROC3.2','CCCMA3.1','ECHAM5','CSIRO-MK3.0']
 GCM_out={'MIROC3.2':'MIROC3.2','CCCMA3.1':'WRF_CCCMA','ECHAM5':'WRF_ECHAM5','CSIRO-MK3.0':'WRF_MK30'}
 RCM_names=['R1','R2','R3']
 Periods=['1990-2010','2060-2080']
-runcommand='./runncl.sh calculate_mslp_arguments.ncl '
-
-for gind,gname in enumerate(GCM_names):
-    for rind,rname in enumerate(RCM_names):
-        for pers,pername in enumerate(Periods):
-            index_rg=gind*3+rind
-            
-            indir=cu.get_raw_location(gname,rname,pername)[0]
-            print ' -->  INPUT DIRECTORY: ',indir
-            
-            outdir = "/srv/ccrc/data28/z3444417/Data/WRF/"+gname+"/"+rname+"/"+pername+"/psl/raw/"+domain+"/"
-            os.system('mkdir -p '+outdir)
-            print '  --> OUTPUT DIRECTORY: ',outdir,'\n'
-            for year in np.arange(int(pername.split('-')[0]),int(pername.split('-')[1])):
-            	for month in np.arange(1,13):
-			month_name=str(month)
-	    		if month<10:
-				month_name='0'+str(month)
-			file_out=outdir+'WRF_mslp_'+rname+'_'+domain+'_'+str(year)+'-'+month_name+'.nc'
-
-            		filewrite=pm.checkfile(file_out,False)
-            		if filewrite==True:
-                		os.system(runcommand+indir+' '+outdir+' '+str(year)+' '+str(month))
-	sys.exit(0)
+outdir_root='/srv/ccrc/data28/z3444417/Data/WRF/'
+runcommand=['./runncl.sh','calculate_mslp_arguments.ncl']
+scriptdir=os.path.dirname(os.path.abspath(__file__))
+# Time steps per day of the wrfout files (3-hourly)
+steps_per_day=8
+
+
+# *************************************************************************************
+def get_units(gcms,rcms,periods):
+  """ List of all work units (one per simulation and month) as dictionaries
+  """
+  units=[]
+  for gname in gcms:
+    for rname in rcms:
+      for pername in periods:
+        indir=cu.get_raw_location(gname,rname,pername)[0]
+        outdir="%s%s/%s/%s/psl/raw/%s/" %(outdir_root,gname,rname,pername,domain)
+        for year in np.arange(int(pername.split('-')[0]),int(pername.split('-')[1])):
+          for month in np.arange(1,13):
+            file_out='%sWRF_mslp_%s_%s_%s-%02d.nc' %(outdir,rname,domain,year,month)
+            units.append({'GCM':gname,'RCM':rname,'period':pername,'year':int(year),'month':int(month),
+                          'indir':indir,'outdir':outdir,'file_out':file_out})
+  return units
+
+
+# *************************************************************************************
+def read_manifest(filename):
+  """ Output files of the units completed in previous runs
+  """
+  done=set()
+  if os.path.exists(filename):
+    for line in open(filename,'r').readlines():
+      entry=line.split()
+      if len(entry)>=3 and entry[1]=='OK':
+        done.add(entry[0])
+  return done
+
+
+# *************************************************************************************
+def is_complete(unit):
+  """ Whether the output file of a unit can be read and has the SLP of all the time
+  steps of its month (the CCCMA3.1 simulations have no leap days)
+  """
+  ndays=cal.monthrange(unit['year'],unit['month'])[1]
+  if unit['GCM']=='CCCMA3.1' and unit['month']==2:
+    ndays=28
+  try:
+    fin=nc.Dataset(unit['file_out'],'r')
+    try:
+      return fin.variables['SLP'].shape[0]==ndays*steps_per_day
+    finally:
+      fin.close()
+  except (IOError,RuntimeError,KeyError):
+    return False
+
+
+# *************************************************************************************
+def run_unit(unit):
+  """ Runs the ncl script for one month. Returns (unit, status, duration in seconds)
+  """
+  if not os.path.exists(unit['outdir']):
+    try:
+      os.makedirs(unit['outdir'])
+    except OSError:
+      # Created at the same time by another process
+      pass
+  tstart=time.time()
+  logname='%s.log' %(unit['file_out'][:-3])
+  logfile=open(logname,'w')
+  status=subprocess.call(runcommand+[unit['indir'],unit['outdir'],str(unit['year']),str(unit['month'])],
+                         cwd=scriptdir,stdout=logfile,stderr=subprocess.STDOUT)
+  logfile.close()
+  if status==0 and os.path.exists(unit['file_out']):
+    status='OK'
+  else:
+    status='FAILED(%s)' %(status)
+    # A partial output would be taken as done by the next run
+    if os.path.exists(unit['file_out']):
+      os.remove(unit['file_out'])
+  return unit,status,time.time()-tstart
+
+
+# *************************************************************************************
+if __name__=='__main__':
+
+  parser = OptionParser()
+  parser.add_option("-n", "--nprocs", dest="nprocs", type="int", default=4,
+  help="number of months processed at the same time (4 by default)", metavar="N")
+  parser.add_option("-g", "--gcms", dest="gcms", default=','.join(GCM_names),
+  help="comma separated list of GCMs (all by default)", metavar="GCMS")
+  parser.add_option("-r", "--rcms", dest="rcms", default=','.join(RCM_names),
+  help="comma separated list of RCMs (all by default)", metavar="RCMS")
+  parser.add_option("-p", "--periods", dest="periods", default=','.join(Periods),
+  help="comma separated list of periods (all by default)", metavar="PERIODS")
+  parser.add_option("-m", "--manifest", dest="manifest", default='%smslp_manifest.txt' %(outdir_root),
+  help="file with the completed units", metavar="FILE")
+  parser.add_option("--dry-run", dest="dryrun", action="store_true", default=False,
+  help="only print the units that would be run")
+  (opts, args) = parser.parse_args()
+
+  units=get_units(opts.gcms.split(','),opts.rcms.split(','),opts.periods.split(','))
+  done=read_manifest(opts.manifest)
+  # Units done before the manifest existed are skipped too, if their output is complete
+  todo=[]
+  nincomplete=0
+  for unit in units:
+    if unit['file_out'] in done:
+      continue
+    if os.path.exists(unit['file_out']):
+      if is_complete(unit):
+        continue
+      nincomplete=nincomplete+1
+    todo.append(unit)
+  print ' -->  %s months, %s already done, %s to run with %s processes (%s with an incomplete output)' %(len(units),
+        len(units)-len(todo),len(todo),opts.nprocs,nincomplete)
+
+  if opts.dryrun:
+    for unit in todo:
+      print '      %s' %(unit['file_out'])
+    sys.exit(0)
+
+  nfailed=0
+  tstart=time.time()
+  pool=multiprocessing.Pool(opts.nprocs)
+  if not os.path.exists(os.path.dirname(os.path.abspath(opts.manifest))):
+    os.makedirs(os.path.dirname(os.path.abspath(opts.manifest)))
+  manifest=open(opts.manifest,'a')
+  for nn,(unit,status,duration) in enumerate(pool.imap_unordered(run_unit,todo)):
+    manifest.write('%s %s %.1f\n' %(unit['file_out'],status,duration))
+    manifest.flush()
+    if status!='OK':
+      nfailed=nfailed+1
+    elapsed=time.time()-tstart
+    print ' [%s/%s] %s %s-%02d %s: %s (%.1f s, %.1f min remaining)' %(nn+1,len(todo),unit['GCM'],unit['year'],
+          unit['month'],unit['RCM'],status,duration,elapsed/(nn+1)*(len(todo)-nn-1)/60.)
+    sys.stdout.flush()
+  pool.close()
+  pool.join()
+  manifest.close()
+
+  print ' -->  FINISHED: %s months run, %s failed' %(len(todo),nfailed)
+  if nfailed>0:
+    sys.exit(1)
@@ -0,0 +1,249 @@
+# ======================================================================
+# PURPOSE
+# =========
+# To calculate a derived variable from two bias-corrected NARCliM
+# variables (e.g. tasmean_bc from tasminmean_bc and tasmaxmean_bc, or
+# the diurnal temperature range dtr_bc) and output the result into a
+# similarly formatted NetCDF file, for single file pairs
+# (combine_files) or for a whole directory structure of
+# bias-corrected files (combine_all).
+
+# The rules to combine the variables are in RULES: the names of the
+# two input variables, the function that combines them and the
+# comments written to the output file. New derived variables only
+# need a new rule.
+
+# The files are read and written in blocks of time steps, so the
+# memory needed does not depend on the length of the files, and
+# combine_all processes several file pairs at a time (jobs). Output
+# files that are newer than both of their input files are not
+# computed again.
+
+# STATUS
+# ========
+# Working
+
+# NOTE! As in make_tasmean_bc, the output data is float64 and
+# regardless of the initial _FillValue, it is filled with 1E+20
+# (also where any of the inputs is NaN).
+
+# INPUT
+# =======
+# rule    => Name of the derived variable (a key of RULES). String.
+# file1   => NARCliM NetCDF file with the first input variable. String.
+# file2   => NARCliM NetCDF file with the second input variable. String.
+# outfile => NetCDF file where to output the result. String ending
+#            with "*.nc".
+# author  => File's author (for global attributes). String.
+# email   => Author's email (for global attributes). String.
+
+# OUTPUT
+# ========
+# outfile => NARCliM NetCDF4 file. Global and variable attributes are
+# copied from file1, with the author, contact, history and comments of
+# the rule.
+
+# HISTORY
+# ========
+# Generalised from make_tasmean_bc (Roman Olson, UNSW) to any rule
+# combining two bias-corrected variables, with block-wise reading and
+# writing and parallel processing of the file pairs.
+# ======================================================================
+import os
+import glob
+from datetime import datetime
+import numpy as np
+import numpy.ma as ma
+import netCDF4 as ncdf
+
+FILLVALUE = 1.0E20
+
+RULES = {
+   "tasmean_bc": {
+      "inputs": ("tasminmean_bc", "tasmaxmean_bc"),
+      "combine": lambda tmin, tmax: (tmin + tmax)/2.0,
+      "history": "Created by averaging tasminmean_bc (monthly mean minimum\
+ temperature) and tasmaxmean_bc (monthly mean maximum temperature).",
+      "comment": "tasmean_bc is not an original NARCliM variable. It is\
+ calculated as an average of tasminmean_bc and tasmaxmean_bc variables",
+      "global_history": "created mean temperature from tasminmean_bc and\
+ tasmaxmean_bc."},
+   "dtr_bc": {
+      "inputs": ("tasminmean_bc", "tasmaxmean_bc"),
+      "combine": lambda tmin, tmax: tmax - tmin,
+      "history": "Created by subtracting tasminmean_bc (monthly mean minimum\
+ temperature) from tasmaxmean_bc (monthly mean maximum temperature).",
+      "comment": "dtr_bc is not an original NARCliM variable. It is the\
+ diurnal temperature range, calculated as the difference between\
+ tasmaxmean_bc and tasminmean_bc variables",
+      "global_history": "created diurnal temperature range from\
+ tasminmean_bc and tasmaxmean_bc."},
+}
+
+
+# ======================================================================
+# Number of time steps read and written at once, so that the blocks of
+# the two inputs and the result take about blockbytes (float64)
+# ======================================================================
+def get_time_block(shape, blockbytes=64*1024*1024):
+   return max(1, int(blockbytes/(3*8*int(np.prod(shape[1:])))))
+
+
+# ======================================================================
+# Whether outfile exists and is newer than all its input files
+# ======================================================================
+def is_uptodate(outfile, infiles):
+   if not os.path.exists(outfile):
+      return False
+   outtime = os.path.getmtime(outfile)
+   return all([os.path.getmtime(infile) <= outtime for infile in infiles])
+
+
+# ======================================================================
+# Copies the coordinate variable name of fin to fout, filled with
+# FILLVALUE as the files written by make_tasmean_bc
+# ======================================================================
+def copy_coordinate(fin, fout, name, skip=()):
+   varin = fin.variables[name]
+   fill_value = None
+   if np.issubdtype(varin.dtype, np.floating):
+      fill_value = FILLVALUE
+   varout = fout.createVariable(name, varin.dtype, varin.dimensions,
+      fill_value=fill_value)
+   for att in varin.ncattrs():
+      if att not in ("_FillValue",) + tuple(skip):
+         varout.setncattr(att, varin.getncattr(att))
+   varout[:] = varin[:]
+
+
+# ======================================================================
+# Computes the derived variable rule from file1 and file2 and writes
+# it to outfile (see the header of this file)
+# ======================================================================
+def combine_files(rule, file1, file2, outfile, author, email,
+   blockbytes=64*1024*1024):
+
+   info = RULES[rule]
+   var1, var2 = info["inputs"]
+   fin1 = ncdf.Dataset(file1)
+   fin2 = ncdf.Dataset(file2)
+   try:
+      # CHECKS
+      if (np.any(fin1.variables["lat"][:] != fin2.variables["lat"][:])):
+         raise ValueError, "Latitudes don't match"
+      if (np.any(fin1.variables["lon"][:] != fin2.variables["lon"][:])):
+         raise ValueError, "Longitudes don't match"
+      if (fin1.variables["time"].shape != fin2.variables["time"].shape or
+          np.any(fin1.variables["time"][:] != fin2.variables["time"][:])):
+         raise ValueError, "Times don't match"
+      ncvar1 = fin1.variables[var1]
+      ncvar2 = fin2.variables[var2]
+
+      # WRITE TO A TEMPORARY FILE, RENAMED WHEN IT IS COMPLETE
+      fout = ncdf.Dataset(outfile + ".part", "w", format=fin1.file_format)
+      try:
+         for dim in ncvar1.dimensions + fin1.variables["lat"].dimensions:
+            if dim not in fout.dimensions:
+               size = len(fin1.dimensions[dim])
+               if fin1.dimensions[dim].isunlimited():
+                  size = None
+               fout.createDimension(dim, size)
+
+         # Globals
+         glob_atts = fin1.__dict__.copy()
+         glob_atts["author"] = author
+         glob_atts["contact"] = email
+         glob_atts["history"] = "\n On " + datetime.utcnow().isoformat(' ')\
+ + " UTC " + info["global_history"]
+         glob_atts["comments"] = info["comment"]
+         fout.setncatts(glob_atts)
+
+         # Coordinates
+         copy_coordinate(fin1, fout, "lat")
+         copy_coordinate(fin1, fout, "lon")
+         copy_coordinate(fin1, fout, "time", skip=("bounds",))
+
+         # Derived variable
+         varout = fout.createVariable(rule, np.float64, ncvar1.dimensions,
+            fill_value=FILLVALUE)
+         for att in ncvar1.ncattrs():
+            if att != "_FillValue":
+               varout.setncattr(att, ncvar1.getncattr(att))
+         varout.setncattr("history", info["history"])
+         varout.setncattr("comment", info["comment"])
+
+         nt = ncvar1.shape[0]
+         ntblock = get_time_block(ncvar1.shape, blockbytes)
+         for it in xrange(0, nt, ntblock):
+            itend = min(it+ntblock, nt)
+            result = info["combine"](
+               ma.asarray(ncvar1[it:itend], dtype=np.float64),
+               ma.asarray(ncvar2[it:itend], dtype=np.float64))
+            varout[it:itend] = ma.masked_where(
+               np.isnan(ma.filled(result, 0.)) | ma.getmaskarray(result),
+               result)
+      finally:
+         fout.close()
+   finally:
+      fin1.close()
+      fin2.close()
+   os.rename(outfile + ".part", outfile)
+
+
+# ======================================================================
+# Derived variable rule of all pairs of decadal monthly files in
+# inputdir (a NARCliM structure [GCM]/[RCM]/[period]/[d01/d02]),
+# written to the same structure in outputdir (created if needed), as
+# make_tasmean_bc_all.
+# jobs pairs are computed at a time. Outputs newer than their inputs
+# are skipped unless overwrite is True. Returns the files written.
+# ======================================================================
+def combine_all(rule, inputdir, outputdir, author, email, jobs=4,
+   overwrite=False):
+
+   from joblib import Parallel, delayed
+   var1, var2 = RULES[rule]["inputs"]
+   tasks = []
+   nuptodate = 0
+   # Note that dirpath does not end with a slash
+   for dirpath, dirnames, filenames in os.walk(inputdir):
+
+      # Only look into bottom directories ending in d01 or d02
+      if (dirpath.endswith(("d01", "d02"))):
+
+         reldirpath = os.path.relpath(dirpath, inputdir)
+         files1 = sorted(glob.glob(dirpath + "/CCRC_NARCliM_MON_*_" + var1
+            + ".nc"))
+         files2 = sorted(glob.glob(dirpath + "/CCRC_NARCliM_MON_*_" + var2
+            + ".nc"))
+         if (len(files1) != len(files2)):
+            raise ValueError, "Different number of %s and %s files in %s"\
+ % (var1, var2, dirpath)
+
+         for file1, file2 in zip(files1, files2):
+            base1 = os.path.basename(file1)
+            base2 = os.path.basename(file2)
+
+            # Check if files cover the same period
+            if (base1[:26] != base2[:26]):
+               raise ValueError, "%s and %s files have different times"\
+ % (var1, var2)
+
+            outfile = os.path.join(outputdir, reldirpath,
+               base1[:26] + "_" + rule + ".nc")
+            if overwrite or not is_uptodate(outfile, [file1, file2]):
+               tasks.append((file1, file2, outfile))
+            else:
+               nuptodate = nuptodate + 1
+
+   print "%s: %s files to write, %s up to date" % (rule, len(tasks),
+      nuptodate)
+   # Output directories, created before the jobs that write into them
+   for outdir in sorted(set([os.path.dirname(outfile)
+      for file1, file2, outfile in tasks])):
+      if not os.path.exists(outdir):
+         os.makedirs(outdir)
+   Parallel(n_jobs=max(1, min(jobs, len(tasks))), verbose=5)(
+      delayed(combine_files)(rule, file1, file2, outfile, author, email)
+      for file1, file2, outfile in tasks)
+   return [outfile for file1, file2, outfile in tasks]
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+"""compute_mslp.py
+   Mean sea level pressure from WRF 3-D fields, with the same algorithm as
+   wrf_user_getvar(f,"slp") in NCL (DCOMPUTESEAPRS in wrf_user.f), which was
+   used by calculate_mslp/calculate_mslp_arguments.ncl.
+
+   The computation is vectorised over time and grid points: all arrays are
+   (time, bottom_top, south_north, west_east) and no loop over columns is done.
+"""
+import numpy as np
+import postprocess_modules as pm
+
+# Constants of DCOMPUTESEAPRS (R=287.04 and G=9.81 of NCL are those of
+# postprocess_modules.const)
+PCONST=10000.     # Pressure above the surface where the temperature is extrapolated from [Pa]
+GAMMA=0.0065      # Standard lapse rate [K m-1]
+TC=273.16+17.5    # Critical temperature of the "ridiculous MM5 test" [K]
+
+
+def compute_temperature(theta_pert,p):
+    """Temperature [K] from the perturbation potential temperature (T) and pressure (P+PB) [Pa]
+    """
+    return (theta_pert+300.)*(p/pm.const.p1000mb)**pm.const.rcp
+
+
+def compute_height(ph,phb):
+    """Geopotential height [m] from the geopotential (PH+PHB), unstaggered to mass
+    levels by the read layer (see read_wrfvar in postprocess_modules.py)
+    """
+    return (ph+phb)/pm.const.g
+
+
+def compute_seaprs(z,t,p,q):
+    """Sea level pressure [Pa]
+    z: geopotential height at mass levels [m]
+    t: temperature [K]
+    p: pressure [Pa]
+    q: water vapor mixing ratio [kg kg-1]
+    ---
+    slp: sea level pressure [Pa] (time, south_north, west_east)
+
+    The temperature at PCONST above the surface is interpolated between the two
+    levels around it, and extrapolated to the surface and to sea level with the
+    standard lapse rate. The steps reproduce DCOMPUTESEAPRS as it is, so that psl
+    is the same as the NCL product it replaces, including its quirks:
+      - the interpolation weight is the product of the logarithms
+        log(p_at_pconst/phi)*log(plo/phi), not their ratio
+      - the upper level is at most the level below the model top (MIN(KLO+1,NZ-1)
+        with 1-based indices)
+      - the "ridiculous MM5 test" replaces the sea level temperature of every
+        column: TC if the sea level is warmer than TC and the surface is not,
+        TC-0.005*(t_surf-TC)**2 otherwise
+    """
+    nt,nz,ny,nx=p.shape
+    psfc=p[:,0,:,:]
+    p_at_pconst=psfc-PCONST
+
+    # First level above PCONST from the surface, and the levels around it
+    above=p<(p_at_pconst[:,np.newaxis,:,:])
+    if not np.all(np.any(above,axis=1)):
+        raise ValueError('compute_seaprs: some columns do not reach %s Pa above the surface' %(PCONST))
+    level=np.argmax(above,axis=1)
+    klo=np.maximum(level-1,0)
+    khi=np.minimum(klo+1,nz-2)
+    if np.any(klo==khi):
+        raise ValueError('compute_seaprs: trapping levels are the same (not enough vertical levels)')
+
+    it,iy,ix=np.ogrid[:nt,:ny,:nx]
+    plo=p[it,klo,iy,ix]
+    phi=p[it,khi,iy,ix]
+    tlo=t[it,klo,iy,ix]*(1.+0.608*q[it,klo,iy,ix])
+    thi=t[it,khi,iy,ix]*(1.+0.608*q[it,khi,iy,ix])
+    zlo=z[it,klo,iy,ix]
+    zhi=z[it,khi,iy,ix]
+
+    weight=np.log(p_at_pconst/phi)*np.log(plo/phi)
+    t_at_pconst=thi-(thi-tlo)*weight
+    z_at_pconst=zhi-(zhi-zlo)*weight
+
+    t_surf=t_at_pconst*(psfc/p_at_pconst)**(GAMMA*pm.const.Rd/pm.const.g)
+    t_sea_level=t_at_pconst+GAMMA*z_at_pconst
+
+    # "Ridiculous MM5 test" of DCOMPUTESEAPRS (applied to all columns)
+    t_sea_level=np.where((t_sea_level>=TC)&(t_surf<=TC),TC,TC-0.005*(t_surf-TC)**2)
+
+    slp=psfc*np.exp((2.*pm.const.g*z[:,0,:,:])/(pm.const.Rd*(t_sea_level+t_surf)))
+    return slp
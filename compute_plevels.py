@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+"""compute_plevels.py
+   Vertical interpolation of WRF 3-D fields to pressure levels.
+
+   Fields are (time, bottom_top, south_north, west_east), with pressure decreasing
+   with the level index. The interpolation is linear in log(p) and vectorised over
+   time and grid points: for each target level only the two model levels around it
+   are gathered from the 3-D arrays. Points where the level is below the surface or above
+   the model top are set to missing values.
+"""
+import numpy as np
+import postprocess_modules as pm
+import compute_mslp as mslp
+
+
+def interp_plevel(field,p,plev):
+    """Interpolates field to the pressure level plev [Pa]
+    field: 3-D field at mass levels (time, bottom_top, south_north, west_east)
+    p: pressure at the same points [Pa]
+    plev: target pressure [Pa]
+    ---
+    out: masked array (time, south_north, west_east), masked below ground and above the top
+    """
+    nt,nz,ny,nx=p.shape
+    # Number of levels with pressure higher than plev: the level below plev is nbelow-1
+    nbelow=np.sum(p>plev,axis=1)
+    valid=(nbelow>0)&(nbelow<nz)
+    klo=np.clip(nbelow-1,0,nz-2)
+    khi=klo+1
+
+    it,iy,ix=np.ogrid[:nt,:ny,:nx]
+    plo=p[it,klo,iy,ix]
+    phi=p[it,khi,iy,ix]
+    flo=field[it,klo,iy,ix]
+    fhi=field[it,khi,iy,ix]
+    weight=np.log(plev/plo)/np.log(phi/plo)
+    out=flo+(fhi-flo)*weight
+    return np.ma.masked_where(np.logical_not(valid),out)
+
+
+def compute_input(name,varvals,gvars):
+    """Field at mass levels used for each pressure-level variable (the WRF
+    fields are already unstaggered by the read layer, see read_wrfvar)
+    ta: air temperature [K]
+    zg: geopotential height [m]
+    ua, va: earth-relative eastward and northward wind [m s-1]
+    hus: specific humidity [kg kg-1]
+    """
+    if name=='ta':
+        p=varvals['P'][:]+varvals['PB'][:]
+        return mslp.compute_temperature(varvals['T'][:],p)
+    if name=='zg':
+        return mslp.compute_height(varvals['PH'][:],varvals['PHB'][:])
+    if name=='hus':
+        q=varvals['QVAPOR'][:]
+        return q/(1.+q)
+    if name in ['ua','va']:
+        u=varvals['U'][:]
+        v=varvals['V'][:]
+        sina=pm.read_static(gvars,'SINALPHA')[np.newaxis,np.newaxis,:,:]
+        cosa=pm.read_static(gvars,'COSALPHA')[np.newaxis,np.newaxis,:,:]
+        if name=='ua':
+            return u*cosa-v*sina
+        return v*cosa+u*sina
+    raise ValueError('Unknown pressure level variable %s' %(name))
@@ -26,7 +26,16 @@ def compute_daily(var,time,stat):
   sdate=time[0].date()
   stime=dt.datetime(sdate.year,sdate.month,sdate.day,12,0,0)
   dtime=[stime+dt.timedelta(days=x) for x in xrange(ndays)]
-  nsteps=len(time)/ndays
+  dvar=compute_daily_steps(var,ndays,stat)
+  return dvar,dtime
+
+def compute_daily_steps(var,ndays,stat):
+  """Daily statistic stat of var, which has ndays days of the same number of time
+     steps (the statistics are the same as compute_daily, without the time axis)
+  """
+  if stat not in ['acc', 'mean','min','max']:
+    sys.exit("ERROR the requested daily statistic %s does not exist. Please choose between 'acc', 'mean', 'min' or 'max'" %(stat))
+  nsteps=var.shape[0]/ndays
   #Remove degenerated dimensions
   var=np.squeeze(var)
   #In the reshape, keep right order for the last two dimensions (lat,lon)
@@ -40,7 +49,7 @@ def compute_daily(var,time,stat):
   elif stat == 'min':
       dvar=np.ma.min(var_r,axis=0)
 
-  return dvar,dtime
+  return dvar
     
 def compute_monthly(var,time,stat):
   """Method to compute monthly statistics
@@ -62,9 +71,6 @@ def compute_monthly(var,time,stat):
   months=years*12+climmonths
   
 
-  var=np.squeeze(var)
-  mvar=np.ma.ones((max(months),)+var.shape[1:],dtype=np.float64)*pm.const.missingval
-
   #Calculating the middle of each month. Data is provided in the mid point between the time_bounds
   mtime=[0]*max(months)
   for mo in xrange(max(months)):
@@ -72,6 +78,24 @@ def compute_monthly(var,time,stat):
     tdiference=(time_m[-1]-time_m[0]).total_seconds()/2
     mtime[mo]=time_m[0]+dt.timedelta(seconds=tdiference)
 
+  mvar=compute_monthly_steps(var,months,stat)
+
+  return mvar,mtime
+
+
+def compute_monthly_steps(var,months,stat):
+  """Monthly statistic stat of var, whose time steps are in the months (1 for the
+     first month) of the array months (the statistics are the same as
+     compute_monthly, without the time axis). Months without time steps are
+     missing values.
+  """
+  if stat not in ['acc', 'mean','min','max', 'minmean', 'maxmean']:
+    sys.exit("ERROR the requested monthly statistic %s does not exist. Please choose between 'acc', 'mean', 'min' or 'max'" %(stat))
+  if len(months)!=var.shape[0]:
+    sys.exit('ERROR in compute_monthly_steps: The lenght of months does not correspond to var first dimension')
+
+  var=np.squeeze(var)
+  mvar=np.ma.ones((max(months),)+var.shape[1:],dtype=np.float64)*pm.const.missingval
 
   if stat == 'acc':
     for mo in xrange(max(months)):
@@ -93,9 +117,4 @@ def compute_monthly(var,time,stat):
       for mo in xrange(max(months)):
           mvar[mo,:,:]=np.ma.mean(var[months==mo+1,:,:],axis=0)
 
-
-  return mvar,mtime
-
-
-            
-        
+  return mvar
@@ -8,6 +8,8 @@ import numpy as np
 import datetime as dt
 import sys
 import postprocess_modules as pm
+import compute_mslp as mslp
+import compute_plevels as cplev
 
 def compute_tas(varvals,time,gvars):
     """Method to compute 2-m temperature
@@ -226,10 +228,8 @@ def compute_wss(varvals,time,gvars):
     tseconds=round(((time[-1]-time[0]).total_seconds()/(len(time)-1)))
     atts=pm.get_varatt(sn="air_velocity",ln="Surface wind speed",un="m s-1",ts="time: point values %s seconds" %(tseconds),hg="10 m")
     
-    #Winds need to be unstagged    
-    #Wu10_unstagged=0.5*(u10[:,:,:-1]+u10[:,:,1:])
-    #Wv10_unstagged=0.5*(v10[:,:-1,:]+v10[:,1:,:])
-    
+    # U10 and V10 are at mass points (only 3-D U and V are staggered; they are
+    # unstaggered when they are read, see read_wrfvar)
     wss=(u10**2+v10**2)**0.5
     
     return wss,atts
@@ -250,8 +250,6 @@ def compute_nonrotuas(varvals,time,gvars):
     tseconds=round(((time[-1]-time[0]).total_seconds()/(len(time)-1)))      
     atts=pm.get_varatt(sn="eastward_wind",ln="Eastward near-surface wind (not rotated)",un="m s-1",ts="time: point values %s seconds" %(tseconds),hg="10 m")    
     
-    # Zonal wind unstagged
-    # uas=0.5*(u10[:,:,:-1]+u10[:,:,1:])
     uas = u10
 
     return uas,atts
@@ -273,8 +271,6 @@ def compute_nonrotvas(varvals,time,gvars):
     tseconds=round(((time[-1]-time[0]).total_seconds()/(len(time)-1)))
     atts=pm.get_varatt(sn="northward_wind",ln="Northward near-surface wind (not rotated)",un="m s-1",ts="time: point values %s seconds" %(tseconds),hg="10 m")    
 
-    # Zonal wind unstagged
-    # vas=0.5*(v10[:,:-1,:]+v10[:,1:,:])
     vas = v10
 
     return vas,atts
@@ -295,9 +291,8 @@ def compute_uas(varvals,time,gvars):
     if (len(time)!=u10.shape[0]) or (len(time)!=v10.shape[0]):
         sys.exit('ERROR in compute_vas: The lenght of time variable does not correspond to U10 or V10 first dimension')
         
-    fileref=nc.Dataset(gvars.fileref_att,'r')
-    sina=fileref.variables['SINALPHA'][:]
-    cosa=fileref.variables['COSALPHA'][:]
+    sina=pm.read_static(gvars,'SINALPHA')
+    cosa=pm.read_static(gvars,'COSALPHA')
     sina_all=np.tile(sina, (len(time),1,1)) 
     cosa_all=np.tile(cosa, (len(time),1,1))
     
@@ -325,9 +320,8 @@ def compute_vas(varvals,time,gvars):
     if (len(time)!=u10.shape[0]) or (len(time)!=v10.shape[0]):
         sys.exit('ERROR in compute_vas: The lenght of time variable does not correspond to U10 or V10 first dimension')
     
-    fileref=nc.Dataset(gvars.fileref_att,'r')
-    sina=fileref.variables['SINALPHA'][:]
-    cosa=fileref.variables['COSALPHA'][:]
+    sina=pm.read_static(gvars,'SINALPHA')
+    cosa=pm.read_static(gvars,'COSALPHA')
     sina_all=np.tile(sina, (len(time),1,1)) 
     cosa_all=np.tile(cosa, (len(time),1,1)) 
     
@@ -379,10 +373,7 @@ def compute_mrso(varvals,time,gvars):
     """
     smstot=varvals['SMSTOT'][:]
     smstot=np.ma.masked_equal(smstot,pm.const.missingval)
-    filemask=nc.Dataset(gvars.fileref_att,'r')
-    mask=filemask.variables['LANDMASK'][:]
-
-    filemask.close()
+    mask=pm.read_static(gvars,'LANDMASK')
 
     if len(time)!=smstot.shape[0]:
         sys.exit('ERROR in compute_mrso: The lenght of time variable does not correspond to var first dimension')
@@ -404,10 +395,7 @@ def compute_sst(varvals,time,gvars):
     """
     sst_in=varvals['SST'][:]
     sst_in=np.ma.masked_equal(sst_in,pm.const.missingval)
-    filemask=nc.Dataset(gvars.fileref_att,'r')
-    mask=filemask.variables['LANDMASK'][:]
-
-    filemask.close()
+    mask=pm.read_static(gvars,'LANDMASK')
 
     if len(time)!=sst_in.shape[0]:
         sys.exit('ERROR in compute_sst: The lenght of time variable does not correspond to var first dimension')
@@ -420,6 +408,33 @@ def compute_sst(varvals,time,gvars):
 
     return sst_out,atts
     
+def compute_psl(varvals,time,gvars):
+    """Method to compute mean sea level pressure (as wrf_user_getvar "slp" in NCL, see compute_mslp.py)
+    t: perturbation potential temperature T from wrf files [K]
+    p, pb: perturbation and base pressure P and PB [Pa]
+    ph, phb: perturbation and base geopotential PH and PHB (unstaggered to mass levels) [m2 s-2]
+    qvapor: water vapor mixing ratio QVAPOR [kg kg-1]
+    time: list of times corresponding to the 1st dimension
+    ---
+    psl: mean sea level pressure [Pa]
+    atts: attributes of the output variable to be used in the output netcdf
+    """
+    if len(time)!=varvals['T'].shape[0]:
+        sys.exit('ERROR in compute_psl: The lenght of time variable does not correspond to var first dimension')
+
+    tseconds=round(((time[-1]-time[0]).total_seconds()/(len(time)-1)))
+    atts=pm.get_varatt(sn="air_pressure_at_mean_sea_level",ln="Sea Level Pressure",un="Pa",ts="time: point values %s seconds" %(tseconds))
+
+    p=varvals['P'][:]+varvals['PB'][:]
+    t=mslp.compute_temperature(varvals['T'][:],p)
+    z=mslp.compute_height(varvals['PH'][:],varvals['PHB'][:])
+    try:
+        # Negative mixing ratios are set to 0 before, as in wrf_user_getvar
+        psl=mslp.compute_seaprs(z,t,p,np.maximum(varvals['QVAPOR'][:],0.))
+    except ValueError, err:
+        sys.exit('ERROR in compute_psl: %s' %(err))
+    return psl,atts
+
 def compute_potevp(varvals,time,gvars):
     """Method to compute surface potential evaporation flux
 
@@ -960,3 +975,35 @@ def compute_wss1Hmaxtstep(varvals,time,gvars):
     wss1Hmaxtstep=uv10max1H
 
     return wss1Hmaxtstep,atts
+
+
+def compute_plevel(varvals,time,gvars,name,plevs):
+    """Method to compute a variable at several pressure levels (see compute_plevels.py)
+    name: ta, zg, ua, va or hus
+    plevs: pressure levels [hPa]
+    time: list of times corresponding to the 1st dimension
+    ---
+    list with the variable at each pressure level (missing below the ground) and
+    the attributes of each of them to be used in the output netcdf
+    """
+    if len(time)!=varvals['P'].shape[0]:
+        sys.exit('ERROR in compute_plevel: The lenght of time variable does not correspond to var first dimension')
+
+    tseconds=round(((time[-1]-time[0]).total_seconds()/(len(time)-1)))
+    info={'ta':("air_temperature","Air Temperature","K"),
+          'zg':("geopotential_height","Geopotential Height","m"),
+          'ua':("eastward_wind","Eastward Wind","m s-1"),
+          'va':("northward_wind","Northward Wind","m s-1"),
+          'hus':("specific_humidity","Specific Humidity","kg/kg")}
+    sn,ln,un=info[name]
+
+    # The field at mass levels and the pressure are computed once for all levels
+    p=varvals['P'][:]+varvals['PB'][:]
+    field=cplev.compute_input(name,varvals,gvars)
+    results=[]
+    for plev in plevs:
+        atts=pm.get_varatt(sn=sn,ln="%s at %s hPa" %(ln,plev),un=un,ts="time: point values %s seconds" %(tseconds))
+        atts['plev']="%s Pa" %(plev*100)
+        varval=cplev.interp_plevel(field,p,plev*100.)
+        results.append((np.ma.filled(varval,pm.const.missingval),atts))
+    return results
@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+"""extract_stations.py script
+   Extracts time series at a list of stations from the postprocessed files
+   (the CCRC_NARCliM_<freq>_<period>_<var>.nc files written by postprocess_NARCliM.py).
+
+   The grid indices of the stations are computed once from the lon/lat of the
+   postprocessed files: the nearest grid point or the four surrounding grid points
+   with bilinear weights. The files of each variable are then read in blocks of time
+   steps, only over small boxes of grid points around the stations, and the series
+   of all the stations are appended to a single output file per variable and frequency:
+
+     <pathout>/<outfile_patt><freq>_<syear>-<eyear>_<var>_stations.nc
+
+   with dimensions (time, station).
+
+   The stations file has one station per line: name lat lon (lines starting with # are ignored)
+
+   Usage:
+     python extract_stations.py -i /path/postprocess/1990-2009/MIROC3.2/R1/d02/ -s stations.txt -o /path/stations/
+     python extract_stations.py -i ... -s stations.txt -o ... -v tas,pracc -f 01H,DAY -m bilinear
+"""
+
+import netCDF4 as nc
+import numpy as np
+import sys
+import os
+import glob
+import datetime as dt
+from optparse import OptionParser
+import postprocess_modules as pm
+
+
+# *************************************************************************************
+def read_stations(filename):
+  """ Reads the stations file (one station per line: name lat lon)
+  ---
+  names: list of station names
+  lats, lons: arrays with the station coordinates
+  """
+  names=[]
+  lats=[]
+  lons=[]
+  filein=open(filename,'r')
+  for line in filein.readlines():
+    line=line.strip()
+    if (line=='') or line.startswith('#'):
+      continue
+    entry=line.split()
+    if len(entry)<3:
+      sys.exit('ERROR: Wrong line in the stations file %s: %s (it should be name lat lon)' %(filename,line))
+    names.append(entry[0])
+    lats.append(float(entry[1]))
+    lons.append(float(entry[2]))
+  filein.close()
+  if len(names)==0:
+    sys.exit('ERROR: There are no stations in %s' %(filename))
+  return names,np.array(lats),np.array(lons)
+
+
+# *************************************************************************************
+def haversine(lat1,lon1,lat2,lon2):
+  """ Great circle distance (km) between points given in degrees
+  """
+  lat1,lon1,lat2,lon2=[np.radians(coord) for coord in (lat1,lon1,lat2,lon2)]
+  aux=np.sin((lat2-lat1)/2.)**2+np.cos(lat1)*np.cos(lat2)*np.sin((lon2-lon1)/2.)**2
+  return 2.*6371.*np.arcsin(np.sqrt(np.minimum(aux,1.)))
+
+
+# *************************************************************************************
+def get_station_index(lat,lon,slats,slons,method='nearest'):
+  """ Grid points used for each station
+  lat, lon: 2-D latitude and longitude of the grid
+  slats, slons: station coordinates
+  method: nearest (nearest grid point) or bilinear (four surrounding grid points)
+  ---
+  iy, ix: arrays (nstations, npoints) with the indices of the grid points used
+  weights: array (nstations, npoints) with the weight of each grid point
+  dist: distance (km) from each station to its nearest grid point
+  """
+  ny,nx=lat.shape
+  nst=len(slats)
+  if method=='nearest':
+    npoints=1
+  elif method=='bilinear':
+    npoints=4
+  else:
+    sys.exit('ERROR: Unknown interpolation method %s (nearest or bilinear)' %(method))
+
+  iy=np.zeros((nst,npoints),dtype=np.int64)
+  ix=np.zeros((nst,npoints),dtype=np.int64)
+  weights=np.zeros((nst,npoints))
+  dist=np.zeros(nst)
+  for st in xrange(nst):
+    dgrid=haversine(lat,lon,slats[st],slons[st])
+    jj,ii=np.unravel_index(np.argmin(dgrid),dgrid.shape)
+    dist[st]=dgrid[jj,ii]
+    if method=='nearest':
+      iy[st,0]=jj
+      ix[st,0]=ii
+      weights[st,0]=1.
+      continue
+
+    # Fractional grid indices of the station from the local gradient of lat/lon
+    # around the nearest point (the grid is smooth, so one linear step is enough)
+    j0=min(max(jj,0),ny-2)
+    i0=min(max(ii,0),nx-2)
+    jac=np.array([[lon[j0,i0+1]-lon[j0,i0],lon[j0+1,i0]-lon[j0,i0]],
+                  [lat[j0,i0+1]-lat[j0,i0],lat[j0+1,i0]-lat[j0,i0]]])
+    dxy=np.linalg.solve(jac,np.array([slons[st]-lon[jj,ii],slats[st]-lat[jj,ii]]))
+    fx=min(max(ii+dxy[0],0.),nx-1.)
+    fy=min(max(jj+dxy[1],0.),ny-1.)
+    x0=min(int(np.floor(fx)),nx-2)
+    y0=min(int(np.floor(fy)),ny-2)
+    wx=fx-x0
+    wy=fy-y0
+    iy[st,:]=[y0,y0,y0+1,y0+1]
+    ix[st,:]=[x0,x0+1,x0,x0+1]
+    weights[st,:]=[(1-wy)*(1-wx),(1-wy)*wx,wy*(1-wx),wy*wx]
+
+  return iy,ix,weights,dist
+
+
+# *************************************************************************************
+def get_files(pathin,outfile_patt,freq,var):
+  """ Postprocessed files of variable var at frequency freq, sorted by period
+  """
+  files=sorted(glob.glob('%s/%s%s_*_%s.nc' %(pathin,outfile_patt,freq,var)))
+  return [ifile for ifile in files if not ifile.endswith('_stations.nc')]
+
+
+# *************************************************************************************
+def get_variables(pathin,outfile_patt,freq):
+  """ Variables with postprocessed files at frequency freq
+  """
+  variables=[]
+  for ifile in get_files(pathin,outfile_patt,freq,'*'):
+    var=os.path.basename(ifile)[:-3].split('_')[-1]
+    if var not in variables:
+      variables.append(var)
+  return variables
+
+
+# *************************************************************************************
+def get_read_block(ncvar,nbox,blockbytes=64*1024**2):
+  """ Number of time steps read at once: as many as fit in blockbytes for the box
+  of grid points that is read, rounded to the time chunk of the file if it is chunked
+  """
+  nt=ncvar.shape[0]
+  block=max(int(blockbytes/(4.*nbox)),1)
+  chunks=ncvar.chunking()
+  if chunks!='contiguous' and chunks is not None:
+    ct=chunks[0]
+    block=max(block//ct,1)*ct
+  return min(block,nt)
+
+
+# *************************************************************************************
+class stationwriter:
+  """ Output file with the time series of one variable at all stations
+  """
+  def __init__(self,fileout,fileref,varname,names,slats,slons,iy,ix,weights,dist,lat,lon,method):
+    fin=nc.Dataset(fileref,'r')
+    varin=fin.variables[varname]
+    nst=len(names)
+    strlen=max([len(name) for name in names])
+
+    self.fout=nc.Dataset(fileout,mode='w',format='NETCDF4_CLASSIC')
+    self.fout.createDimension('time',None)
+    self.fout.createDimension('station',nst)
+    self.fout.createDimension('name_strlen',strlen)
+    if 'time_bnds' in fin.variables:
+      self.fout.createDimension('bnds',2)
+
+    stname=self.fout.createVariable('station_name','S1',('station','name_strlen'))
+    stname.long_name='station name'
+    stname.cf_role='timeseries_id'
+    stname[:]=nc.stringtochar(np.array(names,dtype='S%s' %(strlen)))
+
+    for coord,values,ln in [('lat',slats,'latitude'),('lon',slons,'longitude')]:
+      outvar=self.fout.createVariable(coord,'f4',('station',))
+      for att in fin.variables[coord].ncattrs():
+        setattr(outvar,att,getattr(fin.variables[coord],att))
+      outvar.long_name='station %s' %(ln)
+      outvar[:]=values
+
+    gridlat=self.fout.createVariable('grid_lat','f4',('station',))
+    gridlat.long_name='latitude of the nearest grid point'
+    gridlat.units='degrees_north'
+    gridlon=self.fout.createVariable('grid_lon','f4',('station',))
+    gridlon.long_name='longitude of the nearest grid point'
+    gridlon.units='degrees_east'
+    distance=self.fout.createVariable('grid_distance','f4',('station',))
+    distance.long_name='distance from the station to the nearest grid point'
+    distance.units='km'
+    jnear=iy[np.arange(nst),np.argmax(weights,axis=1)]
+    inear=ix[np.arange(nst),np.argmax(weights,axis=1)]
+    gridlat[:]=lat[jnear,inear]
+    gridlon[:]=lon[jnear,inear]
+    distance[:]=dist
+
+    for tvar in ['time','time_bnds']:
+      if tvar in fin.variables:
+        outvar=self.fout.createVariable(tvar,'f8',fin.variables[tvar].dimensions)
+        for att in fin.variables[tvar].ncattrs():
+          setattr(outvar,att,getattr(fin.variables[tvar],att))
+
+    self.varname=varname
+    outvar=self.fout.createVariable(varname,'f4',('time','station'),fill_value=pm.const.missingval)
+    for att in varin.ncattrs():
+      if att not in ['_FillValue','grid_mapping','coordinates','least_significant_digit']:
+        setattr(outvar,att,getattr(varin,att))
+    outvar.coordinates='lon lat station_name'
+    outvar.interpolation_method=method
+
+    for att in fin.ncattrs():
+      setattr(self.fout,att,getattr(fin,att))
+    self.fout.featureType='timeSeries'
+    self.fout.stations_creation_date=dt.datetime.utcnow().strftime("%Y/%m/%d %H:%M:%S UTC")
+    fin.close()
+    self.nt_written=0
+
+  def write(self,values,time,time_bnds=None):
+    tstart=self.nt_written
+    tend=tstart+values.shape[0]
+    self.fout.variables[self.varname][tstart:tend,:]=values
+    self.fout.variables['time'][tstart:tend]=time
+    if time_bnds is not None:
+      self.fout.variables['time_bnds'][tstart:tend,:]=time_bnds
+    self.nt_written=tend
+
+  def close(self):
+    self.fout.close()
+
+
+# *************************************************************************************
+def get_station_boxes(iy,ix,minpoints=64):
+  """ Groups the stations in boxes of grid points read together: a station joins a box
+  if the box that covers both has at most minpoints grid points or no more than the
+  points of the two boxes read separately (nearby stations). Distant stations are read
+  in their own small boxes instead of in the bounding box of all the stations.
+  iy, ix: arrays (nstations, npoints) with the indices of the grid points used
+  ---
+  boxes: list of [y0,y1,x0,x1,stations], with the stations (list of indices) in each box
+  """
+  boxes=[]
+  for st in np.lexsort((ix.min(axis=1),iy.min(axis=1))):
+    sbox=[iy[st].min(),iy[st].max()+1,ix[st].min(),ix[st].max()+1]
+    for box in boxes:
+      merged=[min(box[0],sbox[0]),max(box[1],sbox[1]),min(box[2],sbox[2]),max(box[3],sbox[3])]
+      npoints=(merged[1]-merged[0])*(merged[3]-merged[2])
+      if npoints<=max(minpoints,(box[1]-box[0])*(box[3]-box[2])+(sbox[1]-sbox[0])*(sbox[3]-sbox[2])):
+        box[:4]=merged
+        box[4].append(st)
+        break
+    else:
+      boxes.append(sbox+[[st]])
+  return boxes
+
+
+# *************************************************************************************
+def extract_file(filein,varname,writer,iy,ix,weights,boxes=None):
+  """ Appends the series at the stations of the file filein to the writer.
+  Only the boxes of grid points with stations are read (see get_station_boxes), in
+  blocks of time steps.
+  """
+  if boxes is None:
+    boxes=get_station_boxes(iy,ix)
+  fin=nc.Dataset(filein,'r')
+  varin=fin.variables[varname]
+  varin.set_auto_maskandscale(True)
+  nt=varin.shape[0]
+  block=get_read_block(varin,sum([(y1-y0)*(x1-x0) for y0,y1,x0,x1,sts in boxes]))
+  for tt in xrange(0,nt,block):
+    tend=min(tt+block,nt)
+    values=np.zeros((tend-tt,len(weights)))
+    for y0,y1,x0,x1,sts in boxes:
+      field=varin[tt:tend,y0:y1,x0:x1]
+      points=field[:,iy[sts]-y0,ix[sts]-x0]  # (time, station, point)
+      wbox=weights[np.newaxis,sts,:]
+      boxvalues=np.ma.sum(points*wbox,axis=2)
+      # A station is missing if any of its grid points with weight is missing
+      mask=np.any(np.ma.getmaskarray(points)&(wbox>0),axis=2)
+      values[:,sts]=np.where(mask,pm.const.missingval,np.ma.getdata(boxvalues))
+    time_bnds=None
+    if 'time_bnds' in fin.variables:
+      time_bnds=fin.variables['time_bnds'][tt:tend,:]
+    writer.write(values,fin.variables['time'][tt:tend],time_bnds)
+  fin.close()
+
+
+# *************************************************************************************
+if __name__=='__main__':
+
+  parser = OptionParser()
+  parser.add_option("-i", "--pathin", dest="pathin",
+  help="directory with the postprocessed files", metavar="PATH")
+  parser.add_option("-s", "--stations", dest="stations",
+  help="file with the stations (name lat lon)", metavar="STATIONSFILE")
+  parser.add_option("-o", "--pathout", dest="pathout",
+  help="directory where the station files are written", metavar="PATH")
+  parser.add_option("-v", "--variables", dest="variables", default=None,
+  help="comma separated list of variables (all by default)", metavar="VARS")
+  parser.add_option("-f", "--frequencies", dest="frequencies", default='01H,03H,DAY,MON',
+  help="comma separated list of frequencies (01H,03H,DAY,MON by default)", metavar="FREQS")
+  parser.add_option("-m", "--method", dest="method", default='nearest',
+  help="nearest or bilinear (nearest by default)", metavar="METHOD")
+  parser.add_option("-p", "--outfile_patt", dest="outfile_patt", default='CCRC_NARCliM_',
+  help="pattern of the postprocessed files (CCRC_NARCliM_ by default)", metavar="PATTERN")
+  (opts, args) = parser.parse_args()
+
+  if (opts.pathin is None) or (opts.stations is None) or (opts.pathout is None):
+    parser.error('The input path (-i), the stations file (-s) and the output path (-o) are required')
+  if not os.path.exists(opts.pathout):
+    os.makedirs(opts.pathout)
+
+  names,slats,slons=read_stations(opts.stations)
+  print 'Extracting %s stations from %s' %(len(names),opts.pathin)
+
+  iy=None
+  for freq in opts.frequencies.split(','):
+    if opts.variables is None:
+      variables=get_variables(opts.pathin,opts.outfile_patt,freq)
+    else:
+      variables=opts.variables.split(',')
+
+    for var in variables:
+      files=get_files(opts.pathin,opts.outfile_patt,freq,var)
+      if len(files)==0:
+        continue
+
+      # All postprocessed files share the grid: the station indices are computed once
+      if iy is None:
+        fin=nc.Dataset(files[0],'r')
+        lat=fin.variables['lat'][:]
+        lon=fin.variables['lon'][:]
+        fin.close()
+        iy,ix,weights,dist=get_station_index(lat,lon,slats,slons,opts.method)
+        boxes=get_station_boxes(iy,ix)
+        far=np.where(dist>2*haversine(lat[0,0],lon[0,0],lat[1,1],lon[1,1]))[0]
+        for st in far:
+          print '   WARNING: station %s is %.1f km away from the nearest grid point' %(names[st],dist[st])
+
+      period='%s-%s' %(os.path.basename(files[0]).split('_')[-2].split('-')[0],os.path.basename(files[-1]).split('_')[-2].split('-')[1])
+      fileout='%s/%s%s_%s_%s_stations.nc' %(opts.pathout,opts.outfile_patt,freq,period,var)
+      print '  -->  %s: %s files' %(os.path.basename(fileout),len(files))
+      writer=stationwriter(fileout,files[0],var,names,slats,slons,iy,ix,weights,dist,lat,lon,opts.method)
+      for filein in files:
+        extract_file(filein,var,writer,iy,ix,weights,boxes)
+      writer.close()
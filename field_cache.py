@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+"""field_cache.py
+   On-disk cache of the WRF fields decoded by read_list (postprocess_modules.py).
+
+   Each field of each WRF file (one file per month for wrfhrly, wrfxtrm and wrfdly,
+   one per day for wrfout) is stored as a compressed .npz file. The entries are keyed
+   by the path, size and modification time of the source file, so a WRF file that is
+   rerun or replaced is decoded again. When the total size of the cache is larger than
+   the maximum size, the least recently used entries are removed.
+
+   The cache is opt-in: it is only used when cache_dir is given in the input file.
+   It is shared by all runs that use the same cache_dir, so reprocessing a simulation
+   (e.g. to add a variable or fix a compute_* function) only reads the fields that
+   were not read before.
+"""
+import os
+import hashlib
+import tempfile
+import numpy as np
+
+
+class fieldcache:
+  """ Cache of WRF fields in the directory cachedir, with a maximum size of maxsize bytes
+
+    cache=fieldcache('/scratch/wrfcache/',50*1024**3)
+    t2=cache.get(filename,'T2')    # None if the field is not in the cache
+    if t2 is None:
+      t2=read the field from filename
+      cache.put(filename,'T2',t2)
+    cache.evict()
+  """
+  def __init__(self,cachedir,maxsize):
+    self.cachedir=cachedir
+    self.maxsize=maxsize
+    if not os.path.exists(cachedir):
+      try:
+        os.makedirs(cachedir)
+      except OSError:
+        # Created at the same time by another reader
+        pass
+
+  def get_entry(self,filename,wrfv,window=None):
+    """ Name of the cache entry of field wrfv of filename. Subsets of the domain
+    (window, see get_window in postprocess_modules.py) are different entries.
+    """
+    stat=os.stat(filename)
+    key='%s|%s|%s|%s' %(os.path.abspath(filename),stat.st_size,stat.st_mtime,wrfv)
+    if window is not None:
+      key='%s|%s:%s,%s:%s' %(key,window[0].start,window[0].stop,window[1].start,window[1].stop)
+    return '%s/%s_%s_%s.npz' %(self.cachedir,os.path.basename(filename),wrfv,hashlib.sha1(key).hexdigest()[:16])
+
+  def get(self,filename,wrfv,window=None):
+    """ Returns the field wrfv of filename if it is in the cache, None otherwise
+    """
+    entry=self.get_entry(filename,wrfv,window)
+    try:
+      npz=np.load(entry)
+      data=npz['data']
+      if 'mask' in npz.files:
+        data=np.ma.masked_array(data,mask=npz['mask'],fill_value=npz['fill_value'])
+      npz.close()
+    except (IOError,OSError,KeyError,ValueError):
+      return None
+    # The modification time of the entry is its last use (for the LRU eviction)
+    try:
+      os.utime(entry,None)
+    except OSError:
+      pass
+    return data
+
+  def put(self,filename,wrfv,data,window=None):
+    """ Stores the field wrfv of filename in the cache
+    """
+    entry=self.get_entry(filename,wrfv,window)
+    fd,tmpname=tempfile.mkstemp(suffix='.tmp',dir=self.cachedir)
+    fout=os.fdopen(fd,'wb')
+    try:
+      if np.ma.isMaskedArray(data):
+        np.savez_compressed(fout,data=np.ma.getdata(data),mask=np.ma.getmaskarray(data),
+          fill_value=data.fill_value)
+      else:
+        np.savez_compressed(fout,data=np.ma.getdata(data))
+      fout.close()
+    except:
+      # No partial entries are left (e.g. when the disk is full)
+      fout.close()
+      os.remove(tmpname)
+      raise
+    # Renaming is atomic, so a concurrent reader never sees a half-written entry
+    os.rename(tmpname,entry)
+
+  def get_size(self):
+    """ Total size of the cache in bytes
+    """
+    return sum([info[1] for info in self.list_entries()])
+
+  def list_entries(self):
+    """ List of (entry, size, last use) of all entries of the cache
+    """
+    entries=[]
+    for name in os.listdir(self.cachedir):
+      if name.endswith('.npz'):
+        try:
+          stat=os.stat('%s/%s' %(self.cachedir,name))
+        except OSError:
+          continue
+        entries.append(('%s/%s' %(self.cachedir,name),stat.st_size,stat.st_mtime))
+    return entries
+
+  def evict(self):
+    """ Removes the least recently used entries until the cache is smaller than maxsize
+    """
+    entries=sorted(self.list_entries(),key=lambda info: info[2])
+    totsize=sum([info[1] for info in entries])
+    nremoved=0
+    for entry,size,lastuse in entries:
+      if totsize<=self.maxsize:
+        break
+      try:
+        os.remove(entry)
+      except OSError:
+        # Removed at the same time by another reader
+        pass
+      totsize=totsize-size
+      nremoved=nremoved+1
+    if nremoved>0:
+      print '  -->  FIELD CACHE: %s entries removed, %.1f MB in use' %(nremoved,totsize/1024.**2)
@@ -25,10 +25,14 @@
 #               created with script createnarclimdirs.
 # author     => Author for the globals of output files. String. 
 # email      => Author email for the globals of output files. String. 
+# jobs       => Number of file pairs processed at a time. Integer.
+# overwrite  => Whether to write again the files that are newer than
+#               their inputs. Boolean.
 
 # CALLS
 # =======
-# make_tasmean_bc
+# combine_all from combine_bc (the files are read and written in blocks
+# of time steps, as make_tasmean_bc does in one go)
 
 # OUTPUT
 # ========
@@ -42,49 +46,17 @@
 # HISTORY
 # ========
 # Feb 02 2015 => Written by Roman Olson, CCRC, UNSW.
+# Processes the file pairs in parallel, in blocks of time steps, and
+# skips the outputs that are up to date (see combine_bc).
 # ======================================================================
 
-def make_tasmean_bc_all(inputdir, outputdir, author, email): 
+def make_tasmean_bc_all(inputdir, outputdir, author, email, jobs=4,
+   overwrite=False): 
 
    # IMPORT MODULES
-   import os
-   import glob
-   from make_tasmean_bc import make_tasmean_bc 
-   import pdb
+   from combine_bc import combine_all
 
-   # WALK THROUGH DIRECTORIES
-   # Note that dirpath does not end with a slash
-   for dirpath, dirnames, filenames in os.walk(inputdir): 
-
-      # Only look into bottom directories ending in d01 or d02
-      if (dirpath.endswith(("d01", "d02"))):
-
-        reldirpath = os.path.relpath(dirpath, inputdir)
-        print reldirpath
-        # Note that these are full paths
-        minfiles = sorted(glob.glob(dirpath + 
-"/CCRC_NARCliM_MON_*_tasminmean_bc.nc"))
-        maxfiles = sorted(glob.glob(dirpath + 
-"/CCRC_NARCliM_MON_*_tasmaxmean_bc.nc"))
-        if (len(minfiles) != len(maxfiles)):
-           raise ValueError, "Different number of min and max files"
-
-        # Iterate across files for each directory. 
-        for minfile, maxfile in zip(minfiles, maxfiles):
-
-           baseminfile = os.path.basename(minfile)
-           basemaxfile = os.path.basename(maxfile) 
-
-           # Check if files cover the same period
-           if (baseminfile[:26] == basemaxfile[:26]):
-
-              basemeanfile = baseminfile[:26] + "_tasmean_bc.nc"
-              meanfile = os.path.join(outputdir, reldirpath, basemeanfile)
-              make_tasmean_bc(minfile, maxfile, meanfile, 
-                 author, email)
-
-           else: 
-              raise ValueError, "Min and max files have different times"
-
-
-      
+   # COMBINE ALL PAIRS OF FILES, jobs AT A TIME. Files that are up to
+   # date (newer than their inputs) are skipped unless overwrite is True
+   return combine_all("tasmean_bc", inputdir, outputdir, author, email,
+      jobs, overwrite)
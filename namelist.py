@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+
+"""namelist.py
+   Reads the input file of postprocess_NARCliM.py (e.g. NARCliM_post.input).
+
+   The file has two parts separated by the line
+     #### Requested output variables (DO NOT CHANGE THIS LINE) ####
+   The first part has one option per line (name = value) and the second the output
+   variables, one per line. Lines starting with # are ignored.
+
+   Both parts are parsed in memory (no temporary files are written, so several
+   runs can be started from the same directory at the same time). The options are
+   converted to their types and checked as declared in OPTIONS, and they are
+   available as attributes of a namelist object, e.g. config.syear is an int and
+   config.overwrite a bool.
+"""
+import re
+import sys
+
+SENTINEL='#### Requested output variables (DO NOT CHANGE THIS LINE) ####'
+
+# Options of the input file.
+#   type: str, path (a directory, / is added at the end), int, float, bool,
+#         choice (one of choices) or intlist/floatlist (comma separated, nvalues values)
+#   default: value if the option is not given (None: not used or chosen by the
+#            program). Options without default are required.
+#   min: smallest valid value of int and float options
+OPTIONS = {
+    'pathin':       {'type':'path'},
+    'pathout':      {'type':'path'},
+    'GCM':          {'type':'str'},
+    'RCM':          {'type':'str'},
+    'syear':        {'type':'int'},
+    'eyear':        {'type':'int'},
+    'domain':       {'type':'str','pattern':'d[0-9][0-9]$'},
+    'outfile_patt': {'type':'str'},
+    'overwrite':    {'type':'bool','default':False},
+    # JSON change set of global attributes of the output files (see get_globatt)
+    'globatt_changes': {'type':'str','default':None},
+    # Compression and chunking of the output files (see get_output_profile)
+    'output_profile':          {'type':'choice','choices':['none','map','timeseries'],'default':'none'},
+    'complevel':               {'type':'int','default':None},
+    'shuffle':                 {'type':'bool','default':None},
+    'quantize':                {'type':'bool','default':False},
+    'least_significant_digit': {'type':'str','default':''},
+    # Writing in a separate process (see writerpool)
+    'async_write':   {'type':'bool','default':False},
+    # Cache of decoded WRF fields (see field_cache.py). Size in GB
+    'cache_dir':     {'type':'path','default':None},
+    'cache_maxsize': {'type':'float','default':50.},
+    # Resources of the run (see get_resources): processes for the computations, memory
+    # budget in GB, files read at once for the variables computed from 3-D fields
+    # (see process_chunked) and parallel readers of read_list
+    'workers':       {'type':'int','min':1,'default':None},
+    'memory':        {'type':'float','min':0.01,'default':None},
+    'chunk_files':   {'type':'int','min':1,'default':None},
+    'io_jobs':       {'type':'int','min':1,'default':10},
+    'io_min_files':  {'type':'int','min':1,'default':15},
+    # Region to postprocess (see get_window)
+    'subset_window': {'type':'intlist','nvalues':4,'default':None},
+    'subset_bbox':   {'type':'floatlist','nvalues':4,'default':None},
+    }
+
+
+# *************************************************************************************
+class namelist:
+  """ Options of a run, with their types:
+
+    config=namelist({'pathin':'/data/wrf/','syear':'1990',...})
+    config.syear         # 1990
+    config.given('subset_bbox')   # whether the option was in the input file
+
+  options is a dictionary of strings, as read from the input file. The program
+  stops with an error if an option is missing or has a wrong value.
+  """
+  def __init__(self,options):
+    self.options=options
+    for name in sorted(options.keys()):
+      if name not in OPTIONS:
+        print 'WARNING: the option %s of the input file is unknown and it is ignored' %(name)
+    for name in OPTIONS.keys():
+      info=OPTIONS[name]
+      if name in options:
+        value=convert(name,options[name],info)
+      elif 'default' in info:
+        value=info['default']
+      else:
+        sys.exit('ERROR: The option %s is missing in the input file' %(name))
+      setattr(self,name,value)
+    if self.syear>self.eyear:
+      sys.exit('ERROR: syear (%s) is later than eyear (%s)' %(self.syear,self.eyear))
+    if (self.subset_window is not None) and (self.subset_bbox is not None):
+      sys.exit('ERROR: subset_window and subset_bbox cannot be used at the same time')
+
+  def given(self,name):
+    """ Whether the option name was given in the input file
+    """
+    return name in self.options
+
+  def override(self,name,value):
+    """ Replaces option name by value (a string, e.g. from the command line)
+    """
+    if name not in OPTIONS:
+      sys.exit('ERROR: The option %s is unknown' %(name))
+    self.options[name]=value
+    setattr(self,name,convert(name,value,OPTIONS[name]))
+
+
+# *************************************************************************************
+def convert(name,value,info):
+  """ Value of option name (a string in the input file) converted to its type
+  """
+  vtype=info['type']
+  try:
+    if vtype=='int' or vtype=='float':
+      number={'int':int,'float':float}[vtype](value)
+      if ('min' in info) and number<info['min']:
+        sys.exit('ERROR: The value of %s (%s) is not valid. It should be at least %s' %(name,value,info['min']))
+      return number
+    if vtype=='intlist' or vtype=='floatlist':
+      values=[{'intlist':int,'floatlist':float}[vtype](val) for val in value.split(',')]
+      if len(values)!=info['nvalues']:
+        raise ValueError
+      return values
+  except ValueError:
+    sys.exit('ERROR: The value of %s (%s) is not valid. It should be %s' %(name,value,get_typename(info)))
+  if vtype=='bool':
+    if value.lower() in ['true','yes','1']:
+      return True
+    if value.lower() in ['false','no','0']:
+      return False
+    sys.exit('ERROR: The value of %s (%s) is not valid. It should be True or False' %(name,value))
+  if vtype=='choice' and value not in info['choices']:
+    sys.exit('ERROR: The value of %s (%s) is not valid. Please choose between %s' %(name,value,', '.join(info['choices'])))
+  if 'pattern' in info and not re.match(info['pattern'],value):
+    sys.exit('ERROR: The value of %s (%s) is not valid' %(name,value))
+  if vtype=='path' and not value.endswith('/'):
+    value=value+'/'
+  return value
+
+
+def get_typename(info):
+  """ Description of the type of an option for the error messages
+  """
+  if info['type']=='intlist':
+    return '%s comma separated integers' %(info['nvalues'])
+  if info['type']=='floatlist':
+    return '%s comma separated numbers' %(info['nvalues'])
+  return {'int':'an integer','float':'a number'}[info['type']]
+
+
+# *************************************************************************************
+def parse(text):
+  """ Options (dictionary of strings) and list of variables of the text of an input file
+  """
+  if SENTINEL not in text:
+    sys.exit('ERROR: The line %s is missing in the input file' %(SENTINEL))
+  optionstext,sentinel,varstext=text.partition(SENTINEL)
+
+  options={}
+  for line in optionstext.splitlines():
+    li=line.strip()
+    #Ignore empty and commented lines
+    if li and not li.startswith('#'):
+      if '=' not in li:
+        sys.exit('ERROR: The line "%s" of the input file is not an option (name = value)' %(li))
+      # Only the blanks around the name and the value are removed (paths may have spaces)
+      name,value=[s.strip() for s in li.split('=',1)]
+      options[name]=value
+
+  varnames=[]
+  for line in varstext.splitlines():
+    li=line.strip()
+    if li and not li.startswith('#'):
+      varnames.append(li.split()[0])
+  return options,varnames
+
+
+def read_namelist(filename):
+  """ Reads the input file filename. Returns a namelist and the list of variables
+  """
+  filein=open(filename,'r')
+  options,varnames=parse(filein.read())
+  filein.close()
+  return namelist(options),varnames
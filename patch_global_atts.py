@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+"""patch_global_atts.py
+   Changes the global attributes of postprocessed files in place, e.g. to add the
+   attributes that postprocess_NARCliM.py now writes (GLOBATT_CHANGES in
+   postprocess_modules.py) to the files of the archive written before.
+
+   The changes are given as a change set (JSON file, see read_globatt_changes in
+   postprocess_modules.py):
+
+     {"set": {"Conventions": "CF-1.6", "version": "2.1"}, "delete": ["old_attribute"]}
+
+   GLOBATT_CHANGES is used if no change set is given. The header of each file is
+   read first and the files that already have all the changes are not opened for
+   writing. The files are patched by several processes at a time (-j), and each
+   file changed is written to the log (one JSON object per line with the old and
+   new values of the attributes changed).
+
+   Usage:
+     python patch_global_atts.py -i /path/postprocess/1990-2009/MIROC3.2/R1/d02/ -j 8
+     python patch_global_atts.py -i dir1,dir2 -c changes.json -l patch.log --dry-run
+     python patch_global_atts.py -i /path/postprocess/ -r
+
+   Only the files directly in the directories are patched, unless -r is given
+   (then the files of all their subdirectories are patched too).
+"""
+
+import netCDF4 as nc
+import numpy as np
+import sys
+import os
+import json
+import glob
+import datetime as dt
+from optparse import OptionParser
+import postprocess_modules as pm
+
+
+# *************************************************************************************
+def get_files(paths,recursive=False):
+  """ NetCDF files (.nc) in the directories paths. Their subdirectories are only
+  searched if recursive is True (e.g. a whole archive [GCM]/[RCM]/[period]/[domain])
+  """
+  files=[]
+  for path in paths:
+    if recursive:
+      for root,dirs,filenames in os.walk(path):
+        files.extend([os.path.join(root,filename) for filename in filenames if filename.endswith('.nc')])
+    else:
+      files.extend(glob.glob('%s/*.nc' %(path)))
+  return sorted(files)
+
+
+def is_same(old,new):
+  """ Whether the value of an attribute in a file (old) is new
+  """
+  if isinstance(old,basestring) or isinstance(new,basestring):
+    return isinstance(old,basestring) and isinstance(new,basestring) and old==new
+  return np.array_equal(np.asarray(old),np.asarray(new))
+
+
+def get_changes(filename,changes):
+  """ Changes of the change set that are not yet in the file (read from its header):
+  {'set': {name: [old value or None, new value]}, 'delete': [names]}
+  """
+  fin=nc.Dataset(filename,'r')
+  present=fin.ncattrs()
+  todo={'set':{},'delete':[]}
+  for name,value in changes['set'].items():
+    if name not in present:
+      todo['set'][name]=[None,value]
+    elif not is_same(fin.getncattr(name),value):
+      todo['set'][name]=[fin.getncattr(name),value]
+  todo['delete']=[name for name in changes['delete'] if name in present]
+  fin.close()
+  return todo
+
+
+def patch_file(filename,changes,dry_run=False):
+  """ Applies the change set to filename if it does not have it yet. Returns the
+  changes done (see get_changes), None if the file was already up to date.
+  """
+  todo=get_changes(filename,changes)
+  if len(todo['set'])==0 and len(todo['delete'])==0:
+    return None
+  if not dry_run:
+    fout=nc.Dataset(filename,'a')
+    for name in sorted(todo['set'].keys()):
+      fout.setncattr(name,todo['set'][name][1])
+    for name in todo['delete']:
+      fout.delncattr(name)
+    fout.close()
+  return todo
+
+
+def get_logvalue(value):
+  """ Value of an attribute that can be written to the JSON log
+  """
+  if isinstance(value,np.ndarray) or isinstance(value,np.generic):
+    return value.tolist()
+  return value
+
+
+def patch_files(files,changes,jobs=4,logfile=None,dry_run=False):
+  """ Applies the change set to all files, jobs files at a time, and writes the
+  changes of each file to logfile. Returns the number of files changed.
+  """
+  from joblib import Parallel, delayed
+  todos=Parallel(n_jobs=max(1,min(jobs,len(files))))(delayed(patch_file)(filename,changes,dry_run) for filename in files)
+  nchanged=0
+  if logfile is not None:
+    flog=open(logfile,'a')
+  for filename,todo in zip(files,todos):
+    if todo is None:
+      continue
+    nchanged=nchanged+1
+    record={'file':filename,'date':dt.datetime.utcnow().strftime("%Y/%m/%d %H:%M:%S UTC"),'dry_run':dry_run,
+            'set':dict([(name,[get_logvalue(old),get_logvalue(new)]) for name,(old,new) in todo['set'].items()]),
+            'delete':todo['delete']}
+    print ' --->> %s: %s' %(filename,', '.join(sorted(todo['set'].keys())+['-'+name for name in todo['delete']]))
+    if logfile is not None:
+      flog.write(json.dumps(record,sort_keys=True)+'\n')
+  if logfile is not None:
+    flog.close()
+  print '%s of %s files changed, %s already up to date' %(nchanged,len(files),len(files)-nchanged)
+  return nchanged
+
+
+# *************************************************************************************
+if __name__=='__main__':
+
+  parser = OptionParser()
+  parser.add_option("-i", "--paths", dest="paths",
+  help="comma separated list of directories with the files to patch", metavar="PATHS")
+  parser.add_option("-r", "--recursive", dest="recursive", action="store_true", default=False,
+  help="also patch the files in the subdirectories of the directories")
+  parser.add_option("-c", "--changes", dest="changes", default=None,
+  help="JSON change set of global attributes (GLOBATT_CHANGES of postprocess_modules.py by default)", metavar="FILE")
+  parser.add_option("-j", "--jobs", dest="jobs", type="int", default=4,
+  help="number of files patched at the same time (4 by default)", metavar="N")
+  parser.add_option("-l", "--log", dest="logfile", default='patch_global_atts.log',
+  help="log of the changes done (patch_global_atts.log by default)", metavar="FILE")
+  parser.add_option("--dry-run", dest="dry_run", action="store_true", default=False,
+  help="only write the changes that would be done to the log")
+  (opts, args) = parser.parse_args()
+
+  if opts.paths is None:
+    parser.error('The directories with the files to patch (-i) are required')
+  if opts.changes is None:
+    changes=pm.GLOBATT_CHANGES
+  else:
+    changes=pm.read_globatt_changes(opts.changes)
+
+  files=get_files(opts.paths.split(','),opts.recursive)
+  print 'Patching the global attributes of %s files' %(len(files))
+  patch_files(files,changes,opts.jobs,opts.logfile,opts.dry_run)
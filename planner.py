@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+"""planner.py
+   Memory plan of the high-frequency stage of postprocess_NARCliM.py.
+
+   The variables are read and computed for a whole period (1 year of wrfhrly, 5 years
+   of the other files) at once. Before reading, the memory needed is predicted from
+   the grid (XLAT of the reference file, over the subset window), the number of time
+   steps of the period and the number of WRF fields read. If it is larger than the
+   memory budget of the run (option memory, see get_resources), the domain is split
+   in bands of rows that fit in the budget: each band is read and computed for the
+   whole period and written to its rows of the same output file (see
+   process_banded in postprocess_modules.py), so the output files have the same
+   values (only their chunks follow the bands).
+
+   The plan, the predicted memory and the actual peak memory of each variable are
+   written to the log.
+"""
+import calendar as cal
+import netCDF4 as nc
+import postprocess_modules as pm
+import tracing as tr
+
+# Arrays of the size of the output (float64) alive at the same time while a variable
+# is computed and checked (temporaries of compute_*, leap days, conversion to float32)
+WORK_FACTOR=4
+
+
+# *************************************************************************************
+def get_grid(gvars):
+  """ Window (slices along y and x) postprocessed, with explicit limits, and its size
+  """
+  fin=nc.Dataset(gvars.fileref_att,'r')
+  ny,nx=fin.variables['XLAT'].shape[-2:]
+  fin.close()
+  window=gvars.window
+  if window is None:
+    window=(slice(0,ny),slice(0,nx))
+  ny=len(xrange(*window[0].indices(ny)))
+  nx=len(xrange(*window[1].indices(nx)))
+  return window,ny,nx
+
+
+def get_ntimes(filet,per,per_f,gvars):
+  """ Number of time steps read for a period (one more for accumulated variables)
+  """
+  time_step=pm.get_filefreq(filet)['time_step']
+  ndays=0
+  for year in xrange(per,per_f+1):
+    ndays=ndays+365
+    if cal.isleap(year) and gvars.GCM_calendar!='no_leap':
+      ndays=ndays+1
+  return ndays*24/time_step+1
+
+
+def predict_memory(nfields,ntimes,ny,nx):
+  """ Memory [bytes] needed to read nfields WRF fields and compute a variable
+  """
+  return 8*ntimes*ny*nx*(nfields+WORK_FACTOR)
+
+
+# *************************************************************************************
+def plan_variables(gvars,varnames,filet,per,per_f):
+  """ Plan to read and compute the variables varnames (read together, see read_list)
+  for the period per-per_f:
+    plan['bands']: list of windows (one per band of rows). A single window if all
+                   of them fit in the memory budget.
+    plan['predicted']: predicted memory of each band [bytes]
+
+  The bands are not free: each band opens and reads all the WRF files of the period
+  again (only the rows of the band, but the compressed chunks of the WRF files that
+  cross several bands are decompressed once per band), so reading takes longer with
+  more bands. Writing costs the same as for the whole domain, because the chunks of
+  the output file follow the bands (see get_varcompression): with the timeseries
+  profile the bands have a whole number of tiles of 16 rows.
+  """
+  window,ny,nx=get_grid(gvars)
+  nfields=len(pm.VARINFO.get_group_inputs(varnames))
+  ntimes=get_ntimes(filet,per,per_f,gvars)
+  predicted=predict_memory(nfields,ntimes,ny,nx)
+  plan={'variables':varnames,'period':'%s-%s' %(per,per_f),'ntimes':ntimes,'grid':(ny,nx),
+        'nfields':nfields,'budget':gvars.memory,'total':predicted}
+  if predicted<=gvars.memory:
+    plan['bands']=[window]
+    plan['predicted']=predicted
+  else:
+    nrows=int(gvars.memory/predict_memory(nfields,ntimes,1,nx))
+    if nrows<1:
+      print 'WARNING: a single row of the domain needs more memory than the budget'
+      nrows=1
+    if gvars.output_profile=='timeseries' and nrows>16:
+      nrows=nrows//16*16
+    y0=window[0].start
+    plan['bands']=[(slice(y0+yy,y0+min(yy+nrows,ny)),window[1]) for yy in xrange(0,ny,nrows)]
+    plan['predicted']=predict_memory(nfields,ntimes,nrows,nx)
+  return plan
+
+
+def print_plan(plan):
+  """ Writes the plan to the log (and to the trace)
+  """
+  print '  -->  MEMORY PLAN %s %s: %s time steps, %sx%s grid points, %s fields: %.3f GB predicted, budget %.3f GB' %(
+        ','.join(plan['variables']),plan['period'],plan['ntimes'],plan['grid'][0],plan['grid'][1],plan['nfields'],
+        plan['total']/1024.**3,plan['budget']/1024.**3)
+  if len(plan['bands'])==1:
+    print '       The whole period is read at once'
+  else:
+    print '       Read in %s bands of up to %s rows (%.3f GB predicted each)' %(len(plan['bands']),
+          plan['bands'][0][0].stop-plan['bands'][0][0].start,plan['predicted']/1024.**3)
+  tr.trace.write({'plan':','.join(plan['variables']),'period':plan['period'],'nbands':len(plan['bands']),
+                  'predicted_mb':round(plan['predicted']/1024.**2,1),'budget_mb':round(plan['budget']/1024.**2,1)})
+
+
+def start_measure():
+  """ Starts measuring the peak memory of the process (see print_peak). Returns the
+  memory in use [bytes]
+  """
+  tr.reset_peak()
+  return tr.get_rss()
+
+
+def print_peak(plan,var,start):
+  """ Writes the predicted and the actual peak memory of var (above the memory in use
+  at start, see start_measure) to the log (and to the trace)
+  """
+  peak=tr.get_peak()
+  print '  -->  MEMORY OF %s: %.3f GB predicted, %.3f GB peak (%.3f GB in use before reading)' %(var,
+        plan['predicted']/1024.**3,(peak-start)/1024.**3,start/1024.**3)
+  tr.trace.write({'memory':var,'period':plan['period'],'predicted_mb':round(plan['predicted']/1024.**2,1),
+                  'peak_mb':round((peak-start)/1024.**2,1)})
@@ -22,11 +22,12 @@ import calendar as cal
 import compute_stats as coms
 from dateutil.relativedelta import relativedelta
 import variables_info as cfg
+import tracing as tr
+import planner
 
 
 # Check initial time
-ctime_i=pm.checkpoint(0)
-ctime=pm.checkpoint(0)
+span_run=tr.trace.start('run')
 
 #### READING INPUT FILE ######
 ### Options 
@@ -35,13 +36,27 @@ parser = OptionParser()
 
 parser.add_option("-i", "--infile", dest="infile",
 help="file with the input arguments", metavar="INPUTFILE")
+parser.add_option("--profile", dest="profile", default=None,
+help="comma separated list of stages to profile (e.g. compute,qc or all): read, compute, qc, write, chunked, daily, daily_stage, monthly, monthly_stage, variable, period, filetype", metavar="STAGES")
+# Resources of the run (they replace the options of the input file)
+parser.add_option("--workers", dest="workers", default=None,
+help="number of processes for the computations (all cores by default)", metavar="N")
+parser.add_option("--memory", dest="memory", default=None,
+help="memory budget in GB (half of the memory of the node by default)", metavar="GB")
+parser.add_option("--chunk-files", dest="chunk_files", default=None,
+help="WRF files read at once for the variables from 3-D fields (from the memory budget by default)", metavar="N")
+parser.add_option("--io-jobs", dest="io_jobs", default=None,
+help="parallel readers of WRF files (10 by default)", metavar="N")
 (opts, args) = parser.parse_args()
 
 ###
 
 
 #### Reading input info file ######
-inputinf,out_variables=pm.read_input(opts.infile)
+config,out_variables=pm.read_input(opts.infile)
+for option in ['workers','memory','chunk_files','io_jobs']:
+  if getattr(opts,option) is not None:
+    config.override(option,getattr(opts,option))
 
 #### Reading variable info file ######
 varinfo = cfg.VariablesInfo()
@@ -54,7 +69,7 @@ for var in out_variables:
 error_msg=[]
 
 #### Creating global variables ####
-gvars=pm.gvar(inputinf)
+gvars=pm.gvar(config)
 fullpathout=pm.create_outdir(gvars)
 
  
@@ -62,14 +77,28 @@ fullpathout=pm.create_outdir(gvars)
 datenow=dt.datetime.now().strftime("%Y-%m-%d_%H:%M")
 logfile = '%spostprocess_%s_%s_%s-%s_%s_%s.log' %(fullpathout,gvars.GCM,gvars.RCM,gvars.syear,gvars.eyear,gvars.domain,datenow)
 print 'The output messages are written to %s' %(logfile)
+# Timed spans of the run (see tracing.py), one JSON object per line
+tracefile = '%s_trace.jsonl' %(logfile[:-4])
+print 'The timing trace is written to %s' %(tracefile)
+tr.trace.open(tracefile)
+if opts.profile is not None:
+  tr.trace.profiler=tr.profiler(opts.profile.split(','))
 sys.stdout = open('%s' %(logfile), "w") 
 
 #***********************************************
 # LOOP OVER ALL TYPES OF WRF FILE OUTPUTS (i.e., wrfhrly, wrfout, etc)
 # This loop generates high-frequency output, with the same time
 # resolution as the original files.
+# The output files are written by the write stage (in a separate process
+# if async_write=True), which overlaps with reading and computing.
+writer=pm.writerpool(gvars)
+
+# Static fields needed by the requested variables (e.g. LANDMASK, SINALPHA), read into
+# gvars.statics with a single opening of the reference file. The compute_* functions
+# get them from there with read_static, restricted to the window or band computed.
+pm.read_statics(gvars,sorted(set([static for var in out_variables for static in varinfo.get_statics(var)])))
 for filet in file_type:
-  ctime_filet=pm.checkpoint(0)
+  span_filet=tr.trace.start('filetype',filet=filet)
   print '\n','\n', '*************************************'
   print '  PROCESSING ', filet, ' FILE OUTPUTS'
   print '*************************************'
@@ -93,10 +122,9 @@ for filet in file_type:
   #==============================================================================
   
   for per in np.arange(sper,eper+1,period):
-    ctime_year=pm.checkpoint(0)
-    
     #Calculating the last year of the period
     per_f=per+period-1
+    span_per=tr.trace.start('period',filet=filet,period='%s-%s' %(per,per_f))
 
     #Calculating the number of files that should exist
     #for that period and that file type (for checking purposes)
@@ -116,17 +144,57 @@ for filet in file_type:
       files_list=pm.file_list(gvars, per, per_f, filet, n_files)
 
     # LOOP OVER VARIABLES IN THE GIVEN KIND OF FILE
-    for var in varset:
-      ctime_var=pm.checkpoint(0)
+    # Variables that share WRF fields (e.g. wss, uas and vas) are processed one
+    # after the other and their fields are read only once (see get_read_groups)
+    read_groups=varinfo.get_read_groups(varset)
+    group_of=dict([(v,gg) for gg,group in enumerate(read_groups) for v in group])
+    group_read=None
+    group_vals=None
+    for var in [v for group in read_groups for v in group]:
+      if varinfo.is_chunked(var) and group_read==group_of[var]:
+        # Already computed with the other variables from 3-D fields (see process_chunked)
+        continue
 
       # CHECK IF THE FILE ALREADY EXISTS
       file_out='%s%s%s_%s-%s_%s.nc' % (fullpathout,gvars.outfile_patt,file_freq,per,per_f,var) # Specify output file
       filewrite=pm.checkfile(file_out,gvars.overwrite)
       if filewrite:
+        span_var=tr.trace.start('variable',var=var,filet=filet,period='%s-%s' %(per,per_f))
 
         # READ FILES FROM THE CORRESPONDING PERIOD
-        wrfvar=(pm.getwrfname(var)[0]).split('-')
-        time_old, varvals=pm.read_list(files_list, var)	
+        # The memory needed is planned before reading (see planner.py): if the whole
+        # domain does not fit in the memory budget, the variable is read, computed
+        # and written in bands of rows (see process_banded)
+        wrfvar=varinfo.get_inputs(var)
+        banded=False
+        rss_start=planner.start_measure()
+        if varinfo.is_chunked(var):
+          # Variables from 3-D fields are read later, chunk by chunk
+          time_old=pm.read_times(files_list)
+        else:
+          if group_read!=group_of[var]:
+            # Fields of all variables of the group that are still to be written
+            group=read_groups[group_of[var]]
+            pending=[v for v in group[group.index(var):] if gvars.overwrite or
+                     not os.path.exists('%s%s%s_%s-%s_%s.nc' % (fullpathout,gvars.outfile_patt,file_freq,per,per_f,v))]
+            group_vals=None
+            plan=planner.plan_variables(gvars,pending,filet,per,per_f)
+            planner.print_plan(plan)
+            if len(plan['bands'])==1:
+              group_time, group_vals=pm.read_list(files_list, pending, gvars)
+            group_read=group_of[var]
+          if group_vals is not None:
+            time_old=group_time
+            varvals=dict([(wrfv,group_vals[wrfv]) for wrfv in wrfvar])
+          else:
+            # The group does not fit in the memory budget: the variable alone
+            plan=planner.plan_variables(gvars,[var],filet,per,per_f)
+            planner.print_plan(plan)
+            if len(plan['bands'])==1:
+              time_old, varvals=pm.read_list(files_list, var, gvars)
+            else:
+              banded=True
+              time_old=pm.read_times(files_list)
 
         # FIRST/LAST YEAR, MONTH, DAY AND HOUR OF ALL READ FILES
         year_i, month_i, day_i, hour_i = pm.get_wrfdate(time_old[0,:])
@@ -154,14 +222,15 @@ for filet in file_type:
 
         # ***********************************************
         # ACCUMULATED VARIABLES NEED ONE TIME STEP MORE TO COMPUTE DIFFERENCES
-        if var in ['pracc','prcacc','prncacc','potevp','evspsbl']:
+        if varinfo.is_accumulated(var):
 
           # DEFINE TIME BOUNDS FOR ACCUMULATED VARIABLES
           time_bounds=True
           if filet=='wrfhrly' or filet=='wrfout':
             time=pm.create_outtime(date,gvars)
             time_bnds=pm.create_timebnds(time)
-            varvals=pm.add_timestep_acc(wrfvar,varvals,per_f,gvars,filet)
+            if not banded:
+              varvals=pm.add_timestep_acc(wrfvar,varvals,per_f,gvars,filet)
 
         # ***********************************************
         # DEFINE TIME BOUNDS FOR XTRM AND DAILY VARIABLES
@@ -169,18 +238,43 @@ for filet in file_type:
           time=pm.date2hours(date,gvars.ref_date)
           time=[time[i]+time_step/2 for i in xrange(len(time))]
           time_bnds=pm.create_timebnds(time)
-          varvals=pm.mv_timestep(wrfvar,varvals,per_f,gvars,filet)
+          if not banded:
+            varvals=pm.mv_timestep(wrfvar,varvals,per_f,gvars,filet)
+
+        if varinfo.is_chunked(var):
+          # READ, COMPUTE AND WRITE IN CHUNKS OF FILES all variables from 3-D fields
+          # that are still to be written: the 3-D fields are read once for all of them
+          group=read_groups[group_of[var]]
+          pending=[v for v in group[group.index(var):] if v==var or gvars.overwrite or
+                   not os.path.exists('%s%s%s_%s-%s_%s.nc' % (fullpathout,gvars.outfile_patt,file_freq,per,per_f,v))]
+          pm.process_chunked([['%s%s%s_%s-%s_%s.nc' % (fullpathout,gvars.outfile_patt,file_freq,per,per_f,v), v, None, time_bounds]
+                              for v in pending],files_list,date,date_var,time,time_bnds,gvars)
+          group_read=group_of[var]
+          tr.trace.stop(span_var)
+          print '=====================================================', '\n', '\n', '\n'
+          continue
 
         # CALL COMPUTE_VAR MODULE
         compute=getattr(comv,'compute_'+var) # FROM STRING TO ATTRIBUTE
+        if banded:
+          # READ, COMPUTE, CHECK AND WRITE IN BANDS OF ROWS
+          error_msg.extend(pm.process_banded([file_out, var, None, time_bounds],files_list,date,date_var,time,time_bnds,
+                                             compute,gvars,filet,per_f,time_step,plan['bands']))
+          planner.print_peak(plan,var,rss_start)
+          tr.trace.stop(span_var)
+          print '=====================================================', '\n', '\n', '\n'
+          continue
+        span=tr.trace.start('compute',var=var,period='%s-%s' %(per,per_f))
         varval, varatt=compute(varvals,date_var,gvars)
         
         # ADD LEAP DAY FOR MODELS WITHOU IT 
         if gvars.GCM_calendar=='no_leap' and n_leap>=1:
           varval=pm.add_leapdays(varval,date)
+        tr.trace.stop(span,nbytes=varval.nbytes,verbose=False)
         
         # CHECK DISCONTINUITY ISSUES
-        if var in ['pracc','prcacc','prncacc','potevp','evspsbl']:
+        span=tr.trace.start('qc',var=var,period='%s-%s' %(per,per_f))
+        if varinfo.is_accumulated(var):
           varval=pm.check_rerundiscontinuity(var,varval,date,per_f,gvars,filet,files_list,time_step)
           
         # CHECK ZEROS IN WRFDLY AND WRFXTRM
@@ -188,39 +282,54 @@ for filet in file_type:
           error_msg.append(pm.check_zeros_values(varval,date,gvars,filet))
           
         # CHECK NEGATIVE VALUES
-        if var in ['pracc','prcacc','prncacc']:
+        if varinfo.is_nonnegative(var):
           error_msg.append(pm.check_negative_values(var,varval,date))
+        tr.trace.stop(span,verbose=False)
   
         # INFO NEEDED TO WRITE THE OUTPUT NETCDF
         netcdf_info=[file_out, var, varatt, time_bounds]
 
         # CREATE NETCDF FILE
-        pm.create_netcdf(netcdf_info, gvars, varval, time, time_bnds)
-        ctime=pm.checkpoint(ctime_var)
+        span=tr.trace.start('write',var=var,period='%s-%s' %(per,per_f))
+        writer.submit(netcdf_info, varval, time, time_bnds)
+        tr.trace.stop(span,nbytes=varval.nbytes,verbose=False)
+        planner.print_peak(plan,var,rss_start)
+        tr.trace.stop(span_var)
         print '=====================================================', '\n', '\n', '\n'
-      print ' =======================  PERIOD: ',per, ' - ', per_f, ' FINISHED ==============', '\n', '\n',
-      ctime=pm.checkpoint(ctime_year)
+    print ' =======================  PERIOD: ',per, ' - ', per_f, ' FINISHED ==============', '\n', '\n',
+    tr.trace.stop(span_per)
   print ' =======================  FILE TYPE :',filet, ' FINISHED ==============', '\n', '\n',
-  ctime=pm.checkpoint(ctime_filet)
+  tr.trace.stop(span_filet)
+
+# Wait until all high-frequency files are written: they are read by the daily statistics
+span=tr.trace.start('write_wait')
+writer.close()
+tr.trace.stop(span)
 
 #***********************************************
 # DAILY STATISTICS
 # Loop over all types of WRF output files (i.e., wrfhrly, wrfout, etc) 
+# The files of all variables, 5-year blocks and statistics are computed in parallel
+daily_units=[]
 for filet in file_type:
   if (filet!='wrfxtrm') and (filet!='wrfdly'): # These files are already daily
     for varname in varinfo.get_daily_variables(filet):
       if varname in out_variables:
         stat_all=varinfo.get_daily_variable_stats(filet, varname)
-        pm.create_dailyfiles(gvars,varname,stat_all, varinfo)
+        daily_units.extend(pm.get_daily_units(gvars,varname,stat_all, varinfo))
+pm.run_units(gvars,pm.run_daily_unit,daily_units,'daily')
           
           
 #***********************************************
 # MONTHLY STATISTICS
+# The files of all variables, statistics and decades are computed in parallel
+monthly_units=[]
 for filet in file_type:
   for varname in varinfo.get_monthly_variables(filet):
     if varname in out_variables:
       stat_all=varinfo.get_monthly_variable_stats(filet, varname)
-      pm.create_monthlyfiles(gvars,varname,stat_all, varinfo)
+      monthly_units.extend(pm.get_monthly_units(gvars,varname,stat_all, varinfo))
+pm.run_units(gvars,pm.run_monthly_unit,monthly_units,'monthly')
 
 
 #***********************************************
@@ -295,3 +404,12 @@ else:
     print bdf
         
 print '\n','\n',error_msg
+
+tr.trace.stop(span_run)
+tr.trace.summary()
+tr.trace.write({'io':tr.io.report()})
+tr.trace.close()
+if tr.trace.profiler is not None:
+  print '\n','Profile files:'
+  for filename in tr.trace.profiler.write('%s_profile' %(logfile[:-4])):
+    print '  ',filename
@@ -1,15 +1,25 @@
 import re
 import sys
+import copy
+import StringIO
 import os
 import time
 import netCDF4 as nc
 import numpy as np
 import datetime as dt
 import glob as glob
+import multiprocessing
+import Queue
 import compute_stats as coms
 import compute_vars as comv
-from dateutil.relativedelta import relativedelta
+import field_cache as fc
+import tracing as tr
+import namelist as nl
+import variables_info as cfg
 from collections import OrderedDict
+
+# Registry of the variables (inputs, statics and flags of each of them)
+VARINFO=cfg.VariablesInfo()
 class const:
   """Class that contains most used atmospheric constant values
   """
@@ -38,23 +48,91 @@ class const:
 # *************************************************************************************
 
 class gvar:
-  def __init__(self,inputinf):
-    if inputinf['GCM']=='CCCMA3.1':
+  def __init__(self,config):
+    # config: options of the run, a namelist (see read_input) or a dictionary of strings
+    if not isinstance(config,nl.namelist):
+      config=nl.namelist(config)
+    self.config=config
+    if config.GCM=='CCCMA3.1':
       self.GCM_calendar='no_leap'
     else:
       self.GCM_calendar='standard'
     self.ref_date=dt.datetime(1949,12,1,00,00,00)
-    self.pathin=inputinf['pathin']
-    self.pathout=inputinf['pathout']
-    self.GCM=inputinf['GCM']
-    self.RCM=inputinf['RCM']
-    self.syear=int(inputinf['syear'])
-    self.eyear=int(inputinf['eyear'])
-    self.domain=inputinf['domain']
-    self.overwrite=inputinf['overwrite']
-    self.outfile_patt=inputinf['outfile_patt']
+    self.pathin=config.pathin
+    self.pathout=config.pathout
+    self.GCM=config.GCM
+    self.RCM=config.RCM
+    self.syear=config.syear
+    self.eyear=config.eyear
+    self.domain=config.domain
+    self.overwrite=config.overwrite
+    self.outfile_patt=config.outfile_patt
     self.fileref_att='%s/wrfout_%s_%s-01-01_00:00:00' %(self.pathin,self.domain,self.syear)
 
+    # Changes of the global attributes of the output files (see get_globatt)
+    self.globatt_changes=None
+    if config.globatt_changes is not None:
+      self.globatt_changes=read_globatt_changes(config.globatt_changes)
+
+    # Compression and chunking of the output files (see get_output_profile)
+    self.output_profile=config.output_profile
+    self.complevel=config.complevel
+    self.shuffle=config.shuffle
+    self.quantize=config.quantize
+    self.lsd_overrides=read_lsd_overrides(config.least_significant_digit)
+
+    # Write the output files in a separate process (see writerpool)
+    self.async_write=config.async_write
+
+    # Cache of decoded WRF fields (see field_cache.py). Size in GB
+    self.cache_dir=config.cache_dir
+    self.cache_maxsize=config.cache_maxsize
+
+    # Processes, memory budget (bytes), files per chunk of process_chunked (None: from
+    # the memory budget, see get_chunk_files) and readers of read_list
+    self.workers,self.memory=get_resources(config)
+    self.chunk_files=config.chunk_files
+    self.io_jobs=config.io_jobs
+    self.io_min_files=config.io_min_files
+
+    # Region to postprocess: slices along y and x, or None for the whole domain
+    self.window=get_window(self,config)
+
+    # Static fields already read (see read_static)
+    self.statics={}
+
+    # Metadata of the reference file written to all output files (see get_refgrid)
+    self.refgrid=None
+
+
+# *************************************************************************************
+def get_resources(config):
+  """ Number of processes and memory budget (bytes) of the run, from the options
+  workers and memory (GB) of the input file. By default, all cores of the node and
+  half of its memory.
+  """
+  workers=config.workers
+  if workers is None:
+    workers=multiprocessing.cpu_count()
+  if config.memory is not None:
+    memory=config.memory*1024**3
+  else:
+    memory=get_node_memory()/2
+  print 'Resources of the run: %s workers, %.2f GB of memory, %s readers' %(workers,memory/1024.**3,config.io_jobs)
+  return workers,memory
+
+
+def get_node_memory():
+  """ Physical memory of the node [bytes]
+  """
+  try:
+    for line in open('/proc/meminfo','r').readlines():
+      if line.startswith('MemTotal:'):
+        return int(line.split()[1])*1024
+  except (IOError,ValueError):
+    pass
+  return os.sysconf('SC_PAGE_SIZE')*os.sysconf('SC_PHYS_PAGES')
+
 
 # *************************************************************************************
 def function_latentheat(T):
@@ -109,9 +187,8 @@ def add_timestep_acc(wrfvar,varvals,year,gvars,filet):
   for wrfv in wrfvar:
     if year<gvars.eyear:
       next_file='%s%s_%s_%s-01-01_00:00:00' % (gvars.pathin,filet,gvars.domain,year+1)
-      ncfile=nc.Dataset(next_file,'r')
-      next_tstep=np.squeeze(ncfile.variables[wrfv][:])
-      accvar[wrfv]=np.concatenate((varvals[wrfv],next_tstep[0:1,:,:]),axis=0)
+      next_tstep=read_first_tstep(next_file,wrfv,gvars.window)
+      accvar[wrfv]=np.concatenate((varvals[wrfv],next_tstep),axis=0)
     else:
       fillvar=np.ones((1,)+varvals[wrfv].shape[1:],dtype=np.float64)*const.missingval
       accvar[wrfv]=np.concatenate((varvals[wrfv][:],fillvar),axis=0)
@@ -180,7 +257,7 @@ def check_rerundiscontinuity(var,varval,date,per_f,gvars,filet,files_list,time_s
       aux_varvals={}
       for wrfv in aux_wrfvar:
         nextfile=nc.Dataset(nextfile_name)
-        aux_varvals[wrfv]=np.squeeze(nextfile.variables[wrfv][:8,:,:])
+        aux_varvals[wrfv]=np.squeeze(nextfile.variables[wrfv][get_window_index(3,gvars.window,slice(None,8))])
       
 
       compute=getattr(comv,'compute_'+var)
@@ -205,10 +282,9 @@ def mv_timestep(wrfvar,varvals,year,gvars,filet):
   for wrfv in wrfvar:
     if year<gvars.eyear:
       next_file='%s%s_%s_%s-01-01_00:00:00' % (gvars.pathin,filet,gvars.domain,year+1)
-      ncfile=nc.Dataset(next_file,'r')
       print 'READ ONE MORE TIME STEP: ', next_file
-      next_tstep=np.squeeze(ncfile.variables[wrfv][:])
-      accvar[wrfv]=np.concatenate((varvals[wrfv],next_tstep[0:1,:,:]),axis=0)
+      next_tstep=read_first_tstep(next_file,wrfv,gvars.window)
+      accvar[wrfv]=np.concatenate((varvals[wrfv],next_tstep),axis=0)
       accvar[wrfv]=accvar[wrfv][1:,:,:] 
     else:
       fillvar=np.ones((1,)+varvals[wrfv].shape[1:],dtype=np.float64)*const.missingval
@@ -218,17 +294,163 @@ def mv_timestep(wrfvar,varvals,year,gvars,filet):
 
 
 # *************************************************************************************
-def get_wrfvars(wrfvar,fin):
+def read_first_tstep(filename,wrfv,window=None):
+  """ First time step of wrfv in filename (the first file of the next period, needed
+  by accumulated and daily variables), with the time dimension
+  """
+  tstart=time.time()
+  fin=nc.Dataset(filename,'r')
+  tstep=read_wrfvar(fin.variables[wrfv],window,slice(0,1)).astype('float64')
+  fin.close()
+  tr.io.add(filename,tstep.nbytes,time.time()-tstart,kind='probe')
+  return tstep
+
+
+# *************************************************************************************
+def get_wrfvars(wrfvar,fin,window=None):
   variabs={}
   for wrfv in wrfvar:
-    variabs[wrfv]=fin.variables[wrfv][:].astype('float64')
+    variabs[wrfv]=read_wrfvar(fin.variables[wrfv],window).astype('float64')
   return  variabs
+
+
+# *************************************************************************************
+def read_wrfvar(ncvar,window=None,tindex=slice(None)):
+  """ Reads a WRF variable over the subset window (all the domain if window is None).
+  Variables on staggered dimensions (west_east_stag, south_north_stag, bottom_top_stag,
+  e.g. U, V, W, PH) are unstaggered, so all fields are returned at mass points.
+  """
+  field=ncvar[get_window_index(ncvar.ndim,window,tindex,ncvar.dimensions)]
+  if type(tindex)==int:
+    dims=ncvar.dimensions[1:]
+  else:
+    dims=ncvar.dimensions
+  for axis,dim in enumerate(dims):
+    if dim.endswith('_stag'):
+      field=unstagger(field,axis)
+  return field
+
+
+# *************************************************************************************
+def unstagger(field,axis):
+  """ Values at mass points of a field on a staggered dimension (axis): the mean of
+  the two staggered points around each mass point. The result is computed in a single
+  pass into one new array (n-1 points along axis) with the same type as field.
+  """
+  lower=[slice(None)]*field.ndim
+  upper=[slice(None)]*field.ndim
+  lower[axis]=slice(None,-1)
+  upper[axis]=slice(1,None)
+  if np.ma.isMA(field):
+    return 0.5*(field[tuple(lower)]+field[tuple(upper)])
+  out=np.add(field[tuple(lower)],field[tuple(upper)])
+  out*=0.5
+  return out
+
+
+# *************************************************************************************
+def get_window_index(ndim,window,tindex=slice(None),dims=None):
+  """ Index to read a subset window of a WRF variable with dimensions (time, [levels,] y, x)
+  window: slices along y and x (gvars.window), None to read the whole domain
+  tindex: index along the time dimension
+  dims: names of the dimensions of the variable. Staggered horizontal dimensions
+        (west_east_stag, south_north_stag) get one more point, so that the window
+        is complete once the variable is unstaggered.
+  """
+  if window is None:
+    window=(slice(None),slice(None))
+  window=list(window)
+  if dims is not None:
+    for ww,dim in enumerate(dims[-2:]):
+      if dim.endswith('_stag') and window[ww].stop is not None:
+        window[ww]=slice(window[ww].start,window[ww].stop+1)
+  return (tindex,)+(slice(None),)*(ndim-3)+tuple(window)
+
+
+# *************************************************************************************
+def get_window(gvars,config):
+  """ Region of the domain to postprocess, from the input file options:
+  subset_window: first and last y and x indices (zero-based, inclusive) e.g. 10,59,20,99
+  subset_bbox: longitude and latitude limits lonmin,lonmax,latmin,latmax e.g. 150,152,-34,-33
+               (the smallest index window that contains all grid points in the box)
+  ---
+  window: slices along y and x, or None to postprocess the whole domain
+  """
+  if config.subset_window is not None:
+    y0,y1,x0,x1=config.subset_window
+    ny,nx=read_lonlat(gvars.fileref_att)[0].shape
+    if not (0<=y0<=y1<ny and 0<=x0<=x1<nx):
+      sys.exit('ERROR: subset_window %s is not within the domain: it must be y0,y1,x0,x1 with 0<=y0<=y1<%s and 0<=x0<=x1<%s'
+               %(','.join([str(ii) for ii in config.subset_window]),ny,nx))
+    window=(slice(y0,y1+1),slice(x0,x1+1))
+
+  elif config.subset_bbox is not None:
+    lonmin,lonmax,latmin,latmax=config.subset_bbox
+    lon,lat=read_lonlat(gvars.fileref_att)
+    inside=(lon>=lonmin)&(lon<=lonmax)&(lat>=latmin)&(lat<=latmax)
+    if not np.any(inside):
+      sys.exit('ERROR: There are no grid points within subset_bbox %s' %(config.subset_bbox))
+    rows=np.where(np.any(inside,axis=1))[0]
+    cols=np.where(np.any(inside,axis=0))[0]
+    window=(slice(rows[0],rows[-1]+1),slice(cols[0],cols[-1]+1))
+
+  else:
+    return None
+
+  print 'Postprocessing the subset y=%s:%s, x=%s:%s of the domain' %(window[0].start,window[0].stop,window[1].start,window[1].stop)
+  return window
+
+
+# *************************************************************************************
+def read_lonlat(filename):
+  """ Reads the 2-D longitude and latitude (XLONG and XLAT) of a WRF file
+  """
+  fin=nc.Dataset(filename,mode='r')
+  temp=fin.variables['XLONG']
+  if temp.ndim==2:
+    lon=np.squeeze(fin.variables['XLONG'][:]) # Getting longitude
+    lat=np.squeeze(fin.variables['XLAT'][:]) # Getting latitude
+  if temp.ndim==3:
+    lon=np.squeeze(fin.variables['XLONG'][0,:,:]) # Getting longitude
+    lat=np.squeeze(fin.variables['XLAT'][0,:,:]) # Getting latitude
+  fin.close()
+  return lon,lat
+
+
+# *************************************************************************************
+def read_statics(gvars,varnames):
+  """ Reads the static fields varnames (whole domain) from the reference file into
+  gvars.statics, opening the file once. The fields already read are not read again.
+  """
+  missing=[varname for varname in varnames if varname not in gvars.statics.keys()]
+  if len(missing)==0:
+    return
+  fin=nc.Dataset(gvars.fileref_att,'r')
+  for varname in missing:
+    var=fin.variables[varname]
+    if var.ndim==3:
+      gvars.statics[varname]=var[0,:,:]
+    else:
+      gvars.statics[varname]=var[:]
+  fin.close()
+
+
+def read_static(gvars,varname):
+  """ Reads a static field (e.g. LANDMASK, SINALPHA, COSALPHA) from the reference file,
+  restricted to the region postprocessed (gvars.window). Returns a 2-D array (y, x)
+  The fields (whole domain) are kept in gvars.statics, so each one is read only once per run.
+  """
+  read_statics(gvars,[varname])
+  field=gvars.statics[varname]
+  if gvars.window is not None:
+    field=field[gvars.window]
+  return field
   
 
 # *************************************************************************************
 def read_input(filename):
   """
-  Read input file with input arguments:
+  Read input file with input arguments (see namelist.py):
   pathin: path to input wrf files
   pathout: path to output postprocessed files
   GCM: Name of the GCM (e.g. MIROC3.2)
@@ -236,60 +458,13 @@ def read_input(filename):
   syear: First year to postprocess (e.g. 1990)
   eyear: Last year to postprocess (e.g. 2009)
   domain: domain to postprocess (e.g. 'd02')
-  
+  ---
+  config: the options of the run (a namelist, with typed attributes)
+  varnames: list of variables that will be obtained
   """
-  filein=open(filename,'r')
-
-  
-  options,sentinel,varnames=filein.read().partition('#### Requested output variables (DO NOT CHANGE THIS LINE) ####')
-  fileopts=open('fileopts.tmp','w')
-  fileopts.write(options)
-  filevarnames=open('filevarnames.tmp','w')
-  filevarnames.write(varnames)
-  
-  
-  fileopts=open('fileopts.tmp','r')
-  lines=fileopts.readlines()
-
-  inputinf={}
-  entryname=[]
-  entryvalue=[]
-  for line in lines:
-    line=re.sub('\s+',' ',line)
-    line=line.replace(" ", "")
-    li=line.strip()
-    #Ignore empty lines
-    if li:
-      #Ignore commented lines
-      if not li.startswith("#"): 
-        values=li.split('=')
-        entryname.append(values[0])
-        entryvalue.append(values[1])
-  fileopts.close()
-  
-  for ii in xrange(len(entryname)):
-    inputinf[entryname[ii]]=entryvalue[ii]
-    
-  filevarnames=open('filevarnames.tmp','r')
-  lines=filevarnames.readlines()
-  varnames=[]
-  for line in lines:
-    line=re.sub('\s+',' ',line)
-    line=line.replace(" ", "")
-    li=line.strip()
-    #Ignore empty lines
-    if li:
-      #Ignore commented lines
-      if not li.startswith("#"):
-        values=li.split()
-        varnames.append(values[0])
-  filevarnames.close()     
-  
-  os.remove('filevarnames.tmp')
-  os.remove('fileopts.tmp') 
-  
+  config,varnames=nl.read_namelist(filename)
   print 'Variables that will be obtained from postprocessing:',varnames
-  return inputinf,varnames
+  return config,varnames
 
 # *************************************************************************************
 
@@ -334,21 +509,54 @@ def read_varinfo(filename):
  
 # *************************************************************************************
 def getwrfname(varname):
-  """ Dictionary containing the equivalence between CF variable names and WRF 
-  variable names.
+  """ WRF variables needed to compute the CF variable varname, joined by '-'
+  (e.g. ['RAINC-RAINNC'] for pracc). They are declared in VARIABLES of variables_info.py.
   """
+  return ['-'.join(VARINFO.get_inputs(varname))]
 
-  dic={'tas':['T2'],'pracc':['RAINC-RAINNC'],'prcacc':['RAINC'],'prncacc':['RAINNC'],'ps':['PSFC'], 'uas':['U10-V10'], 'vas':['U10-V10'],\
-       'huss':['Q2'], 'hurs':['PSFC-T2-Q2'],'clt':['CLDFRA'],'wss':['U10-V10'], 'sst':['SST'],'rsds':['SWDOWN'], 'rlds':['GLW'],\
-       'emiss':['EMISS'], 'albedo':['ALBEDO'], 'hfls':['LH'], 'hfss':['HFX'],'evspsbl':['SFCEVP'],\
-       'mrso':['SMSTOT'], 'potevp':['POTEVP'], 'rlus':['TSK-EMISS'],'tasmeantstep':['T2MEAN'],\
-       'snm':['ACSNOM'],'snc':['SNOWC'],'snw':['SNOW'],'snd':['SNOWH'],\
-       'tasmintstep':['T2MIN'],'tasmaxtstep':['T2MAX'],'wssmaxtstep':['SPDUV10MAX'], 'pr5maxtstep':['PRMAX5'],\
-       'pr10maxtstep':['PRMAX10'],'pr20maxtstep':['PRMAX20'],'pr30maxtstep':['PRMAX30'], 'pr1Hmaxtstep':['PRMAX1H'],\
-       'wss5maxtstep':['UV10MAX5'], 'wss10maxtstep':['UV10MAX10'], 'wss20maxtstep':['UV10MAX20'],\
-       'wss30maxtstep':['UV10MAX30'], 'wss1Hmaxtstep':['UV10MAX1H']}
-  
-  return dic[varname]
+
+# *************************************************************************************
+def getvarlsd(varname,overrides={}):
+  """ Dictionary containing the number of significant decimal digits kept for each
+  output variable when the output is quantized (least_significant_digit in netCDF4).
+  Daily and monthly statistics (e.g. tasmaxmean, pr5maxtstepmax) use the digits of the
+  variable they are computed from. Returns None if the variable must not be quantized.
+  overrides (see read_lsd_overrides) replace or add digits of some variables.
+  """
+
+  dic={'tas':2,'pracc':3,'prcacc':3,'prncacc':3,'ps':0,'uas':2,'vas':2,'huss':6,'hurs':1,\
+       'clt':1,'wss':2,'sst':2,'rsds':1,'rlds':1,'emiss':4,'albedo':4,'hfls':1,'hfss':1,\
+       'evspsbl':8,'mrso':1,'potevp':8,'rlus':1,'snm':8,'snc':1,'snw':2,'snd':4,\
+       'tasmeantstep':2,'tasmintstep':2,'tasmaxtstep':2,'wssmaxtstep':2,\
+       'pr5maxtstep':7,'pr10maxtstep':7,'pr20maxtstep':7,'pr30maxtstep':7,'pr1Hmaxtstep':7,\
+       'wss5maxtstep':2,'wss10maxtstep':2,'wss20maxtstep':2,'wss30maxtstep':2,'wss1Hmaxtstep':2,\
+       'psl':0,'ta':2,'zg':1,'ua':2,'va':2,'hus':6}
+  dic.update(overrides)
+
+  # Longest name first, so that 'tasmaxtstep' is not taken as a 'tas' statistic
+  for name in sorted(dic.keys(),key=len,reverse=True):
+    if varname.startswith(name):
+      return dic[name]
+  return None
+
+
+# *************************************************************************************
+def read_lsd_overrides(entry):
+  """ Reads the least_significant_digit entry of the input file, that overrides
+  the digits given by getvarlsd for some variables (e.g. tas:1,pracc:2)
+  """
+  overrides={}
+  for item in entry.split(','):
+    item=item.strip()
+    if item:
+      try:
+        name,digits=[s.strip() for s in item.split(':')]
+        if name=='':
+          raise ValueError
+        overrides[name]=int(digits)
+      except ValueError:
+        sys.exit('ERROR: Wrong item %s in least_significant_digit (it should be var:digits, e.g. tas:1,pracc:2)' %(item))
+  return overrides
 
 
 # *************************************************************************************
@@ -472,7 +680,7 @@ def add_leapdays(varval,date):
   
 
 # *************************************************************************************
-def get_globatt(GCM,RCM,sch_info,perturb=None):
+def get_globatt(GCM,RCM,sch_info,perturb=None,changes=None):
   import datetime as dt
   """Method that generates the global attributes
   Defines the name of the schemes and the references to include in the global attributes
@@ -481,6 +689,7 @@ def get_globatt(GCM,RCM,sch_info,perturb=None):
   RCM: Name of the RCM (e.g.: R1)
   Period: Name of the perturbation of the GCM
   sch_info: dictionary containing the kind of schemes as keys, and the name and references as values
+  changes: change set of global attributes (see read_globatt_changes) applied after GLOBATT_CHANGES
   e.g.: global_attributes=ga.globalatt("MIROC3.2","R1",sch_info,"d1")
   """
   glatt=OrderedDict()
@@ -510,10 +719,56 @@ def get_globatt(GCM,RCM,sch_info,perturb=None):
   glatt['wrf_schemes_bl_pbl_physics']     = "%s" %(sch_info['bl_pbl_physics']) 
   glatt['wrf_schemes_ra_sw_physics']        = "%s" %(sch_info['ra_sw_physics']) 
   glatt['wrf_schemes_sf_surface_physics']   = "%s" %(sch_info['sf_surface_physics'])
+  apply_globatt_changes(glatt,GLOBATT_CHANGES)
+  if changes is not None:
+    apply_globatt_changes(glatt,changes)
     
   return glatt
 
 
+# *************************************************************************************
+# Global attributes added to the files after the first postprocess of the archive
+# (see patch_global_atts.py, which applies the same changes to existing files)
+GLOBATT_CHANGES={'set':OrderedDict([
+  ('Conventions','CF-1.6'),
+  ('Comments_on_Conventions','Some variables do not strictly follow CF-1.6 conventions (e.g., precipitation is given as an accumulated quantity rather than as a flux quantity).'),
+  ('version','2.1')]),
+  'delete':[]}
+
+
+def read_globatt_changes(filename):
+  """ Change set of global attributes of a JSON file:
+      {"set": {"name": value, ...}, "delete": ["name", ...]}
+  """
+  import json
+  fin=open(filename,'r')
+  try:
+    changes=json.load(fin,object_pairs_hook=OrderedDict)
+  except ValueError as error:
+    sys.exit('ERROR: The change set of global attributes %s is not valid JSON: %s' %(filename,error))
+  fin.close()
+  for key in changes.keys():
+    if key not in ['set','delete']:
+      sys.exit('ERROR: Unknown entry %s in the change set of global attributes %s (set or delete)' %(key,filename))
+  # Strings as str, so they are written as text attributes in NETCDF4_CLASSIC files
+  values=OrderedDict()
+  for name,value in changes.get('set',{}).items():
+    if isinstance(value,unicode):
+      value=value.encode('utf-8')
+    values[name.encode('utf-8')]=value
+  return {'set':values,'delete':[name.encode('utf-8') for name in changes.get('delete',[])]}
+
+
+def apply_globatt_changes(glatt,changes):
+  """ Applies a change set (see read_globatt_changes) to the global attributes glatt
+  """
+  for name,value in changes['set'].items():
+    glatt[name]=value
+  for name in changes['delete']:
+    if name in glatt:
+      del glatt[name]
+
+
 # *************************************************************************************
 def dictionary2entries(vals1, vals2, vals3):
   """ Function to create a dictionary with 3 entries (thanks to Jeff Exbrayat, CoECSCC-CCRC)
@@ -626,9 +881,9 @@ def check_zeros_values(varval,date,gvars,filet):
       filename=gvars.pathin+filet+'_'+gvars.domain+'_'+str(date[tstep].year)+'-'+mm+'-01_00:00:00'
       fin=nc.Dataset(filename,mode='r')
       if filet=='wrfxtrm':
-        temp=fin.variables['T2MEAN'][:]
+        temp=fin.variables['T2MEAN'][get_window_index(3,gvars.window)]
       if filet=='wrfdly':
-        temp=fin.variables['UV10MAX5'][:]
+        temp=fin.variables['UV10MAX5'][get_window_index(3,gvars.window)]
       nn=int(date[tstep].day)-1
       Zero2 = np.all(temp[nn,:,:]==0)
 
@@ -656,6 +911,8 @@ def create_netcdf(info,gvars, varval, time, time_bnds):
        
   By default, the module do not overwrite the file so if there is one with the same name then 
   the script does not do anything.
+  The variable is written in blocks of time steps (see ncwriter), so that only one block
+  is converted to float32 at a time.
 
   Input: global  attributres from pre-defined classes:   
   Output: a netcdf file
@@ -665,146 +922,336 @@ def create_netcdf(info,gvars, varval, time, time_bnds):
 
   """
   print '\n', ' CALLING CREATE_NETCDF MODULE ','\n'
-  import numpy as np
-  import netCDF4 as nc
-  import sys
-  
 
-  file_out=info[0]
-  varname=info[1]
-  varatt=info[2]
-  time_bounds=info[3]
+  fout=ncwriter(info,gvars,varval.shape,time,time_bnds)
+  complete=False
+  try:
+    nt_block=fout.get_write_block()
+    for it in xrange(0,varval.shape[0],nt_block):
+      fout.write(varval[it:it+nt_block],it)
+    complete=True
+  finally:
+    fout.close(complete)
+    
+  print '     ------------  SUCCESFULLY CREATED!!!  ------------ '
 
-  # **********************************************************************
-  # Read attributes from the geo_file of the corresponding domain
-  fin1=nc.Dataset(gvars.fileref_att,mode='r')
-  temp=fin1.variables['XLONG']
-  if temp.ndim==2:
-    lon=np.squeeze(fin1.variables['XLONG'][:]) # Getting longitude
-    lat=np.squeeze(fin1.variables['XLAT'][:]) # Getting latitude
-  if temp.ndim==3:
-    lon=np.squeeze(fin1.variables['XLONG'][0,:,:]) # Getting longitude
-    lat=np.squeeze(fin1.variables['XLAT'][0,:,:]) # Getting latitude
-  dx=getattr(fin1, 'DX')
-  dy=getattr(fin1, 'DY')
-  cen_lat=getattr(fin1, 'CEN_LAT')
-  cen_lon=getattr(fin1, 'CEN_LON')
-  pole_lat=getattr(fin1, 'POLE_LAT')
-  pole_lon=getattr(fin1, 'POLE_LON')
-  stand_lon=getattr(fin1, 'STAND_LON')
-  fin1.close()
-  sch_info=read_schemes(gvars.fileref_att) 
-
-  #**********************************************************************
-  # CREATING NETCDF FILE
-  # Create output file
-  fout=nc.Dataset(file_out,mode='w', format='NETCDF4_CLASSIC')
-
-  # ------------------------
-  # Create dimensions
-  print '   CREATING AND WRITING DIMENSIONS: '
-  print '              TIME, X, Y(, TIME_BNDS)'
-  fout.createDimension('x',varval.shape[2])
-  fout.createDimension('y',varval.shape[1])
-  fout.createDimension('time',None)
-  fout.createDimension('bnds', 2)
-
-  # ------------------------
-  # Create and assign values to variables
-  print "\n"
-  print '   CREATING AND WRITING VARIABLES:'
-
-  # VARIABLE: longitude
-  print '    ---   LONGITUDE VARIABLE CREATED ' 
-  varout=fout.createVariable('lon','f',['y', 'x'])
-  varout[:]=lon[:]
-  setattr(varout, 'standard_name','longitude')
-  setattr(varout, 'long_name','Longitude')
-  setattr(varout, 'units','degrees_east')
-  setattr(varout, '_CoordinateAxisType','Lon')
+
+#**************************************************************************************
+def get_refgrid(gvars):
+  """ Metadata of the reference file (gvars.fileref_att) written to all output files:
+  lon and lat of the whole domain, the attributes of the projection and the physics
+  schemes. They are read once per run and kept in gvars.refgrid, so the workers of
+  run_units receive them with gvars instead of opening the reference file.
+  """
+  if gvars.refgrid is None:
+    lon,lat=read_lonlat(gvars.fileref_att)
+    refgrid={'lon':lon,'lat':lat}
+    fin1=nc.Dataset(gvars.fileref_att,mode='r')
+    for att in ['DX','DY','CEN_LAT','CEN_LON','POLE_LAT','POLE_LON','STAND_LON']:
+      refgrid[att]=getattr(fin1,att)
+    fin1.close()
+    refgrid['schemes']=read_schemes(gvars.fileref_att)
+    gvars.refgrid=refgrid
+  return gvars.refgrid
+
+
+#**************************************************************************************
+class ncwriter:
+  """ Output netcdf file of a post-processed variable that is written in blocks of time steps.
+  The file is created and all the metadata (dimensions, lon, lat, time, time_bnds, 
+  Rotated_pole and global attributes) are written when the object is created. Then
+  the values of the variable are written block by block with write, and the file is 
+  closed with close:
+  
+    fout=ncwriter(netcdf_info,gvars,varval.shape,time,time_bnds)
+    fout.write(varval[0:100],0)
+    fout.write(varval[100:200])  # appended after the last block written
+    fout.close()
   
-  # VARIABLE: latitude
-  print '    ---   LATITUDE VARIABLE CREATED ' 
-  varout=fout.createVariable('lat','f',['y', 'x'])
-  varout[:]=lat[:]
-  setattr(varout, 'standard_name','latitude')
-  setattr(varout, 'long_name','Latitude')
-  setattr(varout, 'units','degrees_north')
-  setattr(varout, '_CoordinateAxisType','Lat')
-     
-  # VARIABLE: time 
-  print '    ---   TIME VARIABLE CREATED ' 
-  varout=fout.createVariable('time','f',['time'])
-  varout[:]=time[:]
-  setattr(varout, 'standard_name','time')
-  setattr(varout, 'long_name','time')
-  setattr(varout, 'bounds','time_bnds')
-  setattr(varout, 'units','hours since %s' %(gvars.ref_date.strftime("%Y-%m-%d %H:%M:%S")))
-  setattr(varout, 'calendar','standard')
-
-  # VARIABLE: time_bnds 
-  if time_bounds==True:
-    print '  ---   TIME_BNDS VARIABLE CREATED ' 
-    varout=fout.createVariable('time_bnds','f8',['time', 'bnds'])
-    varout[:]=time_bnds[:]
+  The file is written with the suffix .part and renamed to file_out by close, so an
+  interrupted run never leaves an incomplete file_out. close(False) removes it instead
+  (e.g. in the finally clause of a loop of writes that failed).
+  
+  info: [file_out, varname, varatt, time_bounds] as in create_netcdf
+  shape: shape of the whole variable (time, y, x)
+  time, time_bnds: time and time bounds of the whole variable. If they are None, 
+  they must be given with each block.
+  """
+  def __init__(self,info,gvars,shape,time=None,time_bnds=None,band_rows=None):
+    self.file_out=info[0]
+    self.varname=info[1]
+    varatt=info[2]
+    self.time_bounds=info[3]
+    self.shape=shape
+    self.band_rows=band_rows
+    self.nt_written=0
+
+    # **********************************************************************
+    # Attributes from the geo_file of the corresponding domain (read once per run)
+    refgrid=get_refgrid(gvars)
+    lon,lat=refgrid['lon'],refgrid['lat']
+    if gvars.window is not None:
+      lon=lon[gvars.window]
+      lat=lat[gvars.window]
+
+    #**********************************************************************
+    # CREATING NETCDF FILE
+    # Create output file (with a temporary name until it is closed)
+    self.fout=nc.Dataset(self.file_out+'.part',mode='w', format='NETCDF4_CLASSIC')
+    try:
+      self.create(gvars,varatt,time,time_bnds,lon,lat,refgrid)
+    except:
+      self.close(False)
+      raise
+    print '  ===> FILE: ', self.file_out
+
+  def create(self,gvars,varatt,time,time_bnds,lon,lat,refgrid):
+    """ Writes the dimensions, coordinates, attributes and metadata of the file
+    """
+    fout=self.fout
+    shape=self.shape
+    dx=refgrid['DX']
+    dy=refgrid['DY']
+    cen_lat=refgrid['CEN_LAT']
+    cen_lon=refgrid['CEN_LON']
+    pole_lat=refgrid['POLE_LAT']
+    pole_lon=refgrid['POLE_LON']
+    stand_lon=refgrid['STAND_LON']
+    sch_info=refgrid['schemes']
+    self.compression=get_varcompression(gvars,self.varname,shape,self.band_rows)
+
+    # ------------------------
+    # Create dimensions
+    print '   CREATING AND WRITING DIMENSIONS: '
+    print '              TIME, X, Y(, TIME_BNDS)'
+    fout.createDimension('x',shape[2])
+    fout.createDimension('y',shape[1])
+    fout.createDimension('time',None)
+    fout.createDimension('bnds', 2)
+
+    # ------------------------
+    # Create and assign values to variables
+    print "\n"
+    print '   CREATING AND WRITING VARIABLES:'
+
+    # VARIABLE: longitude
+    print '    ---   LONGITUDE VARIABLE CREATED ' 
+    varout=fout.createVariable('lon','f',['y', 'x'],zlib=self.compression['zlib'])
+    varout[:]=lon[:]
+    setattr(varout, 'standard_name','longitude')
+    setattr(varout, 'long_name','Longitude')
+    setattr(varout, 'units','degrees_east')
+    setattr(varout, '_CoordinateAxisType','Lon')
+    
+    # VARIABLE: latitude
+    print '    ---   LATITUDE VARIABLE CREATED ' 
+    varout=fout.createVariable('lat','f',['y', 'x'],zlib=self.compression['zlib'])
+    varout[:]=lat[:]
+    setattr(varout, 'standard_name','latitude')
+    setattr(varout, 'long_name','Latitude')
+    setattr(varout, 'units','degrees_north')
+    setattr(varout, '_CoordinateAxisType','Lat')
+       
+    # VARIABLE: time 
+    print '    ---   TIME VARIABLE CREATED ' 
+    varout=fout.createVariable('time','f',['time'])
+    if time is not None:
+      varout[:]=time[:]
+    setattr(varout, 'standard_name','time')
+    setattr(varout, 'long_name','time')
+    setattr(varout, 'bounds','time_bnds')
     setattr(varout, 'units','hours since %s' %(gvars.ref_date.strftime("%Y-%m-%d %H:%M:%S")))
     setattr(varout, 'calendar','standard')
-    
-  # VARIABLE: variable
-  print '    ---   ',varname, ' VARIABLE CREATED ' 
-  varout=fout.createVariable(varname,'f',['time', 'y', 'x'], fill_value=varatt['_FillValue'])
-  varout[:]=varval[:]
-  for att in varatt.keys():
-    if att!='_FillValue':
-      if varatt[att]!=None:
-        setattr(varout, att, varatt[att])
+
+    # VARIABLE: time_bnds 
+    if self.time_bounds==True:
+      print '  ---   TIME_BNDS VARIABLE CREATED ' 
+      varout=fout.createVariable('time_bnds','f8',['time', 'bnds'])
+      if time_bnds is not None:
+        varout[:]=time_bnds[:]
+      setattr(varout, 'units','hours since %s' %(gvars.ref_date.strftime("%Y-%m-%d %H:%M:%S")))
+      setattr(varout, 'calendar','standard')
       
-  # VARIABLE: Rotated_Pole 
-  print '    ---   Rotated_pole VARIABLE CREATED ' 
-  varout=fout.createVariable('Rotated_pole','c',[])
-  setattr(varout, 'grid_mapping_name', 'rotated_latitude_longitude')
-  setattr(varout, 'dx_m', dx)
-  setattr(varout, 'dy_m', dy)
-  setattr(varout, 'latitude_of_projection_origin', cen_lat)
-  setattr(varout, 'longitude_of_central_meridian',cen_lon)
-  setattr(varout, 'true_longitude_of_projection',stand_lon)
-  setattr(varout, 'grid_north_pole_latitude',  pole_lat)
-  setattr(varout, 'grid_north_pole_longitude', pole_lon)
-    
-  # WRITE GLOBAL ATTRIBUTES
-  print '\n', ' CREATING AND WRITING GLOBAL ATTRIBUTES:'
-  gblatt = get_globatt(gvars.GCM,gvars.RCM,sch_info)
-  for att in gblatt.keys():
-    setattr(fout, att, gblatt[att])
-  fout.close()
-  print '  ===> FILE: ', file_out
-    
-  print '     ------------  SUCCESFULLY CREATED!!!  ------------ '
+    # VARIABLE: variable
+    print '    ---   ',self.varname, ' VARIABLE CREATED ' 
+    varout=fout.createVariable(self.varname,'f',['time', 'y', 'x'], fill_value=varatt['_FillValue'],**self.compression)
+    for att in varatt.keys():
+      if att not in ['_FillValue','least_significant_digit']:
+        if varatt[att]!=None:
+          setattr(varout, att, varatt[att])
+        
+    # VARIABLE: Rotated_Pole 
+    print '    ---   Rotated_pole VARIABLE CREATED ' 
+    varout=fout.createVariable('Rotated_pole','c',[])
+    setattr(varout, 'grid_mapping_name', 'rotated_latitude_longitude')
+    setattr(varout, 'dx_m', dx)
+    setattr(varout, 'dy_m', dy)
+    setattr(varout, 'latitude_of_projection_origin', cen_lat)
+    setattr(varout, 'longitude_of_central_meridian',cen_lon)
+    setattr(varout, 'true_longitude_of_projection',stand_lon)
+    setattr(varout, 'grid_north_pole_latitude',  pole_lat)
+    setattr(varout, 'grid_north_pole_longitude', pole_lon)
+      
+    # WRITE GLOBAL ATTRIBUTES
+    print '\n', ' CREATING AND WRITING GLOBAL ATTRIBUTES:'
+    gblatt = get_globatt(gvars.GCM,gvars.RCM,sch_info,changes=gvars.globatt_changes)
+    if gvars.window is not None:
+      gblatt['domain_subset']="y=%s:%s, x=%s:%s of domain %s (zero-based, end excluded)" %(gvars.window[0].start,
+        gvars.window[0].stop,gvars.window[1].start,gvars.window[1].stop,gvars.domain)
+    for att in gblatt.keys():
+      setattr(fout, att, gblatt[att])
+
+  def get_write_block(self,blockbytes=64*1024*1024):
+    """ Number of time steps written at once: as many as fit in blockbytes (in float32),
+    rounded to whole chunks along time so that no chunk is written twice.
+    """
+    nt_chunk=1
+    if 'chunksizes' in self.compression.keys():
+      nt_chunk=self.compression['chunksizes'][0]
+    nt_block=max(1,blockbytes/(4*self.shape[1]*self.shape[2]))
+    return max(1,nt_block/nt_chunk)*nt_chunk
+
+  def write(self,varval,tstart=None,time=None,time_bnds=None,ystart=None):
+    """ Writes a block of time steps of the variable starting at time index tstart
+    (after the last block written if tstart is None). The conversion to float32 is
+    done only for this block. If ystart is given, the block has only some rows of
+    the domain, starting at row ystart (see process_banded).
+    """
+    if tstart is None:
+      tstart=self.nt_written
+    tend=tstart+varval.shape[0]
+    if ystart is None:
+      self.fout.variables[self.varname][tstart:tend]=varval.astype(np.float32)
+    else:
+      self.fout.variables[self.varname][tstart:tend,ystart:ystart+varval.shape[1],:]=varval.astype(np.float32)
+    if time is not None:
+      self.fout.variables['time'][tstart:tend]=time[:]
+    if (time_bnds is not None) and (self.time_bounds==True):
+      self.fout.variables['time_bnds'][tstart:tend]=time_bnds[:]
+    self.nt_written=max(self.nt_written,tend)
+
+  def close(self,complete=True):
+    """ Closes the file and renames it to file_out, or removes it if it is not complete
+    """
+    self.fout.close()
+    if complete:
+      os.rename(self.file_out+'.part',self.file_out)
+    else:
+      os.remove(self.file_out+'.part')
 
 
 #**************************************************************************************
+class writerpool:
+  """ Write stage of the high-frequency loop. When gvars.async_write is True the output 
+  files are written by a dedicated writer process, so that reading and computing the
+  next variable/period overlaps with the compression and writing of the previous one.
+  Otherwise create_netcdf is called directly.
+  
+  Memory is bounded: submit blocks while the variables waiting to be written (in 
+  the queue or being written) plus the new one exceed maxbytes. Each of them is
+  counted twice its serialized size (see get_task_nbytes): until the writer process
+  gets it, it is held pickled in the queue, and then unpickled in the writer.
 
-def checkpoint(ctime):
-  import time
-
-  """ Computes the spent time from the last checkpoint
-      
-  Input: a given time
-  Output: present time
-  Print: the difference between the given time and present time
-  Author: Alejandro Di Luca
-  Created: 07/08/2013
-  Last Modification: 14/08/2013
+  If a file cannot be written, or the writer process dies, the run stops at the next
+  submit (or in close) with an error.
   
+    writer=writerpool(gvars)
+    writer.submit(netcdf_info, varval, time, time_bnds)
+    ...
+    writer.close()  # waits until all files are written
   """
-  if ctime==0:
-    ctime=time.time()
-    dtime=0
-  else:
-    dtime=time.time()-ctime
-    ctime=time.time()
-    print '======> DONE in ',float('%.2g' %(dtime)),' seconds',"\n"
-  return ctime
+  def __init__(self,gvars,maxbytes=2*1024*1024*1024):
+    self.gvars=gvars
+    self.maxbytes=maxbytes
+    self.pending={}
+    self.errors=[]
+    self.process=None
+    if gvars.async_write:
+      # Anything still buffered would otherwise be written twice to the log
+      sys.stdout.flush()
+      self.tasks=multiprocessing.Queue()
+      self.done=multiprocessing.Queue()
+      # The run does not wait at exit to flush the tasks to a writer that stopped (close
+      # returns only when all tasks were written, so nothing else is dropped)
+      self.tasks.cancel_join_thread()
+      self.process=multiprocessing.Process(target=writer_loop,args=(gvars,self.tasks,self.done))
+      self.process.daemon=True
+      self.process.start()
+
+  def submit(self,info,varval,time,time_bnds):
+    if self.process is None:
+      create_netcdf(info,self.gvars,varval,time,time_bnds)
+      return
+    # The run stops as soon as a file could not be written
+    while len(self.pending)>0 and self.wait_one(block=False):
+      pass
+    if len(self.errors)>0:
+      sys.exit('ERROR: the following files could not be written: %s' %(self.errors))
+    if not self.process.is_alive():
+      sys.exit('ERROR: the writer process stopped before writing %s' %(self.pending.keys()))
+    nbytes=2*get_task_nbytes(varval,time,time_bnds)
+    while len(self.pending)>0 and sum(self.pending.values())+nbytes>self.maxbytes:
+      self.wait_one()
+    print '  --> FILE QUEUED FOR WRITING: ', info[0]
+    self.pending[info[0]]=nbytes
+    self.tasks.put((info,varval,time,time_bnds))
+
+  def wait_one(self,block=True):
+    """ Waits until the writer process finishes one of the pending files. If block is
+    False, only a file already finished is taken: returns False if there is none.
+    """
+    while True:
+      try:
+        file_out,nbytes,error=self.done.get(block,1)
+        break
+      except Queue.Empty:
+        if not block:
+          return False
+        if not self.process.is_alive():
+          sys.exit('ERROR: the writer process stopped before writing %s' %(self.pending.keys()))
+    del self.pending[file_out]
+    if error is not None:
+      print 'ERROR writing %s: %s' %(file_out,error)
+      self.errors.append(file_out)
+    return True
+
+  def close(self):
+    if self.process is None:
+      return
+    self.tasks.put(None)
+    while len(self.pending)>0:
+      self.wait_one()
+    self.process.join()
+    self.process=None
+    if len(self.errors)>0:
+      sys.exit('ERROR: the following files could not be written: %s' %(self.errors))
+
+
+#**************************************************************************************
+def writer_loop(gvars,tasks,done):
+  """ Main loop of the writer process of writerpool. Writes the files in the order
+  they were submitted until it gets None.
+  """
+  while True:
+    task=tasks.get()
+    if task is None:
+      break
+    info,varval,time,time_bnds=task
+    error=None
+    try:
+      create_netcdf(info,gvars,varval,time,time_bnds)
+    except (Exception,SystemExit) as e:
+      error=str(e)
+    sys.stdout.flush()
+    done.put((info[0],varval.nbytes,error))
+
+
+def get_task_nbytes(*arrays):
+  """ Size in bytes of a task of writerpool once pickled: the data of its arrays
+  (numpy arrays are pickled whole, the rest of the task is negligible)
+  """
+  return sum([np.asarray(array).nbytes for array in arrays if array is not None])
+
 
 #**************************************************************************************
 
@@ -861,105 +1308,265 @@ def get_yearsfile(fileall,varname):
 
 
 # ***********************************************************
-def create_dailyfiles(gvars,varname,stat_all, varinfo):
-  syp=gvars.syear
+# The daily (and monthly) statistics are computed in work units: each unit reads
+# its own files, computes one statistic and writes one output file, so the units
+# are independent and they are run in parallel by run_units.
+
+# Arrays of the size of the fields read (float64) alive at the same time in a unit
+# of the daily statistics (fields read, reshaped and statistic)
+DAILY_WORK_FACTOR=3
+
+def get_daily_units(gvars,varname,stat_all,varinfo):
+  """ Work units of the daily statistics of varname whose files are still to be
+      written: one per 5-year block, with the statistics missing in that block, so
+      the block is read once and only if some statistic has to be written. Each unit
+      is a dictionary with the files of the block, the statistics and their output
+      files and the predicted memory (nbytes).
+  """
   fullpathout=create_outdir(gvars)
   fileall=sorted(glob.glob('%s/%s0?H_*_%s.nc' %(fullpathout,gvars.outfile_patt,varname)))
-  fileref=nc.Dataset(fileall[0],'r')
   syfile,eyfile=get_yearsfile(fileall,varname)
+  units=[]
+  syp=gvars.syear
   while syp<gvars.eyear:
-    ctime_var=checkpoint(0)
     eyp=((int(syp)/5)+1)*5
-    loadfile=False
+    stats=[]
     for stat in stat_all:
       varstat, targetunused = varinfo.get_source_variables_for_daily_stat(varname, stat)
-     
       file_out='%s/%sDAY_%s-%s_%s.nc' % (fullpathout,gvars.outfile_patt,syp,eyp-1,varstat) # Specify output file
       filewrite=checkfile(file_out,gvars.overwrite)
       if filewrite==True:
-        loadfile=True
-    if loadfile==True:
-
-      print 'PROCESSING PERIOD %s-%s for variable %s' %(syp,eyp,varname)
+        stats.append({'stat':stat,'varstat':varstat,'file_out':file_out})
+    if len(stats)>0:
       sel_files=[fileall[i] for i in xrange(len(syfile)) if ((syfile[i]>=syp) & (eyfile[i]<eyp))]
-      files=nc.MFDataset(sel_files)
-      time=nc.num2date(files.variables['time'][:],units=files.variables['time'].units)
-      var=files.variables[varname][:]
-      ctime=checkpoint(ctime_var)
-
-      for stat in stat_all:
-        ctime_var=checkpoint(0)
-        if varname in ['pracc','prcacc','prncacc']:
-          varstat=varname
-        else:
-          varstat=varname+stat
-        file_out='%s/%sDAY_%s-%s_%s.nc' % (fullpathout,gvars.outfile_patt,syp,eyp-1,varstat) # Specify output file
-        filewrite=checkfile(file_out,gvars.overwrite)
-        if filewrite==True:
-          dvar,dtime=coms.compute_daily(var,time,stat)
-          dtime_nc=date2hours(dtime,gvars.ref_date)
-          time_bnds=create_timebnds(dtime_nc)
-          varatt={}
-          for att in fileref.variables[varname].ncattrs():
-            varatt[att]=getattr(fileref.variables[varname],att)
-
-          # INFO NEEDED TO WRITE THE OUTPUT NETCDF
-          netcdf_info=[file_out, varstat, varatt, True]
-
-          # CREATE NETCDF FILE
-          print 'yes'
-          create_netcdf(netcdf_info,gvars, dvar, dtime_nc, time_bnds)
-          ctime=checkpoint(ctime_var)
-          print '=====================================================', '\n', '\n', '\n'
+      units.append({'varname':varname,'syp':syp,'eyp':eyp,'files':sel_files,'stats':stats,
+                    'nbytes':DAILY_WORK_FACTOR*sum([get_file_nbytes(filename,[varname]) for filename in sel_files])})
     syp=eyp
+  return units
+
+
+def run_daily_unit(gvars,unit):
+  """ Reads the files of a unit of get_daily_units and computes and writes its daily
+      statistics. The daily time axis is computed from the hours of the files (the
+      days start at multiples of 24 hours since gvars.ref_date).
+  """
+  varname=unit['varname']
+  syp,eyp=unit['syp'],unit['eyp']
+  print 'PROCESSING PERIOD %s-%s for variable %s (%s)' %(syp,eyp,varname,
+        ', '.join([stat['stat'] for stat in unit['stats']]))
+  span=tr.trace.start('read',var=varname,period='%s-%s' %(syp,eyp-1),stage='daily')
+  files=nc.MFDataset(unit['files'])
+  try:
+    hours=files.variables['time'][:].astype(np.float64)
+    tref=nc.num2date(0,units=files.variables['time'].units)
+    var=files.variables[varname][:]
+    varatt={}
+    for att in files.variables[varname].ncattrs():
+      varatt[att]=getattr(files.variables[varname],att)
+  finally:
+    files.close()
+  tr.trace.stop(span,nbytes=var.nbytes)
+
+  hours=hours+date2hours([tref],gvars.ref_date)[0]
+  day0=np.floor(hours[0]/24.)
+  ndays=int(np.floor(hours[-1]/24.)-day0)+1
+  dtime_nc=(day0+np.arange(ndays))*24.+12.
+  time_bnds=create_timebnds(dtime_nc)
+  if var.shape[0]%ndays!=0:
+    sys.exit('ERROR in run_daily_unit: %s time steps of %s do not make %s days of the same number of steps' %(
+             var.shape[0],varname,ndays))
+
+  for stat in unit['stats']:
+    span=tr.trace.start('daily',var=varname,stat=stat['stat'],period='%s-%s' %(syp,eyp-1))
+    dvar=coms.compute_daily_steps(var,ndays,stat['stat'])
+
+    # INFO NEEDED TO WRITE THE OUTPUT NETCDF
+    netcdf_info=[stat['file_out'], stat['varstat'], varatt, True]
+
+    # CREATE NETCDF FILE
+    create_netcdf(netcdf_info,gvars, dvar, dtime_nc, time_bnds)
+    tr.trace.stop(span,nbytes=dvar.nbytes)
+    print '=====================================================', '\n', '\n', '\n'
+
+
+def create_dailyfiles(gvars,varname,stat_all, varinfo):
+  run_units(gvars,run_daily_unit,get_daily_units(gvars,varname,stat_all,varinfo),'daily')
 
 
 # ***********************************************************
-def create_monthlyfiles(gvars,varname,stat_all, varinfo):
-  syp=gvars.syear
+def run_units(gvars,function,units,stage):
+  """ Runs function(gvars,unit) for all units (see get_daily_units) in up to
+      gvars.workers processes: as many as fit in the memory budget with the largest
+      unit. The messages, spans and reads of each unit are written to the log and
+      the trace of the run unit by unit, in the order of units. If the run is
+      profiled, the workers profile the same stages and their profiles are added
+      to that of the run.
+  """
+  if len(units)==0:
+    return
+  get_refgrid(gvars)
+  nbytes=max([unit['nbytes'] for unit in units])
+  njobs=min(gvars.workers,len(units),max(1,int(gvars.memory/max(nbytes,1))))
+  print '  -->  %s STATISTICS: %s work units in %s processes (%.3f GB predicted each)' %(stage.upper(),
+        len(units),njobs,nbytes/1024.**3)
+  span=tr.trace.start(stage+'_stage',units=len(units),jobs=njobs)
+  if njobs==1:
+    for unit in units:
+      function(gvars,unit)
+  else:
+    from joblib import Parallel, delayed
+    stages=None
+    if tr.trace.profiler is not None:
+      stages=tr.trace.profiler.stages
+    results=Parallel(n_jobs=njobs)(delayed(run_unit_worker)(function,gvars,unit,stages) for unit in units)
+    for output,records,reads,profile in results:
+      sys.stdout.write(output)
+      tr.trace.add_records(records)
+      tr.io.extend(reads)
+      if profile is not None:
+        tr.trace.profiler.add_results(profile)
+  tr.trace.stop(span)
+
+
+def run_unit_worker(function,gvars,unit,stages=None):
+  """ Runs a unit in a worker of run_units. Returns its messages, the records of its
+      spans, its reads and the profile of the stages (None if stages is None), which
+      are added to those of the run.
+  """
+  stdout=sys.stdout
+  sys.stdout=StringIO.StringIO()
+  tr.trace=tr.tracer()
+  tr.trace.records=[]
+  if stages is not None:
+    tr.trace.profiler=tr.profiler(stages)
+  tr.io.take()
+  try:
+    function(gvars,unit)
+    output=sys.stdout.getvalue()
+  finally:
+    sys.stdout=stdout
+  profile=None
+  if tr.trace.profiler is not None:
+    profile=tr.trace.profiler.get_results()
+  return output,tr.trace.records,tr.io.take(),profile
+
+
+# ***********************************************************
+# Arrays of the size of the daily fields read (float64) alive at the same time in a
+# unit of the monthly statistics
+MONTHLY_WORK_FACTOR=2
+
+def get_monthly_units(gvars,varname,stat_all,varinfo):
+  """ Work units of the monthly statistics of varname whose files are still to be
+      written: one per source daily variable (see get_source_variables_for_monthly_stat
+      in variables_info.py) and decade, with all the statistics computed from it
+      (e.g. tasmax for tasmax and tasmaxmean), so each source file is read once.
+      The attributes of the source variable are read once and given with the units.
+  """
   fullpathout=create_outdir(gvars)
+  units=[]
+  sources={}
   for stat in stat_all:
     sourcestat, targetstat = varinfo.get_source_variables_for_monthly_stat(varname, stat)
     print "create_monthlyfiles: processing %(source)s, %(stat)s, %(vname)s" % {
             'source':sourcestat, 'target': targetstat, 'stat':stat, 'vname':varname
             }
 
-    fileall=sorted(glob.glob('%s/%sDAY_*_%s.nc' %(fullpathout,gvars.outfile_patt,sourcestat)))
-    print '%s/%sDAY_*_%s.nc' %(fullpathout,gvars.outfile_patt,sourcestat)
-    fileref=nc.Dataset(fileall[0],'r')
-    syfile,eyfile=get_yearsfile(fileall,sourcestat)
+    if sourcestat not in sources:
+      fileall=sorted(glob.glob('%s/%sDAY_*_%s.nc' %(fullpathout,gvars.outfile_patt,sourcestat)))
+      print '%s/%sDAY_*_%s.nc' %(fullpathout,gvars.outfile_patt,sourcestat)
+      sources[sourcestat]={'files':fileall,'years':get_yearsfile(fileall,sourcestat),'varatt':None,'units':{}}
+    source=sources[sourcestat]
+    syfile,eyfile=source['years']
     syp=gvars.syear
     while syp<gvars.eyear:
-      print 'start period year:', syp
-      ctime_var=checkpoint(0)
       eyp=((int(syp)/10)+1)*10
-      print 'PROCESSING PERIOD %s-%s for variable %s' %(syp,eyp,sourcestat)
-      sel_files=[fileall[i] for i in xrange(len(syfile)) if ((syfile[i]>=syp) & (eyfile[i]<eyp))]
-      files=nc.MFDataset(sel_files)
-      time=nc.num2date(files.variables['time'][:],units=files.variables['time'].units)
-      var=files.variables[sourcestat][:]
-      ctime=checkpoint(ctime_var)
       file_out=fullpathout+'/%sMON_%s-%s_%s.nc' % (gvars.outfile_patt,syp,eyp-1,targetstat) # Specify output file
       filewrite=checkfile(file_out,gvars.overwrite)
       if filewrite==True:
-        mvar,mtime=coms.compute_monthly(var,time,stat)
-        mtime_nc=date2hours(mtime,gvars.ref_date)
-        mtime_bnds_inf=date2hours([dt.datetime(mtime[i].year,mtime[i].month,1,0,0,0) for i in xrange(len(mtime))],gvars.ref_date)
-        mtime_bnds_sup=date2hours([dt.datetime(mtime[i].year,mtime[i].month,1,0,0,0)+relativedelta(months=1) for i in xrange(len(mtime))],gvars.ref_date)
-        mtime_bnds=np.reshape(np.concatenate([mtime_bnds_inf,mtime_bnds_sup],axis=0), (len(mtime),2),order='F')
-        varatt={}
-
-        for att in fileref.variables[sourcestat].ncattrs():
-          varatt[att]=getattr(fileref.variables[sourcestat],att)
-        
-        # INFO NEEDED TO WRITE THE OUTPUT NETCDF
-        netcdf_info=[file_out, targetstat, varatt, True]
-
-        # CREATE NETCDF FILE
-        create_netcdf(netcdf_info,gvars,mvar, mtime_nc, mtime_bnds)
-        ctime=checkpoint(ctime_var)
-        print '=====================================================', '\n', '\n', '\n'
+        if syp not in source['units']:
+          sel_files=[source['files'][i] for i in xrange(len(syfile)) if ((syfile[i]>=syp) & (eyfile[i]<eyp))]
+          if source['varatt'] is None:
+            fileref=nc.Dataset(source['files'][0],'r')
+            source['varatt']={}
+            for att in fileref.variables[sourcestat].ncattrs():
+              source['varatt'][att]=getattr(fileref.variables[sourcestat],att)
+            fileref.close()
+          unit={'varname':varname,'sourcestat':sourcestat,'syp':syp,'eyp':eyp,'files':sel_files,
+                'varatt':source['varatt'],'stats':[],
+                'nbytes':MONTHLY_WORK_FACTOR*sum([get_file_nbytes(filename,[sourcestat]) for filename in sel_files])}
+          source['units'][syp]=unit
+          units.append(unit)
+        source['units'][syp]['stats'].append({'stat':stat,'targetstat':targetstat,'file_out':file_out})
       syp=eyp
+  return units
+
+
+def run_monthly_unit(gvars,unit):
+  """ Reads the files of a unit of get_monthly_units and computes and writes all its
+      monthly statistics. The months are computed from the hours of the files (see
+      get_months).
+  """
+  sourcestat=unit['sourcestat']
+  syp,eyp=unit['syp'],unit['eyp']
+  print 'PROCESSING PERIOD %s-%s for variable %s (%s)' %(syp,eyp,sourcestat,
+        ', '.join([stat['stat'] for stat in unit['stats']]))
+  span=tr.trace.start('read',var=sourcestat,period='%s-%s' %(syp,eyp-1),stage='monthly')
+  files=nc.MFDataset(unit['files'])
+  try:
+    hours=files.variables['time'][:].astype(np.float64)
+    tref=nc.num2date(0,units=files.variables['time'].units)
+    var=files.variables[sourcestat][:]
+  finally:
+    files.close()
+  tr.trace.stop(span,nbytes=var.nbytes)
+
+  hours=hours+date2hours([tref],gvars.ref_date)[0]
+  months,first=get_months(hours,gvars.ref_date)
+  nmonths=months[-1]
+  mtime_bnds=get_monthbnds(first,nmonths,gvars.ref_date)
+  # Middle of the first and last time steps of each month (of the bounds for the
+  # months without time steps, which are missing values)
+  mtime_nc=mtime_bnds.mean(axis=1)
+  for mo in xrange(nmonths):
+    hours_m=hours[months==mo+1]
+    if len(hours_m)>0:
+      mtime_nc[mo]=(hours_m[0]+hours_m[-1])/2.
+
+  for stat in unit['stats']:
+    span=tr.trace.start('monthly',var=unit['varname'],stat=stat['stat'],period='%s-%s' %(syp,eyp-1))
+    mvar=coms.compute_monthly_steps(var,months,stat['stat'])
+
+    # INFO NEEDED TO WRITE THE OUTPUT NETCDF
+    netcdf_info=[stat['file_out'], stat['targetstat'], unit['varatt'], True]
+
+    # CREATE NETCDF FILE
+    create_netcdf(netcdf_info,gvars,mvar, mtime_nc, mtime_bnds)
+    tr.trace.stop(span,nbytes=mvar.nbytes)
+    print '=====================================================', '\n', '\n', '\n'
+
+
+def get_months(hours,ref_date):
+  """ Month of each time of hours (hours since ref_date), counted from the month of
+      the first time (1), and that first month (numpy datetime64[M])
+  """
+  times=np.datetime64(ref_date,'s')+np.round(hours*3600.).astype(np.int64).astype('timedelta64[s]')
+  months=times.astype('datetime64[M]')
+  return (months-months[0]).astype(np.int64)+1,months[0]
+
+
+def get_monthbnds(first,nmonths,ref_date):
+  """ Time bounds (first hour of the month and of the next month) of nmonths
+      consecutive months from first (numpy datetime64[M]), in hours since ref_date:
+      array (nmonths,2)
+  """
+  edges=np.arange(first,first+nmonths+1)
+  hours=(edges.astype('datetime64[h]')-np.datetime64(ref_date,'h')).astype(np.float64)
+  return np.column_stack([hours[:-1],hours[1:]])
+
+
+def create_monthlyfiles(gvars,varname,stat_all, varinfo):
+  run_units(gvars,run_monthly_unit,get_monthly_units(gvars,varname,stat_all,varinfo),'monthly')
 
 
 
@@ -998,15 +1605,37 @@ def file_list(gvars,per,per_f,filet,n_files):
   return list(files_in)
   
 # ***********************************************************
-def read_list(files_list,var):
+def read_list(files_list,var,gvars=None):
+  """ Reads the WRF fields needed to compute var from all files in files_list.
+      var can also be a list of variables: the fields needed by all of them are
+      read at once (see get_read_groups in variables_info.py).
+      If gvars is given and it has a cache_dir, the fields are taken from the
+      field cache (see field_cache.py) when possible.
+  """
   from joblib import Parallel, delayed
-  ctime_read=checkpoint(0)
+  if type(var)==list:
+    span=tr.trace.start('read',var=','.join(var))
+  else:
+    span=tr.trace.start('read',var=var)
 
   print '  -->  READING FILES '
-  wrfvar=(getwrfname(var)[0]).split('-')
+  if type(var)==list:
+    wrfvar=VARINFO.get_group_inputs(var)
+  else:
+    wrfvar=(getwrfname(var)[0]).split('-')
+  cache=get_fieldcache(gvars)
+  window=None
+  if gvars is not None:
+    window=gvars.window
 
            
-  if len(files_list)<=15:
+  # Short lists are read by this process, long ones by gvars.io_jobs parallel readers
+  njobs=10
+  min_files=15
+  if gvars is not None:
+    njobs=gvars.io_jobs
+    min_files=gvars.io_min_files
+  if len(files_list)<=min_files or njobs==1:
     method='MFDataset'
   else:
     method='Dataset'
@@ -1015,13 +1644,12 @@ def read_list(files_list,var):
   # ---------------------
   if method=='MFDataset':
     print files_list
-    fin=nc.MFDataset(files_list) # Read all files
-    print '   -->   EXTRACTING VARIABLE Time'
-    time = fin.variables['Times'][:] # Get time variable
-  
-    print '   -->   EXTRACTING VARIABLE ',var
-    varvals=get_wrfvars(wrfvar,fin)
-    fin.close()
+    if cache is not None:
+      print '   -->   EXTRACTING VARIABLES Time and ',var,' (FIELD CACHE)'
+      time, varvals=read_block(files_list,wrfvar,cache,window)
+    else:
+      print '   -->   EXTRACTING VARIABLES Time and ',var
+      time, varvals=read_block(files_list,wrfvar,None,window)
    # ---------------------
 
 
@@ -1029,7 +1657,7 @@ def read_list(files_list,var):
   if method=='Dataset':
     varvals={}
 
-    njobs=10
+    njobs=min(njobs,len(files_list))
     nlen = len(files_list)/njobs #time step block length
     a=len(files_list)-njobs*nlen 
     nt_v=np.zeros(njobs)
@@ -1037,12 +1665,14 @@ def read_list(files_list,var):
     nt_v[njobs-1]=nlen+a #block length for each job
     nt_v=nt_v.cumsum()
   
-    files_in = [(files_list[0:int(nt_v[0])],wrfvar)]
+    files_in = [(files_list[0:int(nt_v[0])],wrfvar,cache,window)]
     for tt in np.arange(1,njobs):
-      files_in.append((files_list[int(nt_v[tt-1]):int(nt_v[tt])], wrfvar))
+      files_in.append((files_list[int(nt_v[tt-1]):int(nt_v[tt])], wrfvar,cache,window))
   
   
-    var_v = Parallel(n_jobs=njobs)(delayed(read_block)(*files_in[i]) for i in xrange(len(files_in)))
+    var_v = Parallel(n_jobs=njobs)(delayed(read_block_io)(*files_in[i]) for i in xrange(len(files_in)))
+    for i in np.arange(0,njobs):
+      tr.io.extend(var_v[i][2])
 
     for i in np.arange(0,njobs):
       if i==0:
@@ -1055,51 +1685,293 @@ def read_list(files_list,var):
           varvals[wrfv]=np.concatenate((varvals[wrfv],var_v[i][1][wrfv]))
   # ---------------------
 
-  ctime=checkpoint(ctime_read)
+  if cache is not None:
+    cache.evict()
+  tr.trace.stop(span,nbytes=tr.get_nbytes(varvals))
   return np.asarray(time), varvals
 
 #**************************************************************************************
-def read_block(files_in,wrfvar):
+def read_block(files_in,wrfvar,cache=None,window=None):
   """ Extract wrfvar and time variables from the list of files files_in.
       The output is an array with times and a dictionary caonting arrays with
       the different variables.
+      If a field cache is given, files are read one by one through the cache.
+      Only the subset window of the domain is read (all of it if window is None).
   """  
-  fin=nc.MFDataset(files_in) # Read all files
-  temptime = fin.variables['Times'][:] # Get time variable
-  tempvar=get_wrfvars(wrfvar,fin)
+  if cache is not None:
+    return read_block_cache(files_in,wrfvar,cache,window)
+
+  temptime=[]
+  tempvar={}
+  for wrfv in wrfvar:
+    tempvar[wrfv]=[]
+  for ifile in files_in:
+    times,fields=read_file(ifile,wrfvar,window)
+    temptime.append(times)
+    for wrfv in wrfvar:
+      tempvar[wrfv].append(fields[wrfv])
+
+  return np.concatenate(temptime), concatenate_fields(tempvar)
+
+#**************************************************************************************
+def read_block_io(files_in,wrfvar,cache=None,window=None):
+  """ read_block for the joblib workers of read_list: also returns the reads done
+      by the worker (see iostats in tracing.py), which are added to those of the run
+  """
+  tr.io.take()
+  temptime,tempvar=read_block(files_in,wrfvar,cache,window)
+  return temptime,tempvar,tr.io.take()
+
+#**************************************************************************************
+def read_file(ifile,wrfvar,window=None):
+  """ Times and fields wrfvar of a single file. The size of the fields and the time
+      spent are accounted in tracing.io.
+  """
+  tstart=time.time()
+  fin=nc.Dataset(ifile)
+  temptime=fin.variables['Times'][:]
+  tempvar=get_wrfvars(wrfvar,fin,window)
   fin.close()
+  tr.io.add(ifile,tr.get_nbytes(tempvar),time.time()-tstart)
+  return temptime,tempvar
 
-  return temptime, tempvar
-  
 #**************************************************************************************
-def read_block_Dataset(files_in,wrfvar):
-  """ Extract wrfvar and time variables from the list of files files_in.
-      The output is an array with times and a dictionary caonting arrays with
-      the different variables.
-      It does the same as read_block but using Dataset instead of MFDatset. It might
-      be slower than read_block but it has the advantage to work even if some files 
-      of the list do not have the same number of variables.
-  """  
+def concatenate_fields(tempvar):
+  """ Concatenates in time the list of fields of each variable of tempvar
+  """
+  for wrfv in tempvar.keys():
+    if np.any([np.ma.is_masked(field) for field in tempvar[wrfv]]):
+      tempvar[wrfv]=np.ma.concatenate(tempvar[wrfv])
+    else:
+      tempvar[wrfv]=np.concatenate(tempvar[wrfv])
+  return tempvar
+
+#**************************************************************************************
+def read_block_cache(files_in,wrfvar,cache,window=None):
+  """ Same as read_block, but the fields (and Times) of each file are taken
+      from the field cache if they are there. The original file is only opened if
+      any of the fields is missing, and the missing fields are added to the cache.
+  """
+  temptime=[]
   tempvar={}
-  for ff,ifile in enumerate(files_in):
-    fin=nc.Dataset(ifile) # Read all files
-    temptimet = fin.variables['Times'][:] # Get time variable
-    tempvart=get_wrfvars(wrfvar,fin)
-    fin.close()  
+  for wrfv in wrfvar:
+    tempvar[wrfv]=[]
+
+  for ifile in files_in:
+    fin=None
+    tstart=time.time()
+    nbytes=0
+    for wrfv in ['Times']+wrfvar:
+      if wrfv=='Times':
+        field=cache.get(ifile,wrfv)
+      else:
+        field=cache.get(ifile,wrfv,window)
+      if field is None:
+        if fin is None:
+          fin=nc.Dataset(ifile)
+        if wrfv=='Times':
+          field=fin.variables[wrfv][:]
+          cache.put(ifile,wrfv,field)
+        else:
+          field=read_wrfvar(fin.variables[wrfv],window)
+          nbytes=nbytes+field.nbytes
+          cache.put(ifile,wrfv,field,window)
+      if wrfv=='Times':
+        temptime.append(field)
+      else:
+        tempvar[wrfv].append(field.astype('float64'))
+    if fin is not None:
+      fin.close()
+      # Only the fields that were not in the cache were read from the file
+      tr.io.add(ifile,nbytes,time.time()-tstart)
 
-    if ff==0:
-      temptime=temptimet
-      tempvar=tempvart
+  return np.concatenate(temptime), concatenate_fields(tempvar)
+  
+#**************************************************************************************
+def read_times(files_list):
+  """ Times of the first and last files of files_list (enough to know the first
+      and last dates of the period without reading any field)
+  """
+  times=[]
+  for ifile in [files_list[0],files_list[-1]]:
+    fin=nc.Dataset(ifile)
+    times.append(fin.variables['Times'][:])
+    fin.close()
+  return np.concatenate(times)
 
-    else:
-      temptime=np.concatenate((temptime,temptimet))
-      for ii,wrfv in enumerate(wrfvar):
-        tempvar[wrfv]=np.concatenate((tempvar[wrfv],tempvart[wrfv]))
+#**************************************************************************************
+def process_chunked(infos,files_list,date,date_var,time,time_bnds,gvars):
+  """ Computes and writes the variables computed from 3-D fields (e.g. psl, ta850,
+      zg500) reading the WRF files in chunks of files (see get_chunk_files), so that
+      only the fields of a chunk are in memory. The fields needed by all the
+      variables are read once per chunk, and all the variables are computed and
+      written from it: the pressure-level variables of each field at all their
+      levels at once (see compute_plevel).
+
+      infos: [file_out, varname, None, time_bounds] of each variable; the attributes
+             are taken from the first chunk computed
+      date: dates of the whole output time axis (with leap days)
+      date_var: dates of the time steps in the files (without leap days in no_leap
+                simulations). Leap days are left as missing values.
+      time, time_bnds: time and time bounds of the whole output
+  """
+  varnames=[info[1] for info in infos]
+  span_var=tr.trace.start('chunked',var=','.join(varnames))
+  wrfvar=VARINFO.get_group_inputs(varnames)
+  # Levels of each pressure-level variable (e.g. {'ta': [200, 850]})
+  plevels=OrderedDict()
+  for var in varnames:
+    if VARINFO.get_plevel(var) is not None:
+      name,plev=VARINFO.get_plevel(var)
+      plevels.setdefault(name,[]).append(plev)
+  cache=get_fieldcache(gvars)
+  time_step=(date[1]-date[0]).total_seconds()
+  fouts={}
+  nvar=0
+  chunk_files=get_chunk_files(gvars,files_list,wrfvar)
+  print '  -->  READING AND COMPUTING %s IN CHUNKS OF %s FILES' %(', '.join(varnames),chunk_files)
+  complete=False
+  try:
+    for ff in xrange(0,len(files_list),chunk_files):
+      span=tr.trace.start('read',var='chunked')
+      times,varvals=read_block(files_list[ff:ff+chunk_files],wrfvar,cache,gvars.window)
+      tr.trace.stop(span,nbytes=tr.get_nbytes(varvals),verbose=False)
+      nt=times.shape[0]
+      chunk_dates=date_var[nvar:nvar+nt]
+      span=tr.trace.start('compute',var='chunked')
+      results={}
+      for name in plevels.keys():
+        for plev,result in zip(plevels[name],comv.compute_plevel(varvals,chunk_dates,gvars,name,plevels[name])):
+          results['%s%s' %(name,plev)]=result
+      for var in varnames:
+        if var not in results:
+          results[var]=getattr(comv,'compute_'+var)(varvals,chunk_dates,gvars)
+      tr.trace.stop(span,nbytes=sum([results[var][0].nbytes for var in varnames]),verbose=False)
+      del varvals
+
+      # Position of the chunk in the output time axis
+      index=np.asarray([int(round((dd-date[0]).total_seconds()/time_step)) for dd in chunk_dates])
+      span=tr.trace.start('write',var='chunked')
+      nbytes=0
+      for info in infos:
+        var=info[1]
+        varval,varatt=results.pop(var)
+        nbytes=nbytes+varval.nbytes
+        if var not in fouts:
+          fouts[var]=ncwriter([info[0],var,varatt,info[3]],gvars,(len(date),)+varval.shape[1:],time,time_bnds)
+        if index[-1]-index[0]+1==nt:
+          fouts[var].write(varval,index[0])
+        else:
+          block=np.ones((index[-1]-index[0]+1,)+varval.shape[1:])*const.missingval
+          block[index-index[0]]=np.ma.filled(varval,const.missingval)
+          fouts[var].write(block,index[0])
+      tr.trace.stop(span,nbytes=nbytes,verbose=False)
+      nvar=nvar+nt
+
+    if nvar!=len(date_var):
+      sys.exit('ERROR in process_chunked: %s time steps were read and %s were expected' %(nvar,len(date_var)))
+    complete=True
+  finally:
+    for fout in fouts.values():
+      fout.close(complete)
+  if cache is not None:
+    cache.evict()
+  tr.trace.stop(span_var)
 
+#**************************************************************************************
+# Memory needed to compute a chunk, relative to the size of its fields
+CHUNK_WORK_FACTOR=4
+
+def get_chunk_files(gvars,files_list,wrfvar):
+  """ Number of files read at once by process_chunked: chunk_files of the input
+      file, or as many files as fit in the memory budget. The fields of a chunk
+      (float64, over the window) take CHUNK_WORK_FACTOR times their size while
+      they are computed.
+  """
+  if gvars.chunk_files is not None:
+    return gvars.chunk_files
+  nbytes=get_file_nbytes(files_list[0],wrfvar,gvars.window)
+  chunk_files=int(gvars.memory/(CHUNK_WORK_FACTOR*nbytes))
+  return max(1,min(chunk_files,len(files_list)))
+
+#**************************************************************************************
+def get_file_nbytes(filename,wrfvar,window=None):
+  """ Size in memory (float64) of the fields wrfvar of a file, over the window
+  """
+  fin=nc.Dataset(filename)
+  nbytes=0
+  for wrfv in wrfvar:
+    shape=list(fin.variables[wrfv].shape)
+    if window is not None:
+      shape[-2]=len(xrange(*window[0].indices(shape[-2])))
+      shape[-1]=len(xrange(*window[1].indices(shape[-1])))
+    nbytes=nbytes+8*np.prod(shape)
+  fin.close()
+  return nbytes
+
+#**************************************************************************************
+def process_banded(info,files_list,date,date_var,time,time_bnds,compute,gvars,filet,per_f,time_step,bands):
+  """ Reads, computes, checks and writes a variable band by band of rows of the
+      domain, so that only the fields of a band are in memory (used when the whole
+      domain does not fit in the memory budget, see planner.py). Each band goes
+      through the same steps as the whole domain in postprocess_NARCliM.py and is
+      written to its rows of the output file.
+
+      info: [file_out, varname, None, time_bounds]; the attributes are taken from
+            the first band computed
+      bands: windows (slices along y and x) of the bands, from planner.plan_variables
+      The checks of zero and negative values are done band by band.
+      Returns the messages of the checks.
+  """
+  var=info[1]
+  wrfvar=VARINFO.get_inputs(var)
+  errors=[]
+  fout=None
+  ny=bands[-1][0].stop-bands[0][0].start
+  complete=False
+  try:
+    for band in bands:
+      print '  -->  BAND OF ROWS %s-%s' %(band[0].start,band[0].stop-1)
+      gband=copy.copy(gvars)
+      gband.window=band
+      time_old,varvals=read_list(files_list,var,gband)
+      if VARINFO.is_accumulated(var) and (filet=='wrfhrly' or filet=='wrfout'):
+        varvals=add_timestep_acc(wrfvar,varvals,per_f,gband,filet)
+      if filet=='wrfxtrm' or filet=='wrfdly':
+        varvals=mv_timestep(wrfvar,varvals,per_f,gband,filet)
+      varval,varatt=compute(varvals,date_var,gband)
+      del varvals
+      if len(date_var)<len(date):
+        varval=add_leapdays(varval,date)
+      if VARINFO.is_accumulated(var):
+        varval=check_rerundiscontinuity(var,varval,date,per_f,gband,filet,files_list,time_step)
+      if filet=='wrfxtrm' or filet=='wrfdly':
+        errors.append(check_zeros_values(varval,date,gband,filet))
+      if VARINFO.is_nonnegative(var):
+        errors.append(check_negative_values(var,varval,date))
+
+      if fout is None:
+        fout=ncwriter([info[0],var,varatt,info[3]],gvars,(len(date),ny,varval.shape[2]),time,time_bnds,
+                      band_rows=bands[0][0].stop-bands[0][0].start)
+      nt_block=fout.get_write_block()
+      for it in xrange(0,varval.shape[0],nt_block):
+        fout.write(varval[it:it+nt_block],it,ystart=band[0].start-bands[0][0].start)
+      del varval
+    complete=True
+  finally:
+    if fout is not None:
+      fout.close(complete)
+  return errors
+
+#**************************************************************************************
+def get_fieldcache(gvars):
+  """ Field cache of the run (see field_cache.py), or None if no cache_dir was given
+  """
+  if gvars is None or gvars.cache_dir is None:
+    return None
+  return fc.fieldcache(gvars.cache_dir,gvars.cache_maxsize*1024**3)
 
-  return temptime, tempvar
 
-  
 #**************************************************************************************
 def get_filefreq(filet):
   """ Method to get information about the type of file
@@ -1148,3 +2020,87 @@ def get_filefreq(filet):
     
     
   return file_info
+
+
+#**************************************************************************************
+def get_output_profile(profile):
+  """ Method to get the compression and chunking options of an output profile
+      profile: name of the profile (none, map, timeseries)
+      ---
+      - zlib: whether the variables are compressed
+      - complevel: compression level (1 to 9)
+      - shuffle: whether the HDF5 shuffle filter is applied before compression
+      - chunking: layout of the chunks of the output variable
+         'default': chunks chosen by the netCDF library
+         'map': one time step per chunk (fast access to whole maps)
+         'timeseries': long time chunks over small tiles (fast access to
+                       the time series of single grid points)
+  """
+  profile_info={}
+
+  if profile=='none':
+    profile_info['zlib']=False
+    profile_info['complevel']=0
+    profile_info['shuffle']=False
+    profile_info['chunking']='default'
+
+  elif profile=='map':
+    profile_info['zlib']=True
+    profile_info['complevel']=4
+    profile_info['shuffle']=True
+    profile_info['chunking']='map'
+
+  elif profile=='timeseries':
+    profile_info['zlib']=True
+    profile_info['complevel']=4
+    profile_info['shuffle']=True
+    profile_info['chunking']='timeseries'
+
+  else:
+    sys.exit('The output profile %s is erroneus. Please choose between none, map or timeseries' %(profile))
+
+  return profile_info
+
+
+#**************************************************************************************
+def get_varcompression(gvars,varname,shape,band_rows=None):
+  """ Keyword arguments of createVariable (zlib, complevel, shuffle, chunksizes and
+      least_significant_digit) for an output variable with dimensions (time, y, x).
+      The profile selected in the input file can be modified with the complevel,
+      shuffle, quantize and least_significant_digit entries.
+      band_rows: rows of the bands of a variable written band by band (see
+      process_banded). The chunks do not cross the bands, so each compressed chunk is
+      written once instead of being read, decompressed and written again by each band.
+  """
+  profile_info=get_output_profile(gvars.output_profile)
+  kwargs={}
+  kwargs['zlib']=profile_info['zlib']
+  kwargs['complevel']=profile_info['complevel']
+  kwargs['shuffle']=profile_info['shuffle']
+  if gvars.complevel!=None:
+    kwargs['complevel']=gvars.complevel
+    kwargs['zlib']=kwargs['complevel']>0
+  if gvars.shuffle!=None:
+    kwargs['shuffle']=gvars.shuffle
+
+  nt,ny,nx=shape
+  if band_rows is not None and band_rows>=ny:
+    band_rows=None
+  if profile_info['chunking']=='map':
+    kwargs['chunksizes']=(1,band_rows or ny,nx)
+  elif profile_info['chunking']=='timeseries':
+    # Tiles of 16x16 grid points and as many time steps as fit in ~4MB (the bands
+    # have whole tiles, see planner.plan_variables, unless they are narrower)
+    cy=min(ny,16,band_rows or ny)
+    cx=min(nx,16)
+    ct=max(1,min(nt,4*1024*1024/(4*cy*cx)))
+    kwargs['chunksizes']=(ct,cy,cx)
+  elif band_rows is not None:
+    kwargs['chunksizes']=(1,band_rows,nx)
+
+  if gvars.quantize:
+    lsd=getvarlsd(varname,gvars.lsd_overrides)
+    if lsd!=None:
+      kwargs['least_significant_digit']=lsd
+
+  return kwargs
@@ -6,11 +6,18 @@ Author: Daniel Argues @ CCRC, UNSW. Sydney (Australia)
 email: d.argueso@ unsw.edu.au
 Created: Fri May 16 10:45:12 EST 2014
 
+Copies the postprocessed files of all simulations and domains to their final
+location with transfer.py: several files at a time, only the files that are new or
+modified since the last transfer, and with the checksums of the copies verified.
+
+  python rsync_allpostprocess.py -j 8
+
 """
 
-import subprocess as subprocess
 import ccrc_utils as cu
-import os
+import sys
+from optparse import OptionParser
+import transfer
 
 
 GCM_names=['MIROC3.2','CCCMA3.1','ECHAM5','CSIRO-MK3.0']
@@ -19,14 +26,22 @@ Period_names=['1990-2010','2020-2040','2060-2080']
 Domain_names=['d01','d02']
 Period_covers=['1990-2009','2020-2039','2060-2079']
 
+parser = OptionParser()
+parser.add_option("-j", "--jobs", dest="jobs", type="int", default=4,
+help="number of files copied at the same time (4 by default)", metavar="N")
+parser.add_option("-r", "--retries", dest="retries", type="int", default=2,
+help="times a failed copy is retried (2 by default)", metavar="N")
+(opts, args) = parser.parse_args()
 
+failed=[]
 for gind,gname in enumerate(GCM_names):
   for rind,rname in enumerate(RCM_names):
     for pind,pname in enumerate(Period_names):
       for dind,dname in enumerate(Domain_names):
         fullpath_out=cu.get_postproc_location(gname,rname,pname)[0]
-        if not os.path.exists(fullpath_out):
-          os.makedirs(fullpath_out)
         fullpath_in="/srv/ccrc/data13/z3393020/NARCliM_newpost/postprocess/%s/%s/%s/%s" %(Period_covers[pind],gname,rname,dname)
-        print "rsync -avz --stats %s/* %s%s/" %(fullpath_in,fullpath_out,dname)
-        subprocess.call("rsync -avz --stats %s/* %s%s/" %(fullpath_in,fullpath_out,dname),shell=True)
\ No newline at end of file
+        result=transfer.transfer(fullpath_in,"%s%s/" %(fullpath_out,dname),opts.jobs,opts.retries)
+        failed.extend(result['failed'])
+
+if len(failed)>0:
+  sys.exit('ERROR: %s files could not be copied' %(len(failed)))
@@ -0,0 +1,132 @@
+# To test that the variables read, computed and written in bands of rows
+# (process_banded of postprocess_modules) are the same as those of the whole
+# domain at once, on synthetic WRF files (benchmarks/synthetic_wrf.py)
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import datetime as dt
+import numpy as np
+import netCDF4 as nc
+
+repodir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repodir)
+sys.path.insert(0, os.path.join(repodir, "benchmarks"))
+import postprocess_modules as pm
+import compute_vars as comv
+import variables_info as cfg
+import synthetic_wrf as synth
+import run_benchmarks as bench
+
+NY = 10
+NX = 12
+
+class test_banded(unittest.TestCase):
+
+   # Set-up. One year of hourly files, five years of wrfxtrm files and the
+   # reference file of the grid. The run reads WRF_schemes.inf from the
+   # folder of postprocess_NARCliM.py
+   @classmethod
+   def setUpClass(cls):
+      cls.cwd = os.getcwd()
+      os.chdir(repodir)
+      cls.tmpdir = tempfile.mkdtemp()
+      cls.pathin = os.path.join(cls.tmpdir, "wrf") + "/"
+      synth.generate(cls.pathin, 1990, 1990, NY, NX, 4, filetypes=["wrfhrly"])
+      synth.generate(cls.pathin, 1990, 1994, NY, NX, 4, filetypes=["wrfxtrm"],
+         seed=1)
+      synth.write_wrf_file(cls.pathin + "wrfout_d02_1990-01-01_00:00:00",
+         [dt.datetime(1990, 1, 1)], [], NY, NX, 4, dt.datetime(1990, 1, 1),
+         np.random.RandomState(2))
+      cls.varinfo = cfg.VariablesInfo()
+
+   @classmethod
+   def tearDownClass(cls):
+      shutil.rmtree(cls.tmpdir)
+      os.chdir(cls.cwd)
+
+   # Writes var with the whole domain at once (as postprocess_NARCliM.py) and
+   # band by band, and checks that both files are the same
+   def check_banded(self, var, filet, per, per_f, bands, options=None):
+      gvars = bench.get_gvars(self.pathin, os.path.join(self.tmpdir, "whole"),
+         per, per_f, options)
+      bench.run_highfreq(gvars, self.varinfo, filet, per, per_f, [var], {})
+      file_info = pm.get_filefreq(filet)
+      name = "%s%s_%s-%s_%s.nc" % (gvars.outfile_patt,
+         file_info["file_freq"], per, per_f, var)
+      file_whole = os.path.join(pm.create_outdir(gvars), name)
+
+      gband = bench.get_gvars(self.pathin, os.path.join(self.tmpdir, "banded"),
+         per, per_f, options)
+      file_banded = os.path.join(pm.create_outdir(gband), name)
+      files_list = pm.file_list(gband, per, per_f, filet,
+         file_info["n_files"])
+      time_step = file_info["time_step"]
+      year_i, month_i, day_i, hour_i = pm.get_wrfdate(
+         pm.read_times(files_list)[0, :])
+      n_days = dt.datetime(per_f + 1, month_i, day_i, hour_i) - \
+         dt.datetime(per, month_i, day_i, hour_i)
+      date = pm.get_dates(year_i, month_i, day_i, hour_i, 0, time_step,
+         n_days.days*int(24./time_step))
+      time = pm.date2hours(date, gband.ref_date)
+      time_bounds = file_info["tbounds"]
+      time_bnds = pm.const.missingval
+      if self.varinfo.is_accumulated(var):
+         time_bounds = True
+         time = pm.create_outtime(date, gband)
+         time_bnds = pm.create_timebnds(time)
+      if filet == "wrfxtrm":
+         time = [tt + time_step/2 for tt in time]
+         time_bnds = pm.create_timebnds(time)
+      pm.process_banded([file_banded, var, None, time_bounds], files_list,
+         date, date, time, time_bnds, getattr(comv, "compute_" + var),
+         gband, filet, per_f, time_step, bands)
+
+      fwhole = nc.Dataset(file_whole)
+      fbanded = nc.Dataset(file_banded)
+      for name in (var, "time", "time_bnds", "lat", "lon"):
+         if name in fwhole.variables:
+            np.testing.assert_array_equal(fwhole.variables[name][:],
+               fbanded.variables[name][:], "%s of %s" % (name, var))
+      self.assertEqual(fwhole.variables[var].ncattrs(),
+         fbanded.variables[var].ncattrs())
+      fwhole.close()
+      fbanded.close()
+      return file_banded
+
+   def get_bands(self, rows):
+      return [(slice(y0, y1), slice(0, NX)) for y0, y1 in zip(rows[:-1],
+         rows[1:])]
+
+   def test_instantaneous(self):
+      self.check_banded("tas", "wrfhrly", 1990, 1990,
+         self.get_bands([0, 3, 7, NY]))
+
+   # The accumulated variables need the first time step of the next period
+   def test_accumulated(self):
+      self.check_banded("pracc", "wrfhrly", 1990, 1990,
+         self.get_bands([0, 4, NY]))
+
+   # The fields of the wrfxtrm files are moved one time step
+   def test_extremes(self):
+      self.check_banded("tasmaxtstep", "wrfxtrm", 1990, 1994,
+         self.get_bands([0, 1, 2, 5, NY]))
+
+   # The chunks of the output file follow the bands, so that no compressed
+   # chunk is written by two bands
+   def test_chunks(self):
+      for profile, chunks in (("map", [1, 4, NX]), ("none", [1, 4, NX]),
+         ("timeseries", [8760, 4, NX])):
+         fin = nc.Dataset(self.check_banded("tas", "wrfhrly", 1990, 1990,
+            self.get_bands([0, 4, 8, NY]), {"output_profile": profile}))
+         self.assertEqual(fin.variables["tas"].chunking(), chunks, profile)
+         fin.close()
+
+   def test_single_band(self):
+      self.check_banded("wss", "wrfhrly", 1990, 1990,
+         self.get_bands([0, NY]))
+
+if __name__ == "__main__":
+   unittest.main()
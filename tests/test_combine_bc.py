@@ -0,0 +1,153 @@
+# To test combine_bc: the derived variables computed in blocks of time steps
+# are the same as computed at once, and outputs newer than their inputs are
+# up to date (is_uptodate) and not computed again by combine_all
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import numpy.ma as ma
+import netCDF4 as ncdf
+
+repodir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repodir)
+import combine_bc
+
+NT = 12
+NY = 5
+NX = 7
+
+class test_combine_bc(unittest.TestCase):
+
+   # Set-up. Monthly tasminmean_bc and tasmaxmean_bc files of a small domain,
+   # with missing values and NaNs
+   def setUp(self):
+      self.tmpdir = tempfile.mkdtemp()
+      rng = np.random.RandomState(0)
+      self.tmin = 280. + 10.*rng.rand(NT, NY, NX)
+      self.tmax = self.tmin + 10.*rng.rand(NT, NY, NX)
+      self.mask = np.zeros((NT, NY, NX), dtype=bool)
+      self.mask[:, 0, 0] = True
+      self.mask[3, 2, 4] = True
+      self.tmax[5, 1, 1] = np.nan
+      self.file1 = os.path.join(self.tmpdir, "tasminmean_bc.nc")
+      self.file2 = os.path.join(self.tmpdir, "tasmaxmean_bc.nc")
+      self.write(self.file1, "tasminmean_bc", self.tmin)
+      self.write(self.file2, "tasmaxmean_bc", self.tmax)
+
+   def tearDown(self):
+      shutil.rmtree(self.tmpdir)
+
+   def write(self, filename, name, values, times=None):
+      if times is None:
+         times = 15. + 30.*np.arange(NT)
+      fout = ncdf.Dataset(filename, "w")
+      fout.createDimension("time", None)
+      fout.createDimension("y", NY)
+      fout.createDimension("x", NX)
+      fout.title = "NARCliM bias corrected"
+      lat = fout.createVariable("lat", np.float32, ("y", "x"))
+      lat.units = "degrees_north"
+      lat[:] = -40. + np.arange(NY*NX).reshape((NY, NX))/10.
+      lon = fout.createVariable("lon", np.float32, ("y", "x"))
+      lon.units = "degrees_east"
+      lon[:] = 140. + np.arange(NY*NX).reshape((NY, NX))/10.
+      nctime = fout.createVariable("time", np.float64, ("time",))
+      nctime.units = "days since 1990-01-01"
+      nctime.bounds = "time_bnds"
+      nctime[:] = times
+      var = fout.createVariable(name, np.float32, ("time", "y", "x"),
+         fill_value=-999.)
+      var.units = "K"
+      var[:] = ma.masked_where(self.mask, values)
+      fout.close()
+
+   def combine(self, rule, outfile, blockbytes=64*1024*1024):
+      combine_bc.combine_files(rule, self.file1, self.file2, outfile,
+         "John Smith", "email@email.email", blockbytes)
+      fin = ncdf.Dataset(outfile)
+      values = fin.variables[rule][:]
+      fin.close()
+      return values
+
+   def test_time_block(self):
+      self.assertEqual(combine_bc.get_time_block((NT, NY, NX), 1), 1)
+      self.assertEqual(combine_bc.get_time_block((NT, NY, NX), 3*8*NY*NX*5), 5)
+
+   # The blocks of one and five time steps give the same result as all the time
+   # steps at once
+   def test_blocks(self):
+      whole = self.combine("tasmean_bc", os.path.join(self.tmpdir, "whole.nc"))
+      for blockbytes in (1, 3*8*NY*NX*5):
+         blocks = self.combine("tasmean_bc", os.path.join(self.tmpdir,
+            "blocks.nc"), blockbytes)
+         np.testing.assert_array_equal(ma.getmaskarray(blocks),
+            ma.getmaskarray(whole))
+         np.testing.assert_array_equal(blocks.filled(), whole.filled())
+
+   # Missing values and NaNs of the inputs are filled with FILLVALUE
+   def test_values(self):
+      # Values as stored in the input files
+      tmin = self.tmin.astype(np.float32).astype(np.float64)
+      tmax = self.tmax.astype(np.float32).astype(np.float64)
+      for rule, expected in (("tasmean_bc", (tmin + tmax)/2.),
+         ("dtr_bc", tmax - tmin)):
+         values = self.combine(rule, os.path.join(self.tmpdir, rule + ".nc"), 1)
+         mask = self.mask | np.isnan(expected)
+         np.testing.assert_array_equal(ma.getmaskarray(values), mask)
+         self.assertTrue(np.all(values.data[mask] == combine_bc.FILLVALUE))
+         np.testing.assert_allclose(values[~mask], expected[~mask])
+      self.assertFalse(os.path.exists(os.path.join(self.tmpdir,
+         "dtr_bc.nc.part")))
+
+   def test_times_differ(self):
+      self.write(self.file2, "tasmaxmean_bc", self.tmax,
+         times=16. + 30.*np.arange(NT))
+      outfile = os.path.join(self.tmpdir, "out.nc")
+      self.assertRaisesRegexp(ValueError, "Times don't match",
+         combine_bc.combine_files, "tasmean_bc", self.file1, self.file2,
+         outfile, "John Smith", "email@email.email")
+      self.assertFalse(os.path.exists(outfile))
+
+   def test_uptodate(self):
+      outfile = os.path.join(self.tmpdir, "out.nc")
+      self.assertFalse(combine_bc.is_uptodate(outfile, [self.file1,
+         self.file2]))
+      self.combine("tasmean_bc", outfile)
+      now = time.time()
+      os.utime(self.file1, (now - 100, now - 100))
+      os.utime(self.file2, (now - 100, now - 100))
+      os.utime(outfile, (now - 50, now - 50))
+      self.assertTrue(combine_bc.is_uptodate(outfile, [self.file1,
+         self.file2]))
+      # An input modified after the output
+      os.utime(self.file2, (now, now))
+      self.assertFalse(combine_bc.is_uptodate(outfile, [self.file1,
+         self.file2]))
+
+   # Only the pairs of files whose output is missing or older than the inputs
+   # are computed, unless overwrite is True
+   def test_combine_all(self):
+      inputdir = os.path.join(self.tmpdir, "bcor")
+      outputdir = os.path.join(self.tmpdir, "out")
+      pathin = os.path.join(inputdir, "MIROC3.2", "R1", "1990-2010", "d02")
+      os.makedirs(pathin)
+      for filename, name in ((self.file1, "tasminmean_bc"),
+         (self.file2, "tasmaxmean_bc")):
+         shutil.copy(filename, os.path.join(pathin,
+            "CCRC_NARCliM_MON_1990-1999_%s.nc" % (name)))
+      outfile = os.path.join(outputdir, "MIROC3.2", "R1", "1990-2010", "d02",
+         "CCRC_NARCliM_MON_1990-1999_dtr_bc.nc")
+      self.assertEqual(combine_bc.combine_all("dtr_bc", inputdir, outputdir,
+         "John Smith", "email@email.email", jobs=1), [outfile])
+      self.assertTrue(os.path.exists(outfile))
+      self.assertEqual(combine_bc.combine_all("dtr_bc", inputdir, outputdir,
+         "John Smith", "email@email.email", jobs=1), [])
+      self.assertEqual(combine_bc.combine_all("dtr_bc", inputdir, outputdir,
+         "John Smith", "email@email.email", jobs=1, overwrite=True), [outfile])
+
+if __name__ == "__main__":
+   unittest.main()
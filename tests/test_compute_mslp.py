@@ -0,0 +1,83 @@
+# To test the sea level pressure of compute_mslp (compute_seaprs) against
+# DCOMPUTESEAPRS, the routine of wrf_user_getvar(f,"slp") in NCL
+#
+# The reference values were computed with DCOMPUTESEAPRS of wrf-python 1.3.4
+# (fortran/wrf_user.f90), compiled with the constants of NCL (R=287.04,
+# G=9.81, commented in that file) and converted back from hPa to Pa.
+
+import os
+import sys
+import unittest
+import numpy as np
+
+repodir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repodir)
+import compute_mslp as mslp
+
+# Columns: a standard one, one with a warm surface (t_surf > TC) and an
+# elevated one whose sea level temperature is above TC with a surface below
+# TC. Pressure [Pa], temperature [K], height [m] and QVAPOR [kg kg-1] from
+# the lowest level
+P = [[101000., 99500., 97000., 93000., 88000., 80000., 70000., 60000.],
+   [99000., 98000., 95000., 91000., 86000., 78000., 68000., 58000.],
+   [85000., 84000., 81000., 77000., 72000., 65000., 56000., 47000.]]
+T = [[287., 286., 284., 281., 277.5, 271., 263., 255.],
+   [306., 304.5, 301.5, 297.5, 293., 286., 277., 268.],
+   [289., 288.2, 286., 283., 279., 273.5, 266., 258.]]
+Z = [[10., 135., 350., 700., 1150., 1900., 2950., 4150.],
+   [250., 340., 610., 980., 1450., 2250., 3350., 4600.],
+   [1480., 1580., 1880., 2290., 2830., 3650., 4850., 6250.]]
+Q = [[0.010, 0.009, 0.008, 0.007, 0.005, 0.003, 0.001, 0.0005],
+   [0.012, 0.011, 0.010, 0.008, 0.006, 0.004, 0.002, 0.001],
+   [0.006, 0.0055, 0.005, 0.004, 0.003, 0.002, 0.001, 0.0005]]
+
+SLP_DCOMPUTESEAPRS = [101120.26888969, 101907.72289070, 101291.43078955]
+
+def get_field(columns):
+   # (time, bottom_top, south_north, west_east) with the columns along x
+   return np.asarray(columns, dtype=np.float64).T[np.newaxis, :, np.newaxis, :]
+
+class test_compute_mslp(unittest.TestCase):
+
+   def test_seaprs(self):
+      slp = mslp.compute_seaprs(get_field(Z), get_field(T), get_field(P),
+         get_field(Q))
+      self.assertEqual(slp.shape, (1, 1, 3))
+      np.testing.assert_allclose(slp[0, 0, :], SLP_DCOMPUTESEAPRS, rtol=1e-10)
+
+   # The columns are independent: the same values in any position of a grid
+   # with several times
+   def test_seaprs_grid(self):
+      fields = []
+      for columns in (Z, T, P, Q):
+         field = get_field(columns)[:, :, :, [2, 0, 1, 1]]
+         fields.append(np.concatenate([field, field[:, :, :, ::-1]], axis=2)
+            .repeat(2, axis=0))
+      slp = mslp.compute_seaprs(*fields)
+      self.assertEqual(slp.shape, (2, 2, 4))
+      expected = np.asarray(SLP_DCOMPUTESEAPRS)[[2, 0, 1, 1]]
+      for it in xrange(2):
+         np.testing.assert_allclose(slp[it, 0, :], expected, rtol=1e-10)
+         np.testing.assert_allclose(slp[it, 1, :], expected[::-1], rtol=1e-10)
+
+   def test_seaprs_pconst_not_reached(self):
+      p = get_field(P)
+      p[:, 1:, :, 0] = p[:, 0, :, 0] - 5000.
+      self.assertRaises(ValueError, mslp.compute_seaprs, get_field(Z),
+         get_field(T), p, get_field(Q))
+
+   # The upper trapping level is at most the level below the top: the
+   # levels are the same if PCONST is first reached at the top
+   def test_seaprs_trapping_levels(self):
+      p = get_field(P)
+      p[:, 1:-1, :, 1] = p[:, 0, :, 1] - 5000.
+      self.assertRaises(ValueError, mslp.compute_seaprs, get_field(Z),
+         get_field(T), p, get_field(Q))
+
+   def test_temperature(self):
+      p = np.array([100000., 85000.])
+      np.testing.assert_allclose(mslp.compute_temperature(np.array([0., 10.]),
+         p), [300., 310.*0.85**(2./7.)])
+
+if __name__ == "__main__":
+   unittest.main()
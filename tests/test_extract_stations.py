@@ -0,0 +1,155 @@
+# To test the extraction of the series at the stations (extract_stations.py):
+# the grid points and weights of the stations (get_station_index), the boxes
+# read around them (get_station_boxes) and the series extracted from a small
+# postprocessed file
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import netCDF4 as nc
+
+repodir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repodir)
+import postprocess_modules as pm
+import extract_stations as es
+
+NT = 10
+NY = 20
+NX = 30
+
+class test_get_station_index(unittest.TestCase):
+
+   # Set-up. Regular grid of 0.1 degrees
+   def setUp(self):
+      self.lat, self.lon = np.meshgrid(-35. + 0.1*np.arange(NY),
+         150. + 0.1*np.arange(NX), indexing="ij")
+
+   def test_nearest(self):
+      iy, ix, weights, dist = es.get_station_index(self.lat, self.lon,
+         np.array([-34.77, -33.2]), np.array([150.32, 152.88]))
+      np.testing.assert_array_equal(iy, [[2], [18]])
+      np.testing.assert_array_equal(ix, [[3], [29]])
+      np.testing.assert_array_equal(weights, [[1.], [1.]])
+      np.testing.assert_allclose(dist, [es.haversine(-34.77, 150.32, -34.8,
+         150.3), es.haversine(-33.2, 152.88, -33.2, 152.9)])
+
+   # The four surrounding points, weighted by the distance along each axis
+   def test_bilinear(self):
+      iy, ix, weights, dist = es.get_station_index(self.lat, self.lon,
+         np.array([-34.77]), np.array([150.32]), "bilinear")
+      np.testing.assert_array_equal(iy, [[2, 2, 3, 3]])
+      np.testing.assert_array_equal(ix, [[3, 4, 3, 4]])
+      np.testing.assert_allclose(weights, [[0.7*0.8, 0.7*0.2, 0.3*0.8,
+         0.3*0.2]], atol=1e-9)
+      # At a grid point, all the weight on that point
+      iy, ix, weights, dist = es.get_station_index(self.lat, self.lon,
+         np.array([-34.5]), np.array([151.]), "bilinear")
+      self.assertAlmostEqual(weights[0][(iy[0] == 5) & (ix[0] == 10)].sum(),
+         1., places=9)
+      self.assertAlmostEqual(dist[0], 0., places=6)
+
+class test_extract(unittest.TestCase):
+
+   # Set-up. A postprocessed file of a small domain with missing values
+   def setUp(self):
+      self.tmpdir = tempfile.mkdtemp()
+      self.lat, self.lon = np.meshgrid(-35. + 0.1*np.arange(NY),
+         150. + 0.1*np.arange(NX), indexing="ij")
+      rng = np.random.RandomState(0)
+      self.values = 280. + 10.*rng.rand(NT, NY, NX)
+      self.mask = np.zeros((NT, NY, NX), dtype=bool)
+      self.mask[4, 2, 3] = True
+      self.filein = os.path.join(self.tmpdir,
+         "CCRC_NARCliM_DAY_1990-1990_tas.nc")
+      fout = nc.Dataset(self.filein, "w", format="NETCDF4_CLASSIC")
+      fout.createDimension("time", None)
+      fout.createDimension("y", NY)
+      fout.createDimension("x", NX)
+      fout.createDimension("bnds", 2)
+      for name, values, units in (("lat", self.lat, "degrees_north"),
+         ("lon", self.lon, "degrees_east")):
+         var = fout.createVariable(name, "f4", ("y", "x"))
+         var.units = units
+         var[:] = values
+      nctime = fout.createVariable("time", "f8", ("time",))
+      nctime.units = "hours since 1949-12-01 00:00:00"
+      nctime[:] = 24.*np.arange(NT) + 12.
+      bnds = fout.createVariable("time_bnds", "f8", ("time", "bnds"))
+      bnds[:] = np.array([24.*np.arange(NT), 24.*np.arange(NT) + 24.]).T
+      var = fout.createVariable("tas", "f4", ("time", "y", "x"),
+         fill_value=pm.const.missingval, zlib=True, chunksizes=(1, NY, NX))
+      var.units = "K"
+      var[:] = np.ma.masked_where(self.mask, self.values)
+      fout.close()
+      # Values as stored in the file
+      self.values = self.values.astype(np.float32).astype(np.float64)
+      # Two nearby stations and a distant one
+      self.slats = np.array([-34.77, -34.62, -33.15])
+      self.slons = np.array([150.32, 150.41, 152.77])
+
+   def tearDown(self):
+      shutil.rmtree(self.tmpdir)
+
+   def extract(self, method, boxes=None):
+      iy, ix, weights, dist = es.get_station_index(self.lat, self.lon,
+         self.slats, self.slons, method)
+      fileout = os.path.join(self.tmpdir, "stations_%s.nc" % (method))
+      writer = es.stationwriter(fileout, self.filein, "tas", ["A", "B", "C"],
+         self.slats, self.slons, iy, ix, weights, dist, self.lat, self.lon,
+         method)
+      es.extract_file(self.filein, "tas", writer, iy, ix, weights, boxes)
+      writer.close()
+      fin = nc.Dataset(fileout)
+      values = fin.variables["tas"][:]
+      np.testing.assert_array_equal(fin.variables["time_bnds"][:, 1],
+         24.*np.arange(NT) + 24.)
+      self.assertEqual(list(nc.chartostring(fin.variables["station_name"][:])),
+         ["A", "B", "C"])
+      fin.close()
+      return values, iy, ix, weights
+
+   def test_nearest(self):
+      values, iy, ix, weights = self.extract("nearest")
+      self.assertEqual(values.shape, (NT, 3))
+      np.testing.assert_allclose(values[:, 2], self.values[:, 18, 28])
+      np.testing.assert_allclose(values[:, 1], self.values[:, 4, 4])
+      # Missing at the nearest point
+      np.testing.assert_array_equal(np.ma.getmaskarray(values[:, 0]),
+         np.arange(NT) == 4)
+      np.testing.assert_allclose(values[:, 0].compressed(),
+         np.delete(self.values[:, 2, 3], 4))
+
+   def test_bilinear(self):
+      values, iy, ix, weights = self.extract("bilinear")
+      expected = np.sum(self.values[:, iy, ix]*weights[np.newaxis], axis=2)
+      # The first station uses the missing point (2,3) with weight
+      mask = np.zeros((NT, 3), dtype=bool)
+      mask[4, 0] = True
+      np.testing.assert_array_equal(np.ma.getmaskarray(values), mask)
+      np.testing.assert_allclose(values[~mask], expected[~mask], rtol=1e-6)
+
+   # The nearby stations share a small box, the distant one is read apart,
+   # with the same values as read in the box of all the stations
+   def test_boxes(self):
+      iy, ix, weights, dist = es.get_station_index(self.lat, self.lon,
+         self.slats, self.slons, "bilinear")
+      boxes = es.get_station_boxes(iy, ix)
+      self.assertEqual(sorted([sorted(box[4]) for box in boxes]), [[0, 1], [2]])
+      for y0, y1, x0, x1, sts in boxes:
+         self.assertTrue((iy[sts] >= y0).all() and (iy[sts] < y1).all())
+         self.assertTrue((ix[sts] >= x0).all() and (ix[sts] < x1).all())
+         self.assertTrue((y1 - y0)*(x1 - x0) <= 64)
+      # Without the minimum, only the stations whose boxes overlap are merged
+      self.assertEqual(len(es.get_station_boxes(iy, ix, 0)), 3)
+      values = self.extract("bilinear")[0]
+      whole = self.extract("bilinear", [[iy.min(), iy.max() + 1, ix.min(),
+         ix.max() + 1, [0, 1, 2]]])[0]
+      np.testing.assert_array_equal(np.ma.getmaskarray(values),
+         np.ma.getmaskarray(whole))
+      np.testing.assert_array_equal(values.filled(), whole.filled())
+
+if __name__ == "__main__":
+   unittest.main()
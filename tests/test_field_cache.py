@@ -0,0 +1,122 @@
+# To test the on-disk cache of WRF fields (field_cache.py): fields stored and
+# read back (also masked arrays and their fill value), misses, the entries
+# written atomically and the eviction of the least recently used entries
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+repodir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repodir)
+import field_cache
+
+class test_fieldcache(unittest.TestCase):
+
+   # Set-up. Two source "WRF files" and an empty cache
+   def setUp(self):
+      self.tmpdir = tempfile.mkdtemp()
+      self.cachedir = os.path.join(self.tmpdir, "cache")
+      self.cache = field_cache.fieldcache(self.cachedir, 1024**3)
+      self.files = []
+      for name in ("wrfhrly_d02_1990-01-01_00:00:00",
+         "wrfhrly_d02_1990-02-01_00:00:00"):
+         self.files.append(os.path.join(self.tmpdir, name))
+         fout = open(self.files[-1], "w")
+         fout.write(name)
+         fout.close()
+      self.field = np.random.RandomState(0).rand(4, 5, 6).astype(np.float32)
+      self.savez_compressed = np.savez_compressed
+
+   def tearDown(self):
+      np.savez_compressed = self.savez_compressed
+      shutil.rmtree(self.tmpdir)
+
+   def list_cache(self, suffix=""):
+      return [name for name in os.listdir(self.cachedir)
+         if name.endswith(suffix)]
+
+   def test_roundtrip(self):
+      self.cache.put(self.files[0], "T2", self.field)
+      data = self.cache.get(self.files[0], "T2")
+      self.assertFalse(np.ma.isMaskedArray(data))
+      self.assertEqual(data.dtype, np.float32)
+      np.testing.assert_array_equal(data, self.field)
+
+   def test_roundtrip_masked(self):
+      field = np.ma.masked_greater(self.field, 0.8)
+      field.set_fill_value(-999.)
+      self.cache.put(self.files[0], "T2", field)
+      data = self.cache.get(self.files[0], "T2")
+      self.assertTrue(np.ma.isMaskedArray(data))
+      np.testing.assert_array_equal(np.ma.getmaskarray(data),
+         np.ma.getmaskarray(field))
+      np.testing.assert_array_equal(data.filled(), field.filled())
+      self.assertEqual(data.fill_value, -999.)
+
+   # Other fields, files, windows and modified files are not in the cache
+   def test_miss(self):
+      self.cache.put(self.files[0], "T2", self.field)
+      self.assertIsNone(self.cache.get(self.files[0], "Q2"))
+      self.assertIsNone(self.cache.get(self.files[1], "T2"))
+      window = (slice(1, 3), slice(0, 4))
+      self.assertIsNone(self.cache.get(self.files[0], "T2", window))
+      self.cache.put(self.files[0], "T2", self.field[:, 1:3, 0:4], window)
+      np.testing.assert_array_equal(self.cache.get(self.files[0], "T2",
+         window), self.field[:, 1:3, 0:4])
+      fout = open(self.files[0], "a")
+      fout.write("rerun")
+      fout.close()
+      self.assertIsNone(self.cache.get(self.files[0], "T2"))
+
+   # The entry only appears when it is complete, and a failed write leaves
+   # neither the entry nor its temporary file
+   def test_atomic(self):
+      entry = self.cache.get_entry(self.files[0], "T2")
+      def savez_check(fout, **arrays):
+         self.assertFalse(os.path.exists(entry))
+         self.savez_compressed(fout, **arrays)
+      np.savez_compressed = savez_check
+      self.cache.put(self.files[0], "T2", self.field)
+      self.assertEqual(self.list_cache(), [os.path.basename(entry)])
+
+      def savez_fail(fout, **arrays):
+         fout.write("partial")
+         raise IOError("No space left on device")
+      np.savez_compressed = savez_fail
+      self.assertRaises(IOError, self.cache.put, self.files[1], "T2",
+         self.field)
+      self.assertEqual(self.list_cache(), [os.path.basename(entry)])
+
+   # The least recently used entries (read or written) are removed first
+   # until the cache is below its maximum size
+   def test_evict(self):
+      now = time.time()
+      entries = []
+      for i, wrfv in enumerate(["T2", "Q2", "PSFC", "U10"]):
+         self.cache.put(self.files[0], wrfv, self.field + i)
+         entries.append(self.cache.get_entry(self.files[0], wrfv))
+         os.utime(entries[-1], (now - 100 + i, now - 100 + i))
+      size = self.cache.get_size()
+      self.assertEqual(len(self.list_cache(".npz")), 4)
+      # T2, the oldest, is used again
+      self.assertIsNotNone(self.cache.get(self.files[0], "T2"))
+      self.cache.maxsize = size - 1
+      self.cache.evict()
+      self.assertEqual(sorted(self.list_cache(".npz")), sorted([
+         os.path.basename(entries[i]) for i in (0, 2, 3)]))
+      # Space for two entries: the most recently used, T2 and U10
+      self.cache.maxsize = os.path.getsize(entries[0]) + os.path.getsize(
+         entries[3])
+      self.cache.evict()
+      self.assertEqual(sorted(self.list_cache(".npz")),
+         sorted([os.path.basename(entries[0]), os.path.basename(entries[3])]))
+      # Nothing is removed below the maximum size
+      self.cache.evict()
+      self.assertEqual(len(self.list_cache(".npz")), 2)
+
+if __name__ == "__main__":
+   unittest.main()
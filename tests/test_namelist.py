@@ -0,0 +1,154 @@
+# To test the input file of postprocess_NARCliM.py (namelist.py): the parsing of
+# the options and the variables, the conversion and checks of the values, the
+# options replaced from the command line and the least_significant_digit
+# overrides (read_lsd_overrides)
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+repodir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repodir)
+import namelist
+import postprocess_modules as pm
+
+TEXT = """#File with NARCliM postprocessing input arguments
+
+pathin = /data/WRF outs/MIROC3.2/R1/out
+pathout=/data/post/
+GCM = MIROC3.2
+RCM = R1
+   syear = 1990
+eyear = 1999
+domain = d02
+# outfile_patt = WRONG_
+outfile_patt=CCRC_NARCliM_
+globatt_changes = changes=v2.json
+overwrite=yes
+least_significant_digit = tas:1, pracc:2
+workers = 4
+memory = 0.5
+subset_bbox = -35.5,-33,150,152.25
+
+%s
+#Variables
+tas
+# pracc
+pr     comment of the variable
+
+""" % (namelist.SENTINEL)
+
+class test_parse(unittest.TestCase):
+
+   def test_options(self):
+      options, varnames = namelist.parse(TEXT)
+      self.assertEqual(varnames, ["tas", "pr"])
+      # Blanks only removed around the name and the value
+      self.assertEqual(options["pathin"], "/data/WRF outs/MIROC3.2/R1/out")
+      self.assertEqual(options["syear"], "1990")
+      # Commented options are ignored
+      self.assertEqual(options["outfile_patt"], "CCRC_NARCliM_")
+      # Only the first = separates the name and the value
+      self.assertEqual(options["globatt_changes"], "changes=v2.json")
+      self.assertEqual(len(options), 14)
+
+   def test_errors(self):
+      self.assertRaises(SystemExit, namelist.parse, "syear = 1990\ntas\n")
+      self.assertRaises(SystemExit, namelist.parse,
+         "syear 1990\n%s\ntas\n" % (namelist.SENTINEL))
+
+   def test_read_namelist(self):
+      tmpdir = tempfile.mkdtemp()
+      try:
+         filename = os.path.join(tmpdir, "post.input")
+         filein = open(filename, "w")
+         filein.write(TEXT)
+         filein.close()
+         config, varnames = namelist.read_namelist(filename)
+      finally:
+         shutil.rmtree(tmpdir)
+      self.assertEqual(varnames, ["tas", "pr"])
+      self.assertEqual(config.eyear, 1999)
+
+class test_namelist(unittest.TestCase):
+
+   def setUp(self):
+      self.options = namelist.parse(TEXT)[0]
+
+   # Values converted to their types, and defaults of the options not given
+   def test_types(self):
+      config = namelist.namelist(self.options)
+      self.assertEqual(config.pathin, "/data/WRF outs/MIROC3.2/R1/out/")
+      self.assertEqual(config.pathout, "/data/post/")
+      self.assertTrue(config.syear == 1990 and isinstance(config.syear, int))
+      self.assertIs(config.overwrite, True)
+      self.assertEqual(config.workers, 4)
+      self.assertEqual(config.memory, 0.5)
+      self.assertEqual(config.subset_bbox, [-35.5, -33., 150., 152.25])
+      self.assertEqual(config.output_profile, "none")
+      self.assertIs(config.async_write, False)
+      self.assertEqual(config.io_jobs, 10)
+      self.assertIsNone(config.chunk_files)
+      self.assertTrue(config.given("workers"))
+      self.assertFalse(config.given("chunk_files"))
+
+   def test_invalid(self):
+      for name, value in (("syear", "1990.5"), ("memory", "lots"),
+         ("overwrite", "maybe"), ("output_profile", "fast"),
+         ("domain", "d2"), ("subset_window", "1,2,3"),
+         ("subset_bbox", "1,2,3,x")):
+         options = dict(self.options)
+         options[name] = value
+         self.assertRaises(SystemExit, namelist.namelist, options)
+
+   def test_minimum(self):
+      for name, value in (("workers", "0"), ("memory", "0.001"),
+         ("io_jobs", "-1")):
+         options = dict(self.options)
+         options[name] = value
+         self.assertRaises(SystemExit, namelist.namelist, options)
+      options = dict(self.options)
+      options["memory"] = "0.01"
+      self.assertEqual(namelist.namelist(options).memory, 0.01)
+
+   def test_required(self):
+      del self.options["domain"]
+      self.assertRaises(SystemExit, namelist.namelist, self.options)
+
+   def test_checks(self):
+      options = dict(self.options)
+      options["syear"] = "2000"
+      self.assertRaises(SystemExit, namelist.namelist, options)
+      options = dict(self.options)
+      options["subset_window"] = "0,10,0,10"
+      self.assertRaises(SystemExit, namelist.namelist, options)
+
+   # As the options given in the command line of postprocess_NARCliM.py
+   def test_override(self):
+      config = namelist.namelist(self.options)
+      config.override("workers", "8")
+      config.override("chunk_files", "3")
+      self.assertEqual(config.workers, 8)
+      self.assertEqual(config.chunk_files, 3)
+      self.assertTrue(config.given("chunk_files"))
+      self.assertRaises(SystemExit, config.override, "workers", "0")
+      self.assertRaises(SystemExit, config.override, "threads", "2")
+
+class test_lsd_overrides(unittest.TestCase):
+
+   def test_read(self):
+      self.assertEqual(pm.read_lsd_overrides(""), {})
+      self.assertEqual(pm.read_lsd_overrides("tas:1,pracc:2"),
+         {"tas": 1, "pracc": 2})
+      # Blanks around the items, the names and the digits
+      self.assertEqual(pm.read_lsd_overrides(" tas : 1, pracc:2 ,"),
+         {"tas": 1, "pracc": 2})
+
+   def test_errors(self):
+      for entry in ("tas", "tas:x", "tas:1:2", ":1", "tas:1,pracc"):
+         self.assertRaises(SystemExit, pm.read_lsd_overrides, entry)
+
+if __name__ == "__main__":
+   unittest.main()
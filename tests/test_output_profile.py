@@ -0,0 +1,133 @@
+# To test the compression and chunking of the output files (output_profile,
+# complevel, shuffle, quantize and least_significant_digit of the input file):
+# small files written with create_netcdf are read back to check the filters,
+# the chunks and the digits kept (get_varcompression and getvarlsd)
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import datetime as dt
+import numpy as np
+import netCDF4 as nc
+
+repodir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repodir)
+sys.path.insert(0, os.path.join(repodir, "benchmarks"))
+import postprocess_modules as pm
+import synthetic_wrf as synth
+import run_benchmarks as bench
+
+NT = 24
+NY = 20
+NX = 40
+VARATT = {"long_name": "Surface air temperature", "units": "K",
+   "_FillValue": pm.const.missingval}
+
+class test_output_profile(unittest.TestCase):
+
+   # Set-up. The reference file of the grid. The run reads WRF_schemes.inf from
+   # the folder of postprocess_NARCliM.py
+   @classmethod
+   def setUpClass(cls):
+      cls.cwd = os.getcwd()
+      os.chdir(repodir)
+      cls.tmpdir = tempfile.mkdtemp()
+      cls.pathin = os.path.join(cls.tmpdir, "wrf") + "/"
+      os.makedirs(cls.pathin)
+      synth.write_wrf_file(cls.pathin + "wrfout_d02_1990-01-01_00:00:00",
+         [dt.datetime(1990, 1, 1)], [], NY, NX, 4, dt.datetime(1990, 1, 1),
+         np.random.RandomState(0))
+      cls.values = 280. + 10.*np.random.RandomState(1).rand(NT, NY, NX)
+      cls.nrun = 0
+
+   @classmethod
+   def tearDownClass(cls):
+      shutil.rmtree(cls.tmpdir)
+      os.chdir(cls.cwd)
+
+   # Writes varname with the options of the input file. Returns the filters,
+   # chunks, least_significant_digit and values of the file
+   def write(self, options, varname="tas"):
+      self.__class__.nrun = self.nrun + 1
+      gvars = bench.get_gvars(self.pathin, os.path.join(self.tmpdir,
+         "out%s" % (self.nrun)), 1990, 1990, options)
+      filename = "%sCCRC_NARCliM_01H_1990-1990_%s.nc" % (
+         pm.create_outdir(gvars), varname)
+      pm.create_netcdf([filename, varname, VARATT, False], gvars,
+         self.values, np.arange(NT) + 0.5, pm.const.missingval)
+      fin = nc.Dataset(filename)
+      var = fin.variables[varname]
+      result = {"filters": var.filters(), "chunking": var.chunking(),
+         "lsd": getattr(var, "least_significant_digit", None),
+         "values": var[:]}
+      fin.close()
+      return result
+
+   def test_none(self):
+      result = self.write({"output_profile": "none"})
+      self.assertFalse(result["filters"]["zlib"])
+      self.assertFalse(result["filters"]["shuffle"])
+      self.assertIsNone(result["lsd"])
+      np.testing.assert_array_equal(result["values"],
+         self.values.astype(np.float32))
+
+   def test_map(self):
+      result = self.write({"output_profile": "map"})
+      self.assertTrue(result["filters"]["zlib"])
+      self.assertEqual(result["filters"]["complevel"], 4)
+      self.assertTrue(result["filters"]["shuffle"])
+      self.assertEqual(result["chunking"], [1, NY, NX])
+      np.testing.assert_array_equal(result["values"],
+         self.values.astype(np.float32))
+
+   # Tiles of 16x16 points with all the time steps (they fit in 4 MB)
+   def test_timeseries(self):
+      result = self.write({"output_profile": "timeseries"})
+      self.assertTrue(result["filters"]["zlib"])
+      self.assertEqual(result["filters"]["complevel"], 4)
+      self.assertTrue(result["filters"]["shuffle"])
+      self.assertEqual(result["chunking"], [NT, 16, 16])
+
+   def test_complevel_shuffle(self):
+      result = self.write({"output_profile": "map", "complevel": "1",
+         "shuffle": "False"})
+      self.assertTrue(result["filters"]["zlib"])
+      self.assertEqual(result["filters"]["complevel"], 1)
+      self.assertFalse(result["filters"]["shuffle"])
+      result = self.write({"output_profile": "timeseries", "complevel": "0"})
+      self.assertFalse(result["filters"]["zlib"])
+      self.assertEqual(result["chunking"], [NT, 16, 16])
+
+   # The digits of getvarlsd are kept, and the values differ less than them
+   def test_quantize(self):
+      for varname, lsd in (("tas", 2), ("tasmaxtstep", 2), ("psl", 0)):
+         result = self.write({"output_profile": "map", "quantize": "True"},
+            varname)
+         self.assertEqual(result["lsd"], lsd)
+         self.assertTrue(np.abs(result["values"] - self.values).max()
+            <= 10.**(-lsd))
+      # Variables without digits are not quantized
+      self.assertIsNone(pm.getvarlsd("pblh"))
+      result = self.write({"quantize": "True"}, "pblh")
+      self.assertIsNone(result["lsd"])
+
+   # The overrides of least_significant_digit only change the variables
+   # they name and their statistics
+   def test_lsd_overrides(self):
+      options = {"output_profile": "map", "quantize": "True",
+         "least_significant_digit": "tas:1,pblh:0"}
+      for varname, lsd in (("tas", 1), ("tasmaxmean", 1), ("tasmaxtstep", 2),
+         ("pracc", 3), ("pblh", 0)):
+         result = self.write(options, varname)
+         self.assertEqual(result["lsd"], lsd, varname)
+         self.assertTrue(np.abs(result["values"] - self.values).max()
+            <= 10.**(-lsd))
+      # Without quantize, the overrides are not used
+      result = self.write({"output_profile": "map",
+         "least_significant_digit": "tas:1"})
+      self.assertIsNone(result["lsd"])
+
+if __name__ == "__main__":
+   unittest.main()
@@ -0,0 +1,137 @@
+# To test the patch of the global attributes of postprocessed files
+# (patch_global_atts.py): the comparison of the values, the changes still to
+# do, the dry runs, the files already up to date and the files searched
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import netCDF4 as nc
+
+repodir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repodir)
+import postprocess_modules as pm
+import patch_global_atts as pga
+
+CHANGES = {"set": {"Conventions": "CF-1.6", "version": "2.1",
+   "levels": [850, 500]}, "delete": ["old_attribute"]}
+
+class test_is_same(unittest.TestCase):
+
+   def test_strings(self):
+      self.assertTrue(pga.is_same("CF-1.6", "CF-1.6"))
+      self.assertTrue(pga.is_same(u"CF-1.6", "CF-1.6"))
+      self.assertFalse(pga.is_same("CF-1.6", "CF-1.5"))
+      # A number is not the same as its text
+      self.assertFalse(pga.is_same("2.1", 2.1))
+      self.assertFalse(pga.is_same(2.1, "2.1"))
+
+   def test_numbers(self):
+      self.assertTrue(pga.is_same(np.float32(2.5), 2.5))
+      self.assertTrue(pga.is_same(np.array([850, 500]), [850, 500]))
+      self.assertFalse(pga.is_same(np.array([850, 500]), [850]))
+      self.assertFalse(pga.is_same(np.int32(1), 2))
+
+class test_patch(unittest.TestCase):
+
+   # Set-up. Files with none of the changes, with all of them and with some
+   def setUp(self):
+      self.tmpdir = tempfile.mkdtemp()
+      self.files = [os.path.join(self.tmpdir, "CCRC_NARCliM_DAY_1990-1994_%s.nc"
+         % (var)) for var in ("tas", "pracc", "wss")]
+      self.write(self.files[0], {"version": "2.0", "old_attribute": "x"})
+      self.write(self.files[1], {"Conventions": "CF-1.6", "version": "2.1",
+         "levels": np.array([850, 500])})
+      self.write(self.files[2], {"Conventions": "CF-1.6", "version": 2.1})
+
+   def tearDown(self):
+      shutil.rmtree(self.tmpdir)
+
+   def write(self, filename, atts):
+      if not os.path.exists(os.path.dirname(filename)):
+         os.makedirs(os.path.dirname(filename))
+      fout = nc.Dataset(filename, "w")
+      fout.title = "NARCliM"
+      fout.setncatts(atts)
+      fout.close()
+
+   def read(self, filename):
+      fin = nc.Dataset(filename)
+      atts = dict([(name, fin.getncattr(name)) for name in fin.ncattrs()])
+      fin.close()
+      return atts
+
+   def test_get_changes(self):
+      todo = pga.get_changes(self.files[0], CHANGES)
+      self.assertEqual(todo["set"], {"Conventions": [None, "CF-1.6"],
+         "version": ["2.0", "2.1"], "levels": [None, [850, 500]]})
+      self.assertEqual(todo["delete"], ["old_attribute"])
+      self.assertEqual(pga.get_changes(self.files[1], CHANGES),
+         {"set": {}, "delete": []})
+      todo = pga.get_changes(self.files[2], CHANGES)
+      self.assertEqual(sorted(todo["set"].keys()), ["levels", "version"])
+      self.assertEqual(todo["set"]["version"][1], "2.1")
+
+   def test_patch_file(self):
+      todo = pga.patch_file(self.files[0], CHANGES)
+      self.assertEqual(sorted(todo["set"].keys()), ["Conventions", "levels",
+         "version"])
+      atts = self.read(self.files[0])
+      self.assertEqual(sorted(atts.keys()), ["Conventions", "levels", "title",
+         "version"])
+      self.assertEqual(atts["version"], "2.1")
+      np.testing.assert_array_equal(atts["levels"], [850, 500])
+      # Applied again, nothing to change
+      self.assertIsNone(pga.patch_file(self.files[0], CHANGES))
+
+   # The files up to date are not opened for writing
+   def test_uptodate(self):
+      mtime = int(os.path.getmtime(self.files[1])) - 100
+      os.utime(self.files[1], (mtime, mtime))
+      self.assertIsNone(pga.patch_file(self.files[1], CHANGES))
+      self.assertEqual(os.path.getmtime(self.files[1]), mtime)
+
+   def test_dry_run(self):
+      before = [open(filename, "rb").read() for filename in self.files]
+      logfile = os.path.join(self.tmpdir, "patch.log")
+      self.assertEqual(pga.patch_files(self.files, CHANGES, jobs=2,
+         logfile=logfile, dry_run=True), 2)
+      self.assertEqual([open(filename, "rb").read()
+         for filename in self.files], before)
+      records = [json.loads(line) for line in open(logfile).readlines()]
+      self.assertEqual([record["file"] for record in records],
+         [self.files[0], self.files[2]])
+      self.assertTrue(all([record["dry_run"] for record in records]))
+      self.assertEqual(records[0]["set"]["version"], ["2.0", "2.1"])
+      self.assertEqual(records[0]["delete"], ["old_attribute"])
+
+   def test_patch_files(self):
+      logfile = os.path.join(self.tmpdir, "patch.log")
+      self.assertEqual(pga.patch_files(self.files, CHANGES, jobs=2,
+         logfile=logfile), 2)
+      for filename in self.files:
+         self.assertEqual(pga.get_changes(filename, CHANGES),
+            {"set": {}, "delete": []})
+      # A second run only finds files up to date, and logs nothing new
+      self.assertEqual(pga.patch_files(self.files, CHANGES, logfile=logfile), 0)
+      self.assertEqual(len(open(logfile).readlines()), 2)
+      self.assertEqual(pga.patch_files(self.files, pm.GLOBATT_CHANGES,
+         logfile=logfile), 3)
+      self.assertEqual(self.read(self.files[2])["version"], "2.1")
+
+   # The subdirectories are only searched if recursive is True
+   def test_get_files(self):
+      subfile = os.path.join(self.tmpdir, "d02", "CCRC_NARCliM_MON_1990-1999_tas.nc")
+      self.write(subfile, {})
+      open(os.path.join(self.tmpdir, "notes.txt"), "w").close()
+      self.assertEqual(pga.get_files([self.tmpdir]), sorted(self.files))
+      self.assertEqual(pga.get_files([self.tmpdir], recursive=True),
+         sorted(self.files + [subfile]))
+      self.assertEqual(pga.get_files([self.tmpdir, os.path.dirname(subfile)]),
+         sorted(self.files + [subfile]))
+
+if __name__ == "__main__":
+   unittest.main()
@@ -0,0 +1,180 @@
+# To test the variables at pressure levels: the interpolation in log(p) and
+# the masking of compute_plevels (interp_plevel), the fields interpolated
+# (compute_input) and the chunks of files of process_chunked, on synthetic WRF
+# files with 3-D fields (benchmarks/synthetic_wrf.py)
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import datetime as dt
+import numpy as np
+import netCDF4 as nc
+
+repodir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repodir)
+sys.path.insert(0, os.path.join(repodir, "benchmarks"))
+import postprocess_modules as pm
+import compute_plevels as cplev
+import synthetic_wrf as synth
+import run_benchmarks as bench
+
+class options(object):
+   # Static fields already read and region postprocessed (see read_static)
+   def __init__(self, statics):
+      self.statics = statics
+      self.window = None
+
+class test_interp_plevel(unittest.TestCase):
+
+   # Set-up. Columns of 6 levels with different surface pressures and a
+   # field linear in log(p), which the interpolation reproduces exactly
+   def setUp(self):
+      psfc = np.array([[101000., 95000., 87000.], [99000., 90000., 80000.]])
+      eta = np.array([1., 0.93, 0.8, 0.6, 0.35, 0.15])
+      self.p = (psfc[np.newaxis, np.newaxis, :, :]*
+         eta[np.newaxis, :, np.newaxis, np.newaxis]).repeat(2, axis=0)
+      self.p[1] = self.p[1]*0.98
+      self.field = 200. + 15.*np.log(self.p)
+      self.field[:, :, 1, :] = self.field[:, :, 1, :] + 7.
+
+   def test_analytic(self):
+      for plev in (85000., 50000., 30000.):
+         out = cplev.interp_plevel(self.field, self.p, plev)
+         self.assertEqual(out.shape, (2, 2, 3))
+         expected = 200. + 15.*np.log(plev) + np.array([0., 7.])[:, np.newaxis]
+         valid = ~np.ma.getmaskarray(out)
+         self.assertTrue(valid.any())
+         np.testing.assert_allclose(out.filled(0.),
+            np.where(valid, expected[np.newaxis], 0.), rtol=1e-12)
+
+   def test_weights(self):
+      # Halfway in log(p) between two levels of a field linear in the level
+      field = np.arange(6.)[np.newaxis, :, np.newaxis, np.newaxis]*np.ones(
+         self.p.shape)
+      plev = np.sqrt(self.p[0, 2, 0, 0]*self.p[0, 3, 0, 0])
+      out = cplev.interp_plevel(field, self.p, plev)
+      self.assertAlmostEqual(out[0, 0, 0], 2.5, places=12)
+      # At a model level, the value of that level
+      out = cplev.interp_plevel(field, self.p, self.p[0, 4, 1, 2])
+      self.assertAlmostEqual(out[0, 1, 2], 4., places=12)
+
+   # Masked where the level is below the surface (pressure above the lowest
+   # level) or above the model top
+   def test_mask(self):
+      for plev in (100000., 85000., 20000., 12000.):
+         out = cplev.interp_plevel(self.field, self.p, plev)
+         masked = (plev > self.p[:, 0]) | (plev < self.p[:, -1])
+         np.testing.assert_array_equal(np.ma.getmaskarray(out), masked)
+      out = cplev.interp_plevel(self.field, self.p, 100000.)
+      self.assertTrue(np.ma.getmaskarray(out)[0, 1, :].all())
+      self.assertFalse(np.ma.getmaskarray(out)[0, 0, 0])
+
+class test_compute_input(unittest.TestCase):
+
+   def setUp(self):
+      self.shape = (2, 3, 2, 4)
+      rng = np.random.RandomState(0)
+      self.varvals = {"U": rng.rand(*self.shape) - 0.5,
+         "V": rng.rand(*self.shape) - 0.5, "QVAPOR": 0.02*rng.rand(*self.shape)}
+      alpha = np.radians(np.array([[-30., 0., 15., 45.], [10., 20., 30., 90.]]))
+      self.gvars = options({"SINALPHA": np.sin(alpha),
+         "COSALPHA": np.cos(alpha)})
+      self.alpha = alpha
+
+   # The grid-relative wind is rotated to the earth by the angle of the grid
+   def test_wind(self):
+      ua = cplev.compute_input("ua", self.varvals, self.gvars)
+      va = cplev.compute_input("va", self.varvals, self.gvars)
+      u, v = self.varvals["U"], self.varvals["V"]
+      np.testing.assert_allclose(ua**2 + va**2, u**2 + v**2, rtol=1e-12)
+      # Angles of the wind increased by alpha
+      np.testing.assert_allclose(np.cos(np.arctan2(va, ua) - np.arctan2(v, u)
+         - self.alpha), 1., rtol=1e-12)
+      # No rotation where the grid is aligned with the earth
+      np.testing.assert_allclose(ua[:, :, 0, 1], u[:, :, 0, 1])
+      np.testing.assert_allclose(va[:, :, 1, 3], u[:, :, 1, 3])
+
+   def test_humidity(self):
+      hus = cplev.compute_input("hus", self.varvals, self.gvars)
+      q = self.varvals["QVAPOR"]
+      np.testing.assert_allclose(hus, q/(1. + q))
+
+   def test_unknown(self):
+      self.assertRaises(ValueError, cplev.compute_input, "wa", self.varvals,
+         self.gvars)
+
+class test_process_chunked(unittest.TestCase):
+
+   # Set-up. Six days of 3-hourly wrfout files with 3-D fields. The run reads
+   # WRF_schemes.inf from the folder of postprocess_NARCliM.py
+   @classmethod
+   def setUpClass(cls):
+      cls.cwd = os.getcwd()
+      os.chdir(repodir)
+      cls.tmpdir = tempfile.mkdtemp()
+      cls.pathin = cls.tmpdir + "/"
+      rng = np.random.RandomState(0)
+      cls.files = []
+      tstart = dt.datetime(1990, 1, 1)
+      for start, dates in synth.get_file_dates("wrfout", 1990, 1990)[:6]:
+         filename = "%swrfout_d02_%s" % (cls.pathin,
+            start.strftime("%Y-%m-%d_%H:%M:%S"))
+         synth.write_wrf_file(filename, dates, synth.FIELDS_3D, 4, 5, 6,
+            tstart, rng)
+         cls.files.append(filename)
+      cls.dates = [tstart + dt.timedelta(hours=3*i) for i in xrange(6*8)]
+      cls.varnames = ["ta850", "ta500", "zg500", "ua850", "va850", "hus200",
+         "psl"]
+
+   @classmethod
+   def tearDownClass(cls):
+      shutil.rmtree(cls.tmpdir)
+      os.chdir(cls.cwd)
+
+   # Runs process_chunked with chunks of chunk_files files. Returns the values
+   # of each variable
+   def run_chunked(self, chunk_files):
+      gvars = bench.get_gvars(self.pathin, os.path.join(self.tmpdir,
+         "out%s" % (chunk_files)) + "/", 1990, 1990,
+         {"chunk_files": str(chunk_files)})
+      pathout = pm.create_outdir(gvars)
+      infos = [["%s%s.nc" % (pathout, var), var, None, False]
+         for var in self.varnames]
+      pm.process_chunked(infos, self.files, self.dates, self.dates,
+         pm.date2hours(self.dates, gvars.ref_date), pm.const.missingval, gvars)
+      values = {}
+      for info in infos:
+         fin = nc.Dataset(info[0])
+         values[info[1]] = fin.variables[info[1]][:]
+         self.assertEqual(fin.variables["time"].shape, (len(self.dates),))
+         fin.close()
+      return values
+
+   # The chunks (of one file, and uneven) give the same values as one chunk
+   def test_chunks(self):
+      whole = self.run_chunked(len(self.files))
+      for var in self.varnames:
+         self.assertEqual(whole[var].shape, (len(self.dates), 4, 5))
+      for chunk_files in (1, 4):
+         chunked = self.run_chunked(chunk_files)
+         for var in self.varnames:
+            np.testing.assert_array_equal(np.ma.getmaskarray(chunked[var]),
+               np.ma.getmaskarray(whole[var]), var)
+            np.testing.assert_array_equal(chunked[var].filled(),
+               whole[var].filled(), var)
+
+   # The values of a chunk are those of the variable computed from the fields
+   # read at once
+   def test_values(self):
+      values = self.run_chunked(2)
+      times, varvals = pm.read_block(self.files, ["T", "P", "PB", "U", "V"])
+      p = varvals["P"] + varvals["PB"]
+      t = cplev.compute_input("ta", varvals, None)
+      ta850 = cplev.interp_plevel(t, p, 85000.)
+      np.testing.assert_allclose(values["ta850"], ta850, rtol=1e-6)
+      self.assertFalse(np.ma.getmaskarray(values["ta850"]).all())
+
+if __name__ == "__main__":
+   unittest.main()
@@ -0,0 +1,123 @@
+# To test the transfer of the postprocessed files (transfer.py): copy of a
+# directory tree, files skipped when unchanged, verification and retries of
+# the copies and check of the destination
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+repodir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repodir)
+import transfer
+
+class test_transfer(unittest.TestCase):
+
+   # Set-up. Three files in a directory tree (and a temporary file of an
+   # unfinished copy, that is not transferred)
+   def setUp(self):
+      self.tmpdir = tempfile.mkdtemp()
+      self.pathin = os.path.join(self.tmpdir, "in")
+      self.pathout = os.path.join(self.tmpdir, "out")
+      self.names = ["CCRC_NARCliM_01H_1990-1990_tas.nc",
+         "CCRC_NARCliM_DAY_1990-1994_tasmax.nc",
+         os.path.join("temp", "CCRC_NARCliM_MON_1990-1999_pracc.nc")]
+      for i, name in enumerate(self.names):
+         self.write(os.path.join(self.pathin, name), os.urandom(1000*(i + 1)))
+      self.write(os.path.join(self.pathin, "unfinished.nc.part"), "part")
+      self.md5sum = transfer.md5sum
+
+   def tearDown(self):
+      transfer.md5sum = self.md5sum
+      shutil.rmtree(self.tmpdir)
+
+   def write(self, filename, content):
+      if not os.path.exists(os.path.dirname(filename)):
+         os.makedirs(os.path.dirname(filename))
+      fout = open(filename, "wb")
+      fout.write(content)
+      fout.close()
+
+   def read(self, filename):
+      fin = open(filename, "rb")
+      content = fin.read()
+      fin.close()
+      return content
+
+   def assertCopied(self, name):
+      self.assertEqual(self.read(os.path.join(self.pathin, name)),
+         self.read(os.path.join(self.pathout, name)))
+
+   def test_copy(self):
+      result = transfer.transfer(self.pathin, self.pathout, jobs=2)
+      self.assertEqual(sorted(result["copied"]), sorted(self.names))
+      self.assertEqual(result["failed"], [])
+      self.assertEqual(result["skipped"], 0)
+      for name in self.names:
+         self.assertCopied(name)
+      self.assertFalse(os.path.exists(os.path.join(self.pathout,
+         "unfinished.nc.part")))
+      manifest = transfer.read_manifest(self.pathout)
+      self.assertEqual(sorted(manifest.keys()), sorted(self.names))
+      for name in self.names:
+         self.assertEqual(manifest[name]["md5"],
+            transfer.md5sum(os.path.join(self.pathin, name)))
+
+   # Only the files new or modified since the last transfer (or missing at
+   # the destination) are copied again
+   def test_skip_unchanged(self):
+      transfer.transfer(self.pathin, self.pathout)
+      result = transfer.transfer(self.pathin, self.pathout)
+      self.assertEqual(result["copied"], [])
+      self.assertEqual(result["skipped"], 3)
+
+      self.write(os.path.join(self.pathin, self.names[0]), "modified")
+      os.remove(os.path.join(self.pathout, self.names[1]))
+      self.write(os.path.join(self.pathin, "new.nc"), "new")
+      result = transfer.transfer(self.pathin, self.pathout)
+      self.assertEqual(sorted(result["copied"]), sorted([self.names[0],
+         self.names[1], "new.nc"]))
+      self.assertEqual(result["skipped"], 1)
+      for name in self.names + ["new.nc"]:
+         self.assertCopied(name)
+
+   # A copy whose checksum is wrong is retried
+   def test_retry(self):
+      calls = []
+      def md5sum_once_wrong(filename):
+         calls.append(filename)
+         if len(calls) == 1:
+            return "wrong"
+         return self.md5sum(filename)
+      transfer.md5sum = md5sum_once_wrong
+      entry = transfer.copy_file(os.path.join(self.pathin, self.names[0]),
+         os.path.join(self.pathout, self.names[0]), retries=1)
+      self.assertEqual(len(calls), 2)
+      self.assertEqual(entry["md5"], self.md5sum(os.path.join(self.pathin,
+         self.names[0])))
+      self.assertCopied(self.names[0])
+
+   # The files that cannot be verified after all retries are not left at the
+   # destination nor added to the manifest
+   def test_failed(self):
+      transfer.md5sum = lambda filename: "wrong"
+      result = transfer.transfer(self.pathin, self.pathout, retries=1)
+      self.assertEqual(result["copied"], [])
+      self.assertEqual(sorted(result["failed"]), sorted(self.names))
+      self.assertEqual(transfer.read_manifest(self.pathout), {})
+      self.assertEqual(transfer.get_files(self.pathout), {})
+      for root, dirs, filenames in os.walk(self.pathout):
+         self.assertEqual([filename for filename in filenames
+            if filename.endswith(".part")], [])
+
+   def test_check(self):
+      transfer.transfer(self.pathin, self.pathout)
+      self.assertEqual(transfer.check(self.pathout), [])
+      self.write(os.path.join(self.pathout, self.names[0]), "corrupted")
+      os.remove(os.path.join(self.pathout, self.names[2]))
+      self.assertEqual(transfer.check(self.pathout), [self.names[0],
+         self.names[2]])
+
+if __name__ == "__main__":
+   unittest.main()
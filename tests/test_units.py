@@ -0,0 +1,163 @@
+# To test the work units of the daily statistics (get_daily_units and
+# run_daily_unit of postprocess_modules) and the months and monthly time
+# bounds computed from the hours of the files (get_months and get_monthbnds)
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import datetime as dt
+import numpy as np
+import netCDF4 as nc
+
+repodir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repodir)
+sys.path.insert(0, os.path.join(repodir, "benchmarks"))
+import postprocess_modules as pm
+import variables_info as cfg
+import synthetic_wrf as synth
+import run_benchmarks as bench
+
+NY = 2
+NX = 3
+
+class test_daily_units(unittest.TestCase):
+
+   # Set-up. Hourly tas files of 1990-1999 in the output folder and the
+   # reference file of the grid. The run reads WRF_schemes.inf from the folder
+   # of postprocess_NARCliM.py
+   def setUp(self):
+      self.cwd = os.getcwd()
+      os.chdir(repodir)
+      self.tmpdir = tempfile.mkdtemp()
+      pathin = self.tmpdir + "/"
+      synth.write_wrf_file(pathin + "wrfout_d02_1990-01-01_00:00:00",
+         [dt.datetime(1990, 1, 1)], [], NY, NX, 4, dt.datetime(1990, 1, 1),
+         np.random.RandomState(0))
+      self.gvars = bench.get_gvars(pathin,
+         os.path.join(self.tmpdir, "out") + "/", 1990, 1999,
+         {"overwrite": "False"})
+      self.varinfo = cfg.VariablesInfo()
+      self.pathout = pm.create_outdir(self.gvars)
+      self.files = []
+      for year in xrange(1990, 2000):
+         filename = "%s%s01H_%s-%s_tas.nc" % (self.pathout,
+            self.gvars.outfile_patt, year, year)
+         self.write_hourly(filename, year)
+         self.files.append(filename)
+
+   def tearDown(self):
+      shutil.rmtree(self.tmpdir)
+      os.chdir(self.cwd)
+
+   def write_hourly(self, filename, year):
+      ndays = (dt.datetime(year + 1, 1, 1) - dt.datetime(year, 1, 1)).days
+      hours = pm.date2hours([dt.datetime(year, 1, 1) + dt.timedelta(hours=hh)
+         for hh in xrange(ndays*24)], self.gvars.ref_date)
+      fout = nc.Dataset(filename, "w", format="NETCDF4_CLASSIC")
+      fout.createDimension("time", None)
+      fout.createDimension("y", NY)
+      fout.createDimension("x", NX)
+      time = fout.createVariable("time", np.float64, ("time",))
+      time.units = "hours since 1949-12-01 00:00:00"
+      time[:] = hours
+      tas = fout.createVariable("tas", np.float32, ("time", "y", "x"),
+         fill_value=pm.const.missingval)
+      tas.units = "K"
+      tas[:] = 280. + np.arange(len(hours)*NY*NX).reshape(
+         (len(hours), NY, NX)) % 17
+      fout.close()
+
+   def get_daily_file(self, period, varstat):
+      return "%s%sDAY_%s_%s.nc" % (self.pathout, self.gvars.outfile_patt,
+         period, varstat)
+
+   def test_units(self):
+      units = pm.get_daily_units(self.gvars, "tas", ["mean", "min", "max"],
+         self.varinfo)
+      self.assertEqual([(unit["syp"], unit["eyp"]) for unit in units],
+         [(1990, 1995), (1995, 2000)])
+      self.assertEqual(units[0]["files"], self.files[:5])
+      self.assertEqual(units[1]["files"], self.files[5:])
+      for unit, ndays in zip(units, (1826, 1826)):
+         self.assertEqual([stat["varstat"] for stat in unit["stats"]],
+            ["tasmean", "tasmin", "tasmax"])
+         self.assertEqual(unit["nbytes"],
+            pm.DAILY_WORK_FACTOR*8*ndays*24*NY*NX)
+      self.assertEqual(os.path.normpath(units[0]["stats"][0]["file_out"]),
+         self.get_daily_file("1990-1994", "tasmean"))
+
+   # Only the statistics whose files are missing are computed, and the blocks
+   # with all their files are not read
+   def test_units_existing(self):
+      for period, varstat in (("1990-1994", "tasmin"),
+         ("1995-1999", "tasmean"), ("1995-1999", "tasmin"),
+         ("1995-1999", "tasmax")):
+         open(self.get_daily_file(period, varstat), "w").close()
+      units = pm.get_daily_units(self.gvars, "tas", ["mean", "min", "max"],
+         self.varinfo)
+      self.assertEqual(len(units), 1)
+      self.assertEqual(units[0]["syp"], 1990)
+      self.assertEqual([stat["varstat"] for stat in units[0]["stats"]],
+         ["tasmean", "tasmax"])
+
+   def test_run_unit(self):
+      unit = pm.get_daily_units(self.gvars, "tas", ["mean", "max"],
+         self.varinfo)[0]
+      pm.run_daily_unit(self.gvars, unit)
+      fin = nc.MFDataset(self.files[:5])
+      tas = fin.variables["tas"][:].reshape((1826, 24, NY, NX))
+      fin.close()
+      fin = nc.Dataset(self.get_daily_file("1990-1994", "tasmean"))
+      np.testing.assert_allclose(fin.variables["tasmean"][:],
+         tas.mean(axis=1), rtol=1e-6)
+      # Days at noon, with bounds at midnight
+      days = fin.variables["time"][:]
+      self.assertEqual(days[0], pm.date2hours([dt.datetime(1990, 1, 1, 12)],
+         self.gvars.ref_date)[0])
+      np.testing.assert_array_equal(fin.variables["time_bnds"][:, 0], days - 12.)
+      np.testing.assert_array_equal(fin.variables["time_bnds"][:, 1], days + 12.)
+      fin.close()
+      fin = nc.Dataset(self.get_daily_file("1990-1994", "tasmax"))
+      np.testing.assert_allclose(fin.variables["tasmax"][:], tas.max(axis=1),
+         rtol=1e-6)
+      fin.close()
+
+class test_months(unittest.TestCase):
+
+   def setUp(self):
+      self.ref_date = dt.datetime(1949, 12, 1)
+
+   def get_hours(self, dates):
+      return np.asarray(pm.date2hours(dates, self.ref_date))
+
+   def test_months(self):
+      hours = self.get_hours([dt.datetime(1991, 12, 31, 12),
+         dt.datetime(1992, 1, 1), dt.datetime(1992, 2, 29, 23, 30),
+         dt.datetime(1992, 3, 1), dt.datetime(1993, 1, 15)])
+      months, first = pm.get_months(hours, self.ref_date)
+      self.assertEqual(months.tolist(), [1, 2, 3, 4, 14])
+      self.assertEqual(first, np.datetime64("1991-12", "M"))
+
+   # Times close to the start of a month are not moved to the month before by
+   # the rounding of the hours
+   def test_months_rounding(self):
+      hours = self.get_hours([dt.datetime(1990, 1, 1)]) + np.array([-1e-9, 0.])
+      months, first = pm.get_months(hours, self.ref_date)
+      self.assertEqual(months.tolist(), [1, 1])
+      self.assertEqual(first, np.datetime64("1990-01", "M"))
+
+   def test_monthbnds(self):
+      bnds = pm.get_monthbnds(np.datetime64("1991-12", "M"), 4, self.ref_date)
+      edges = self.get_hours([dt.datetime(1991, 12, 1), dt.datetime(1992, 1, 1),
+         dt.datetime(1992, 2, 1), dt.datetime(1992, 3, 1),
+         dt.datetime(1992, 4, 1)])
+      self.assertEqual(bnds.shape, (4, 2))
+      np.testing.assert_array_equal(bnds[:, 0], edges[:-1])
+      np.testing.assert_array_equal(bnds[:, 1], edges[1:])
+      # 29 days in February 1992
+      self.assertEqual(bnds[2, 1] - bnds[2, 0], 29*24.)
+
+if __name__ == "__main__":
+   unittest.main()
@@ -0,0 +1,64 @@
+# To test the registry of variables of variables_info (VARIABLES) and the
+# groups of variables read together (get_read_groups)
+
+import os
+import sys
+import unittest
+
+repodir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repodir)
+import variables_info as cfg
+import compute_vars as comv
+
+class test_variables_info(unittest.TestCase):
+
+   def setUp(self):
+      self.varinfo = cfg.VariablesInfo()
+
+   # Variables that share WRF fields are read in the same group
+   def test_groups_shared_inputs(self):
+      groups = self.varinfo.get_read_groups(["wss", "tas", "uas", "vas"])
+      self.assertEqual(groups, [["wss", "uas", "vas"], ["tas"]])
+
+   # A variable that shares fields with several groups merges them, and the
+   # variables keep the order of the list
+   def test_groups_merged(self):
+      groups = self.varinfo.get_read_groups(["tas", "ps", "huss", "hurs",
+         "rsds"])
+      self.assertEqual(groups, [["tas", "ps", "huss", "hurs"], ["rsds"]])
+
+   def test_groups_all_variables(self):
+      vnames = self.varinfo.VARIABLES.keys()
+      groups = self.varinfo.get_read_groups(vnames)
+      self.assertEqual(sorted(sum(groups, [])), sorted(vnames))
+      for group in groups:
+         self.assertEqual(group, sorted(group, key=vnames.index))
+
+   # All variables from 3-D fields are in a single group of their own, even
+   # if they share fields with others (T2 and PSFC are not 3-D fields)
+   def test_groups_chunked(self):
+      groups = self.varinfo.get_read_groups(["ta850", "tas", "psl", "zg500",
+         "ps", "hus200"])
+      self.assertEqual(groups, [["ta850", "psl", "zg500", "hus200"], ["tas"],
+         ["ps"]])
+      self.assertEqual(self.varinfo.get_group_inputs(groups[0]),
+         ["T", "P", "PB", "PH", "PHB", "QVAPOR"])
+
+   def test_plevel(self):
+      self.assertEqual(self.varinfo.get_plevel("ta850"), ("ta", 850))
+      self.assertEqual(self.varinfo.get_plevel("hus200"), ("hus", 200))
+      self.assertEqual(self.varinfo.get_plevel("psl"), None)
+      for name in self.varinfo.PLEVEL_VARIABLES:
+         for plev in self.varinfo.PLEVELS:
+            self.assertTrue(self.varinfo.is_chunked("%s%s" % (name, plev)))
+            self.assertTrue(self.varinfo.is_supported("%s%s" % (name, plev)))
+
+   # Every variable of the registry can be computed: by its compute_*
+   # function, or by compute_plevel for the pressure-level variables
+   def test_compute_functions(self):
+      for vname in self.varinfo.VARIABLES.keys():
+         if self.varinfo.get_plevel(vname) is None:
+            self.assertTrue(hasattr(comv, "compute_" + vname), vname)
+
+if __name__ == "__main__":
+   unittest.main()
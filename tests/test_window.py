@@ -0,0 +1,87 @@
+# To test the subset window of postprocess_modules (get_window and
+# get_window_index), on a synthetic WRF file (benchmarks/synthetic_wrf.py)
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import datetime as dt
+import numpy as np
+
+repodir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repodir)
+sys.path.insert(0, os.path.join(repodir, "benchmarks"))
+import postprocess_modules as pm
+import synthetic_wrf as synth
+
+class options(object):
+   # Subset options of the input file (see namelist.py)
+   def __init__(self, subset_window=None, subset_bbox=None):
+      self.subset_window = subset_window
+      self.subset_bbox = subset_bbox
+
+class test_window(unittest.TestCase):
+
+   # Set-up. A wrfout file of 10x12 points as reference file
+   def setUp(self):
+      self.tmpdir = tempfile.mkdtemp()
+      self.gvars = options()
+      self.gvars.fileref_att = os.path.join(self.tmpdir,
+         "wrfout_d02_1990-01-01_00:00:00")
+      synth.write_wrf_file(self.gvars.fileref_att, [dt.datetime(1990, 1, 1)],
+         [], 10, 12, 4, dt.datetime(1990, 1, 1), np.random.RandomState(0))
+
+   def tearDown(self):
+      shutil.rmtree(self.tmpdir)
+
+   def test_whole_domain(self):
+      self.assertEqual(pm.get_window(self.gvars, options()), None)
+
+   def test_subset_window(self):
+      window = pm.get_window(self.gvars, options(subset_window=[2, 5, 0, 11]))
+      self.assertEqual(window, (slice(2, 6), slice(0, 12)))
+
+   def test_subset_window_out_of_domain(self):
+      for subset in ([2, 10, 0, 11], [0, 9, 3, 12], [-1, 5, 0, 11],
+         [5, 2, 0, 11], [0, 9, 7, 6]):
+         self.assertRaises(SystemExit, pm.get_window, self.gvars,
+            options(subset_window=subset))
+
+   def test_subset_bbox(self):
+      lon, lat = pm.read_lonlat(self.gvars.fileref_att)
+      # Box around the points y=3:6, x=4:9
+      bbox = [lon[0, 4] - 0.1, lon[0, 8] + 0.1, lat[3, 0] - 0.1,
+         lat[5, 0] + 0.1]
+      window = pm.get_window(self.gvars, options(subset_bbox=bbox))
+      self.assertEqual(window, (slice(3, 6), slice(4, 9)))
+      self.assertTrue(np.all(lon[window] >= bbox[0]))
+      self.assertTrue(np.all(lat[window] <= bbox[3]))
+
+   def test_subset_bbox_empty(self):
+      self.assertRaises(SystemExit, pm.get_window, self.gvars,
+         options(subset_bbox=[0., 1., 0., 1.]))
+
+   def test_window_index(self):
+      window = (slice(2, 6), slice(3, 9))
+      self.assertEqual(pm.get_window_index(3, None),
+         (slice(None), slice(None), slice(None)))
+      self.assertEqual(pm.get_window_index(3, window, 0), (0,) + window)
+      self.assertEqual(pm.get_window_index(4, window),
+         (slice(None), slice(None)) + window)
+
+   def test_window_index_staggered(self):
+      # One more point along the staggered dimension, to unstagger the window
+      window = (slice(2, 6), slice(3, 9))
+      index = pm.get_window_index(4, window,
+         dims=("Time", "bottom_top", "south_north", "west_east_stag"))
+      self.assertEqual(index[2:], (slice(2, 6), slice(3, 10)))
+      index = pm.get_window_index(4, window,
+         dims=("Time", "bottom_top", "south_north_stag", "west_east"))
+      self.assertEqual(index[2:], (slice(2, 7), slice(3, 9)))
+      index = pm.get_window_index(4, None,
+         dims=("Time", "bottom_top", "south_north_stag", "west_east"))
+      self.assertEqual(index[2:], (slice(None), slice(None)))
+
+if __name__ == "__main__":
+   unittest.main()
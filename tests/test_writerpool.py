@@ -0,0 +1,172 @@
+# To test the write stage of postprocess_NARCliM.py (writerpool): the files
+# written by the writer process are the same as those of create_netcdf, in the
+# order they are submitted, the memory budget blocks submit, close waits for
+# all the files, and the run stops (without hanging) if the writer fails
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+import subprocess
+import datetime as dt
+import numpy as np
+import netCDF4 as nc
+
+repodir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repodir)
+sys.path.insert(0, os.path.join(repodir, "benchmarks"))
+import postprocess_modules as pm
+import synthetic_wrf as synth
+import run_benchmarks as bench
+
+NT = 48
+NY = 6
+NX = 8
+VARATT = {"standard_name": "air_temperature", "long_name": "Surface air\
+ temperature", "units": "K", "_FillValue": pm.const.missingval}
+
+class test_writerpool(unittest.TestCase):
+
+   # Set-up. The reference file of the grid. The run reads WRF_schemes.inf from
+   # the folder of postprocess_NARCliM.py
+   @classmethod
+   def setUpClass(cls):
+      cls.cwd = os.getcwd()
+      os.chdir(repodir)
+      cls.tmpdir = tempfile.mkdtemp()
+      cls.pathin = os.path.join(cls.tmpdir, "wrf") + "/"
+      os.makedirs(cls.pathin)
+      synth.write_wrf_file(cls.pathin + "wrfout_d02_1990-01-01_00:00:00",
+         [dt.datetime(1990, 1, 1)], [], NY, NX, 4, dt.datetime(1990, 1, 1),
+         np.random.RandomState(0))
+      rng = np.random.RandomState(1)
+      cls.values = [280. + 10.*rng.rand(NT, NY, NX) for i in xrange(4)]
+      cls.time = np.arange(NT) + 0.5
+      cls.time_bnds = np.array([np.arange(NT), np.arange(NT) + 1.]).T
+
+   @classmethod
+   def tearDownClass(cls):
+      shutil.rmtree(cls.tmpdir)
+      os.chdir(cls.cwd)
+
+   def get_gvars(self, name, async_write):
+      gvars = bench.get_gvars(self.pathin, os.path.join(self.tmpdir, name),
+         1990, 1990, {"async_write": str(async_write)})
+      return gvars, pm.create_outdir(gvars)
+
+   def get_info(self, pathout, i):
+      return ["%sCCRC_NARCliM_01H_1990-1990_tas%s.nc" % (pathout, i),
+         "tas%s" % (i), VARATT, True]
+
+   def read(self, filename, varname):
+      fin = nc.Dataset(filename)
+      values = [fin.variables[name][:] for name in (varname, "time",
+         "time_bnds")]
+      atts = fin.variables[varname].__dict__
+      fin.close()
+      return values, atts
+
+   # Same files as create_netcdf, written in the order they are submitted,
+   # and all of them written when close returns
+   def test_files(self):
+      gsync, pathsync = self.get_gvars("sync", False)
+      gvars, pathout = self.get_gvars("async", True)
+      writer = pm.writerpool(gvars)
+      for i, varval in enumerate(self.values):
+         pm.create_netcdf(self.get_info(pathsync, i), gsync, varval, self.time,
+            self.time_bnds)
+         writer.submit(self.get_info(pathout, i), varval, self.time,
+            self.time_bnds)
+      writer.close()
+      self.assertIsNone(writer.process)
+      self.assertEqual(writer.pending, {})
+      mtimes = []
+      for i in xrange(len(self.values)):
+         filename = self.get_info(pathout, i)[0]
+         self.assertFalse(os.path.exists(filename + ".part"))
+         mtimes.append(os.path.getmtime(filename))
+         values, atts = self.read(filename, "tas%s" % (i))
+         expected, expected_atts = self.read(self.get_info(pathsync, i)[0],
+            "tas%s" % (i))
+         self.assertEqual(atts, expected_atts)
+         for value, expect in zip(values, expected):
+            np.testing.assert_array_equal(value, expect)
+      self.assertEqual(mtimes, sorted(mtimes))
+
+   # With a budget of one task, each submit waits for the previous file
+   def test_budget(self):
+      gvars, pathout = self.get_gvars("budget", True)
+      nbytes = 2*pm.get_task_nbytes(self.values[0], self.time, self.time_bnds)
+      writer = pm.writerpool(gvars, maxbytes=nbytes + 1)
+      for i, varval in enumerate(self.values):
+         writer.submit(self.get_info(pathout, i), varval, self.time,
+            self.time_bnds)
+         self.assertEqual(writer.pending.keys(), [self.get_info(pathout, i)[0]])
+         # The previous files are already written
+         for iprev in xrange(i):
+            self.assertTrue(os.path.exists(self.get_info(pathout, iprev)[0]))
+      writer.close()
+      self.assertTrue(os.path.exists(self.get_info(pathout, 3)[0]))
+
+   # A file that cannot be written stops the run at the next submit, and in
+   # close if it is the last one
+   def test_write_error(self):
+      gvars, pathout = self.get_gvars("error", True)
+      writer = pm.writerpool(gvars)
+      missing = os.path.join(self.tmpdir, "missing") + "/"
+      writer.submit(self.get_info(missing, 0), self.values[0], self.time,
+         self.time_bnds)
+      writer.wait_one()
+      self.assertEqual(writer.errors, [self.get_info(missing, 0)[0]])
+      self.assertRaises(SystemExit, writer.submit, self.get_info(pathout, 1),
+         self.values[1], self.time, self.time_bnds)
+      self.assertFalse(os.path.exists(self.get_info(pathout, 1)[0]))
+      self.assertRaises(SystemExit, writer.close)
+
+      writer = pm.writerpool(gvars)
+      writer.submit(self.get_info(missing, 0), self.values[0], self.time,
+         self.time_bnds)
+      self.assertRaises(SystemExit, writer.close)
+
+   # The run stops, instead of waiting for ever, if the writer process dies
+   # with tasks in the queue (larger than the buffer of the pipe)
+   def test_writer_dies(self):
+      script = """
+import os, sys, numpy as np
+sys.path.insert(0, %r)
+sys.path.insert(0, %r)
+import postprocess_modules as pm
+import run_benchmarks as bench
+os.chdir(%r)
+gvars = bench.get_gvars(%r, %r, 1990, 1990, {"async_write": "True"})
+pathout = pm.create_outdir(gvars)
+writer = pm.writerpool(gvars)
+writer.process.terminate()
+writer.process.join()
+varval = np.zeros((100, 100, 100))
+try:
+   writer.submit([pathout + "tas.nc", "tas", {}, False], varval, None, None)
+except SystemExit:
+   print "STOPPED AT SUBMIT"
+writer.pending["tas.nc"] = 1
+writer.tasks.put(([pathout + "tas.nc", "tas", {}, False], varval, None, None))
+writer.close()
+""" % (repodir, os.path.join(repodir, "benchmarks"), repodir, self.pathin,
+         os.path.join(self.tmpdir, "dies"))
+      proc = subprocess.Popen([sys.executable, "-c", script],
+         stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+      tstart = time.time()
+      while proc.poll() is None and time.time() - tstart < 60:
+         time.sleep(0.1)
+      if proc.poll() is None:
+         proc.kill()
+         self.fail("The run did not stop after the writer process died")
+      stdout, stderr = proc.communicate()
+      self.assertEqual(proc.returncode, 1)
+      self.assertIn("STOPPED AT SUBMIT", stdout)
+      self.assertIn("ERROR: the writer process stopped", stderr)
+
+if __name__ == "__main__":
+   unittest.main()
@@ -0,0 +1,425 @@
+#!/usr/bin/env python
+
+"""tracing.py
+   Timed spans of the postprocess (read, compute, qc, write, daily, monthly...).
+
+   Each span measures the wall and CPU time, the bytes read and written by the
+   process, the size of the data it handled and the peak memory (RSS), and it is
+   labelled with the variable, period and type of file it belongs to. Finished
+   spans are written as one JSON object per line to the trace file (next to the
+   log of postprocess_NARCliM.py) and added to a summary that is printed at the
+   end of the run.
+
+   The bytes read and written are taken from /proc/self/io (Linux only), so they do
+   not include the files read by the joblib workers of read_list; data_mb (the size
+   of the fields read or written) is given for those spans.
+
+   Some types of spans can also be profiled (postprocess_NARCliM.py --profile, see
+   profiler): cProfile statistics and sampled call stacks (in the collapsed format
+   of flamegraph.pl and speedscope) are written for each of them. Without
+   --profile nothing is profiled and the spans are not slowed down.
+
+   The reads of the WRF files are also accounted file by file (iostats): the MB
+   and seconds of each file, summarised per type of file and source directory.
+"""
+import os
+import time
+import json
+import marshal
+import signal
+import cProfile
+import pstats
+import resource
+
+
+class tracer:
+  """ Spans of a run, each started and stopped around a stage and timed:
+
+    span=trace.start('read',var='tas',period='1990-1994')
+    ...
+    trace.stop(span,nbytes=varvals['T2'].nbytes)   # prints '======> read ... DONE in ...'
+
+    trace.open(filename) writes the spans to filename; trace.summary() prints the
+    totals of each type of span. In a worker process, the records are kept in
+    trace.records (a list) and added to the trace of the run with add_records.
+  """
+  def __init__(self):
+    self.fout=None
+    self.records=None
+    self.stack=[]
+    self.totals={}
+    self.order=[]
+    self.profiler=None
+
+  def open(self,filename):
+    """ Writes the spans to filename (JSON lines) from now on
+    """
+    self.fout=open(filename,'w')
+
+  def start(self,name,**labels):
+    """ Starts a span called name, with labels (e.g. var, period, filet). The
+    labels of the enclosing span are added to those given.
+    """
+    span={'span':name,'labels':labels,'t0':time.time(),'cpu0':get_cputime(),'io0':get_iobytes()}
+    if len(self.stack)>0:
+      span['parent']=self.stack[-1]['span']
+      span['labels']=dict(self.stack[-1]['labels'].items()+labels.items())
+    self.stack.append(span)
+    if self.profiler is not None:
+      span['profiled']=self.profiler.push(name)
+    return span
+
+  def stop(self,span,nbytes=None,verbose=True):
+    """ Stops span and records it. nbytes is the size of the data handled by the
+    span (fields read, computed or written), when it is known.
+    """
+    if span.get('profiled',False):
+      self.profiler.pop(span['span'])
+    wall=time.time()-span['t0']
+    cpu=[now-before for now,before in zip(get_cputime(),span['cpu0'])]
+    io=[now-before for now,before in zip(get_iobytes(),span['io0'])]
+    if span in self.stack:
+      self.stack.remove(span)
+    record={'span':span['span'],'start':round(span['t0'],3),'wall':round(wall,4),
+            'cpu':round(cpu[0],4),'cpu_children':round(cpu[1],4),
+            'read_mb':round(io[0]/1024.**2,3),'written_mb':round(io[1]/1024.**2,3),
+            'maxrss_mb':round(get_maxrss()/1024.,1)}
+    if nbytes is not None:
+      record['data_mb']=round(nbytes/1024.**2,3)
+    if 'parent' in span:
+      record['parent']=span['parent']
+    record.update(span['labels'])
+    self.write(record)
+    self.add_total(record)
+    if verbose:
+      labels=' '.join([str(span['labels'][key]) for key in sorted(span['labels'].keys())])
+      print '======> %s %s DONE in %.2g seconds (cpu %.2g s, peak RSS %.0f MB)' %(span['span'],labels,wall,
+            cpu[0]+cpu[1],record['maxrss_mb']),"\n"
+    return record
+
+  def add_total(self,record):
+    """ Adds a finished span to the totals of its type
+    """
+    name=record['span']
+    if name not in self.totals:
+      self.totals[name]={'count':0,'wall':0.,'cpu':0.,'read_mb':0.,'written_mb':0.,'data_mb':0.,'maxrss_mb':0.}
+      self.order.append(name)
+    total=self.totals[name]
+    total['count']=total['count']+1
+    for key in ['wall','read_mb','written_mb','data_mb']:
+      total[key]=total[key]+record.get(key,0.)
+    total['cpu']=total['cpu']+record['cpu']+record['cpu_children']
+    total['maxrss_mb']=max(total['maxrss_mb'],record['maxrss_mb'])
+
+  def summary(self):
+    """ Prints the totals of each type of span and writes them to the trace file
+    """
+    print '\n','*************************************'
+    print '  TIME SUMMARY'
+    print '*************************************'
+    print '%-12s %6s %10s %10s %10s %10s %10s %10s' %('span','count','wall (s)','cpu (s)','read MB','written MB','data MB','peak MB')
+    for name in self.order:
+      total=self.totals[name]
+      print '%-12s %6d %10.1f %10.1f %10.1f %10.1f %10.1f %10.0f' %(name,total['count'],total['wall'],total['cpu'],
+            total['read_mb'],total['written_mb'],total['data_mb'],total['maxrss_mb'])
+    self.write({'summary':self.totals})
+
+  def add_records(self,records):
+    """ Writes the records of another process (e.g. a worker of run_units in
+    postprocess_modules.py) and adds its spans to the totals
+    """
+    for record in records:
+      self.write(record)
+      if 'span' in record:
+        self.add_total(record)
+
+  def write(self,record):
+    """ Writes a record (dictionary) to the trace file
+    """
+    if self.records is not None:
+      self.records.append(record)
+    if self.fout is not None:
+      self.fout.write(json.dumps(record,sort_keys=True)+'\n')
+      self.fout.flush()
+
+  def close(self):
+    if self.fout is not None:
+      self.fout.close()
+      self.fout=None
+
+
+# *************************************************************************************
+class profiler:
+  """ cProfile and a stack sampler for the spans of some types (stages):
+
+    trace.profiler=profiler(['compute','qc'])    # or ['all']
+    ... run ...
+    trace.profiler.write('/path/postprocess_..._profile')
+
+  The time of nested profiled spans is attributed to the innermost one (e.g. with
+  'all' the read inside a variable counts for read, not for variable). write()
+  writes, for each stage, the cProfile statistics (_<stage>.prof, readable with
+  pstats, and the 40 most expensive functions in _<stage>.txt) and the sampled
+  stacks (_<stage>.collapsed, one 'frame;frame;... count' line per stack). The
+  stacks are sampled every interval seconds of CPU time of the main process, so
+  the time waiting for the joblib workers is not sampled. The workers of run_units
+  (postprocess_modules.py) profile the same stages with their own profiler, and
+  their statistics and stacks are added to those of the run (add_results).
+  """
+  def __init__(self,stages,interval=0.01):
+    self.stages=stages
+    self.interval=interval
+    self.profiles={}
+    self.samples={}
+    self.added={}
+    self.active=[]
+    signal.signal(signal.SIGPROF,self.sample)
+    # System calls interrupted by a sample are restarted (e.g. the reads of netCDF4)
+    signal.siginterrupt(signal.SIGPROF,False)
+
+  def push(self,name):
+    """ Starts profiling stage name. Returns False if name is not profiled
+    """
+    if ('all' not in self.stages) and (name not in self.stages):
+      return False
+    if len(self.active)>0:
+      self.profiles[self.active[-1]].disable()
+    else:
+      signal.setitimer(signal.ITIMER_PROF,self.interval,self.interval)
+    if name not in self.profiles:
+      self.profiles[name]=cProfile.Profile()
+      self.samples[name]={}
+    self.active.append(name)
+    self.profiles[name].enable()
+    return True
+
+  def pop(self,name):
+    """ Stops profiling stage name and resumes the enclosing profiled stage
+    """
+    self.profiles[name].disable()
+    self.active.pop()
+    if len(self.active)>0:
+      self.profiles[self.active[-1]].enable()
+    else:
+      signal.setitimer(signal.ITIMER_PROF,0,0)
+
+  def sample(self,signum,frame):
+    """ Handler of SIGPROF: adds the current call stack to the active stage
+    """
+    if len(self.active)==0:
+      return
+    stack=[]
+    while frame is not None:
+      code=frame.f_code
+      stack.append('%s (%s:%s)' %(code.co_name,os.path.basename(code.co_filename),code.co_firstlineno))
+      frame=frame.f_back
+    key=';'.join(reversed(stack))
+    samples=self.samples[self.active[-1]]
+    samples[key]=samples.get(key,0)+1
+
+  def get_stats(self,name):
+    """ cProfile statistics of stage name (as in the .prof files), with those
+    added from other processes
+    """
+    stats={}
+    if name in self.profiles:
+      self.profiles[name].create_stats()
+      stats.update(self.profiles[name].stats)
+    for other in self.added.get(name,[]):
+      for func,stat in other.items():
+        stats[func]=pstats.add_func_stats(stats.get(func,(0,0,0,0,{})),stat)
+    return stats
+
+  def get_results(self):
+    """ Statistics and sampled stacks of all stages, to be sent to another
+    process (e.g. from a worker) and added to its profiler with add_results
+    """
+    return dict([(name,{'stats':self.get_stats(name),'samples':self.samples[name]})
+                 for name in self.profiles.keys()])
+
+  def add_results(self,results):
+    """ Adds the statistics and stacks of another process (see get_results)
+    """
+    for name,result in results.items():
+      self.added.setdefault(name,[]).append(result['stats'])
+      samples=self.samples.setdefault(name,{})
+      for key,count in result['samples'].items():
+        samples[key]=samples.get(key,0)+count
+
+  def write(self,prefix):
+    """ Writes the profile files of all stages. Returns the list of files written
+    """
+    written=[]
+    for name in sorted(set(self.profiles.keys())|set(self.added.keys())):
+      fout=open('%s_%s.prof' %(prefix,name),'wb')
+      marshal.dump(self.get_stats(name),fout)
+      fout.close()
+      fout=open('%s_%s.txt' %(prefix,name),'w')
+      try:
+        pstats.Stats('%s_%s.prof' %(prefix,name),stream=fout).sort_stats('cumulative').print_stats(40)
+      except TypeError:
+        # Stage started but no function called while it was profiled
+        pass
+      fout.close()
+      fout=open('%s_%s.collapsed' %(prefix,name),'w')
+      for key in sorted(self.samples[name].keys()):
+        fout.write('%s %s\n' %(key,self.samples[name][key]))
+      fout.close()
+      written.extend(['%s_%s.%s' %(prefix,name,ext) for ext in ['prof','txt','collapsed']])
+    return written
+
+
+# *************************************************************************************
+class iostats:
+  """ Reads of WRF files: size of the fields read and time spent in each file
+
+    io.add(filename,nbytes,seconds)
+    io.add(filename,nbytes,seconds,kind='probe')
+    io.report()      # prints MB/s per type of file and directory, and the slowest files
+
+  The reads done in the joblib workers of read_list are recorded in the workers
+  and returned with the fields (see read_block_io in postprocess_modules.py).
+  Probes (reads of a single time step, e.g. read_first_tstep) take the time of
+  opening the file for a few kB, so they are accounted apart and are not part of
+  the throughput nor of the slowest files.
+  """
+  def __init__(self):
+    self.records=[]
+
+  def add(self,filename,nbytes,seconds,kind='read'):
+    self.records.append((os.path.abspath(filename),nbytes,seconds,kind))
+
+  def extend(self,records):
+    self.records.extend(records)
+
+  def take(self):
+    """ Returns the records and starts a new list
+    """
+    records=self.records
+    self.records=[]
+    return records
+
+  def get_totals(self,key,kind='read'):
+    """ Files, MB, seconds and MB/s of the reads of a kind grouped by key(filename)
+    """
+    totals={}
+    for filename,nbytes,seconds in [record[:3] for record in self.records if record[3]==kind]:
+      total=totals.setdefault(key(filename),{'files':0,'mb':0.,'seconds':0.})
+      total['files']=total['files']+1
+      total['mb']=total['mb']+nbytes/1024.**2
+      total['seconds']=total['seconds']+seconds
+    for total in totals.values():
+      total['mb_s']=total['mb']/max(total['seconds'],1e-6)
+    return totals
+
+  def report(self,nslowest=10):
+    """ Prints the throughput per type of file and per directory, and the nslowest
+    files (lowest MB/s). Returns the same information as a dictionary.
+    """
+    report={'filetype':self.get_totals(lambda filename: os.path.basename(filename).split('_')[0]),
+            'directory':self.get_totals(os.path.dirname),
+            'probes':self.get_totals(lambda filename: 'probes',kind='probe').get('probes')}
+    print '\n','*************************************'
+    print '  READ THROUGHPUT'
+    print '*************************************'
+    for group in ['filetype','directory']:
+      print '%-60s %8s %10s %10s %8s' %(group,'files','MB','seconds','MB/s')
+      for name in sorted(report[group].keys()):
+        total=report[group][name]
+        print '%-60s %8d %10.1f %10.1f %8.1f' %(name,total['files'],total['mb'],total['seconds'],total['mb_s'])
+    if report['probes'] is not None:
+      print 'Probes (single time steps): %s reads, %.1f MB in %.1f s' %(report['probes']['files'],report['probes']['mb'],
+            report['probes']['seconds'])
+    reads=[record[:3] for record in self.records if record[3]=='read']
+    slowest=sorted(reads,key=lambda record: record[1]/max(record[2],1e-6))[:nslowest]
+    report['slowest']=[{'file':filename,'mb':nbytes/1024.**2,'seconds':seconds} for filename,nbytes,seconds in slowest]
+    print 'Slowest files:'
+    for filename,nbytes,seconds in slowest:
+      print '  %s: %.1f MB in %.2f s (%.1f MB/s)' %(filename,nbytes/1024.**2,seconds,nbytes/1024.**2/max(seconds,1e-6))
+    return report
+
+
+# *************************************************************************************
+def get_cputime():
+  """ CPU time (user+system) of the process and of its finished children [s]
+  """
+  times=os.times()
+  return times[0]+times[1],times[2]+times[3]
+
+
+def get_iobytes():
+  """ Bytes read and written by the process (0 where /proc/self/io is not available)
+  """
+  nread,nwritten=0,0
+  try:
+    for line in open('/proc/self/io','r').readlines():
+      key,value=line.split(':')
+      if key=='rchar':
+        nread=int(value)
+      elif key=='wchar':
+        nwritten=int(value)
+  except (IOError,ValueError):
+    pass
+  return nread,nwritten
+
+
+def get_maxrss():
+  """ Peak resident memory of the process or of any of its children [kB]
+  """
+  return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+             resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+
+def reset_peak():
+  """ Resets the peak resident memory of the process (Linux only, see get_peak)
+  """
+  try:
+    fout=open('/proc/self/clear_refs','w')
+    fout.write('5')
+    fout.close()
+  except IOError:
+    pass
+
+
+def get_status(name):
+  """ Value of name (e.g. VmRSS) in /proc/self/status [bytes], None if not available
+  """
+  try:
+    for line in open('/proc/self/status','r').readlines():
+      if line.startswith(name+':'):
+        return int(line.split()[1])*1024
+  except (IOError,ValueError):
+    pass
+  return None
+
+
+def get_peak():
+  """ Peak resident memory of the process since the last reset_peak [bytes]. Where
+  it cannot be reset, the peak since the start of the process.
+  """
+  peak=get_status('VmHWM')
+  if peak is None:
+    peak=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+  return peak
+
+
+def get_rss():
+  """ Resident memory of the process [bytes] (0 if not available)
+  """
+  rss=get_status('VmRSS')
+  if rss is None:
+    rss=0
+  return rss
+
+
+def get_nbytes(fields):
+  """ Total size of the arrays in fields (a dictionary or a single array) [bytes]
+  """
+  if isinstance(fields,dict):
+    return sum([get_nbytes(field) for field in fields.values()])
+  return getattr(fields,'nbytes',0)
+
+
+# Spans and reads of the current run (shared by postprocess_NARCliM.py and postprocess_modules.py)
+trace=tracer()
+io=iostats()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+"""transfer.py
+   Copies the postprocessed files of a simulation to their final location (e.g. the
+   directory of the NARCliM archive in a mounted filesystem), several files at a time.
+
+   A manifest (.transfer_manifest.json in the destination directory) records the
+   size, modification time and MD5 checksum of each file transferred. Files whose
+   size and modification time have not changed since the last transfer are skipped,
+   so a transfer can be repeated (or resumed) after each ensemble member and only
+   new or modified files are copied. Each file is copied to a temporary file
+   (.part), its checksum is computed again at the destination and compared with the
+   source, and the temporary file is renamed only if they match; otherwise the copy
+   is retried. The files are not compressed again: the NetCDF files are already
+   compressed.
+
+   Usage:
+     python transfer.py -i /path/postprocess/1990-2009/MIROC3.2/R1/d02/ -o /archive/MIROC3.2/R1/d02/ -j 8
+     python transfer.py -o /archive/MIROC3.2/R1/d02/ --check     # checksums of the destination
+"""
+
+import os
+import sys
+import time
+import json
+import shutil
+import hashlib
+from multiprocessing.pool import ThreadPool
+from optparse import OptionParser
+
+MANIFEST='.transfer_manifest.json'
+BLOCKSIZE=8*1024*1024
+
+
+# *************************************************************************************
+def get_files(pathin):
+  """ Files in pathin and its subdirectories: dictionary of relative path: (size, mtime)
+  """
+  files={}
+  for root,dirs,filenames in os.walk(pathin):
+    for filename in filenames:
+      if filename==MANIFEST or filename.endswith('.part'):
+        continue
+      fullname=os.path.join(root,filename)
+      info=os.stat(fullname)
+      files[os.path.relpath(fullname,pathin)]=(info.st_size,info.st_mtime)
+  return files
+
+
+def md5sum(filename):
+  """ MD5 checksum (hexadecimal) of a file, read in blocks of BLOCKSIZE bytes
+  """
+  md5=hashlib.md5()
+  fin=open(filename,'rb')
+  try:
+    block=fin.read(BLOCKSIZE)
+    while block:
+      md5.update(block)
+      block=fin.read(BLOCKSIZE)
+  finally:
+    fin.close()
+  return md5.hexdigest()
+
+
+def read_manifest(pathout):
+  """ Manifest of the files already transferred to pathout ({} if there is none)
+  """
+  filename=os.path.join(pathout,MANIFEST)
+  if not os.path.exists(filename):
+    return {}
+  fin=open(filename,'r')
+  manifest=json.load(fin)
+  fin.close()
+  return manifest
+
+
+def write_manifest(pathout,manifest):
+  """ Writes the manifest of pathout (to a temporary file that is then renamed, so
+  an interrupted transfer does not leave a broken manifest)
+  """
+  filename=os.path.join(pathout,MANIFEST)
+  fout=open(filename+'.part','w')
+  json.dump(manifest,fout,indent=1,sort_keys=True)
+  fout.close()
+  os.rename(filename+'.part',filename)
+
+
+def is_unchanged(entry,size,mtime,fileout):
+  """ Whether a file (size and mtime at the source) is the same as when it was
+  transferred (manifest entry) and its copy is still at the destination
+  """
+  if entry is None or entry['size']!=size or entry['mtime']!=mtime:
+    return False
+  return os.path.exists(fileout) and os.path.getsize(fileout)==size
+
+
+# *************************************************************************************
+def copy_file(filein,fileout,retries=2):
+  """ Copies filein to fileout and checks the MD5 checksum of the copy. The copy is
+  retried up to retries times if it fails or the checksums differ.
+  Returns the manifest entry of the file, or None if it could not be copied.
+  """
+  for attempt in xrange(retries+1):
+    try:
+      if not os.path.exists(os.path.dirname(fileout)):
+        try:
+          os.makedirs(os.path.dirname(fileout))
+        except OSError:
+          # Created at the same time by another stream
+          pass
+      info=os.stat(filein)
+      md5=hashlib.md5()
+      fin=open(filein,'rb')
+      fout=open(fileout+'.part','wb')
+      try:
+        block=fin.read(BLOCKSIZE)
+        while block:
+          md5.update(block)
+          fout.write(block)
+          block=fin.read(BLOCKSIZE)
+      finally:
+        fin.close()
+        fout.close()
+      shutil.copystat(filein,fileout+'.part')
+      if md5sum(fileout+'.part')==md5.hexdigest():
+        os.rename(fileout+'.part',fileout)
+        return {'size':info.st_size,'mtime':info.st_mtime,'md5':md5.hexdigest()}
+      print 'WARNING: the checksum of the copy of %s is wrong (attempt %s of %s)' %(filein,attempt+1,retries+1)
+    except (IOError,OSError) as error:
+      print 'WARNING: %s could not be copied (attempt %s of %s): %s' %(filein,attempt+1,retries+1,error)
+  if os.path.exists(fileout+'.part'):
+    os.remove(fileout+'.part')
+  return None
+
+
+def transfer(pathin,pathout,jobs=4,retries=2):
+  """ Copies the files of pathin that are new or modified since the last transfer
+  to pathout, jobs files at a time, and updates the manifest of pathout.
+  Returns a dictionary with the files copied, skipped (unchanged) and failed.
+  """
+  tstart=time.time()
+  if not os.path.exists(pathout):
+    os.makedirs(pathout)
+  files=get_files(pathin)
+  manifest=read_manifest(pathout)
+  pending=[name for name in sorted(files.keys()) if not
+           is_unchanged(manifest.get(name),files[name][0],files[name][1],os.path.join(pathout,name))]
+  print 'Transfer %s -> %s: %s files, %s unchanged, %s to copy (%.1f MB) with %s streams' %(pathin,pathout,
+        len(files),len(files)-len(pending),len(pending),sum([files[name][0] for name in pending])/1024.**2,jobs)
+
+  def copy(name):
+    return name,copy_file(os.path.join(pathin,name),os.path.join(pathout,name),retries)
+
+  pool=ThreadPool(max(1,min(jobs,len(pending))))
+  results=pool.map(copy,pending,chunksize=1)
+  pool.close()
+  pool.join()
+
+  failed=[]
+  nbytes=0
+  for name,entry in results:
+    if entry is None:
+      failed.append(name)
+    else:
+      manifest[name]=entry
+      nbytes=nbytes+entry['size']
+  write_manifest(pathout,manifest)
+
+  seconds=time.time()-tstart
+  print 'Copied %s files (%.1f MB) in %.1f s (%.1f MB/s)' %(len(pending)-len(failed),nbytes/1024.**2,seconds,
+        nbytes/1024.**2/max(seconds,1e-6))
+  if len(failed)>0:
+    print 'ERROR: %s files could not be copied:' %(len(failed))
+    for name in failed:
+      print '  ',os.path.join(pathin,name)
+  return {'copied':[name for name,entry in results if entry is not None],'failed':failed,
+          'skipped':len(files)-len(pending)}
+
+
+def check(pathout,jobs=4):
+  """ Computes again the checksums of the files of the manifest of pathout.
+  Returns the files that are missing or whose checksum is wrong.
+  """
+  manifest=read_manifest(pathout)
+
+  def check_file(name):
+    fileout=os.path.join(pathout,name)
+    if not os.path.exists(fileout) or md5sum(fileout)!=manifest[name]['md5']:
+      return name
+    return None
+
+  pool=ThreadPool(max(1,jobs))
+  bad=[name for name in pool.map(check_file,sorted(manifest.keys()),chunksize=1) if name is not None]
+  pool.close()
+  pool.join()
+  print 'Checked %s files of %s: %s missing or with a wrong checksum' %(len(manifest),pathout,len(bad))
+  for name in bad:
+    print '  ',os.path.join(pathout,name)
+  return bad
+
+
+# *************************************************************************************
+if __name__=='__main__':
+
+  parser = OptionParser()
+  parser.add_option("-i", "--pathin", dest="pathin",
+  help="directory with the files to transfer", metavar="PATH")
+  parser.add_option("-o", "--pathout", dest="pathout",
+  help="destination directory", metavar="PATH")
+  parser.add_option("-j", "--jobs", dest="jobs", type="int", default=4,
+  help="number of files copied at the same time (4 by default)", metavar="N")
+  parser.add_option("-r", "--retries", dest="retries", type="int", default=2,
+  help="times a failed copy is retried (2 by default)", metavar="N")
+  parser.add_option("--check", dest="check", action="store_true", default=False,
+  help="only check the checksums of the files of the destination")
+  (opts, args) = parser.parse_args()
+
+  if opts.pathout is None:
+    parser.error('The destination directory (-o) is required')
+  if opts.check:
+    if len(check(opts.pathout,opts.jobs))>0:
+      sys.exit(1)
+  else:
+    if opts.pathin is None:
+      parser.error('The input directory (-i) is required')
+    if len(transfer(opts.pathin,opts.pathout,opts.jobs,opts.retries)['failed'])>0:
+      sys.exit(1)
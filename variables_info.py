@@ -2,6 +2,11 @@
 
 class VariablesInfo(object):
 
+    # Pressure levels [hPa] of the pressure-level variables (e.g. ta850, zg500),
+    # computed from the 3-D wrfout fields (see compute_plevels.py)
+    PLEVELS = (200, 500, 850)
+    PLEVEL_VARIABLES = ('ta', 'zg', 'ua', 'va', 'hus')
+
     RAW_SOURCE = {
         'wrfhrly': {'tas'          :{'D': ('mean','min','max'), 'M': ('mean','min','max', 'minmean', 'maxmean')}, 
                     'wss'          :{'D': ('mean','max'), 'M': ('mean','max')},
@@ -30,6 +35,7 @@ class VariablesInfo(object):
                     'snc'          :{'D': ('mean',), 'M': ('mean',)},
                     'snw'          :{'D': ('mean',), 'M': ('mean',)},
                     'snd'          :{'D': ('mean',), 'M': ('mean',)},
+                    'psl'          :{'D': ('mean',), 'M': ('mean',)},
                     },
         'wrfdly' : {'pr5maxtstep'  :{'D': ('max',), 'M': ('max',)}, 
                     'pr10maxtstep' :{'D': ('max',), 'M': ('max',)}, 
@@ -47,8 +53,74 @@ class VariablesInfo(object):
                     'tasmaxtstep'  :{'D': ('max' ,), 'M': ('max', 'maxmean')}
                     },
         }
-        
-        
+
+    # What each variable needs to be computed by its compute_* function (compute_vars.py):
+    #   inputs: WRF fields read from the files
+    #   statics: static fields of the domain (read once from the reference file, see read_static)
+    #   accumulated: the WRF fields are accumulated, so one more time step (from the
+    #                next file) is needed to compute the differences
+    #   nonnegative: negative values are reported as errors
+    #   chunked: computed from 3-D fields, so it is read and computed in chunks of files
+    #            (see process_chunked in postprocess_modules.py) and the 3-D fields
+    #            of a whole period are never in memory at the same time. All chunked
+    #            variables are computed together, reading the 3-D fields once
+    #   plevel: name and pressure level [hPa] of the pressure-level variables
+    VARIABLES = {
+        'tas'          :{'inputs': ('T2',)},
+        'pracc'        :{'inputs': ('RAINC','RAINNC'), 'accumulated': True, 'nonnegative': True},
+        'prcacc'       :{'inputs': ('RAINC',), 'accumulated': True, 'nonnegative': True},
+        'prncacc'      :{'inputs': ('RAINNC',), 'accumulated': True, 'nonnegative': True},
+        'ps'           :{'inputs': ('PSFC',)},
+        'uas'          :{'inputs': ('U10','V10'), 'statics': ('SINALPHA','COSALPHA')},
+        'vas'          :{'inputs': ('U10','V10'), 'statics': ('SINALPHA','COSALPHA')},
+        'huss'         :{'inputs': ('Q2',)},
+        'hurs'         :{'inputs': ('PSFC','T2','Q2')},
+        'clt'          :{'inputs': ('CLDFRA',)},
+        'wss'          :{'inputs': ('U10','V10')},
+        'sst'          :{'inputs': ('SST',), 'statics': ('LANDMASK',)},
+        'rsds'         :{'inputs': ('SWDOWN',)},
+        'rlds'         :{'inputs': ('GLW',)},
+        'emiss'        :{'inputs': ('EMISS',)},
+        'albedo'       :{'inputs': ('ALBEDO',)},
+        'hfls'         :{'inputs': ('LH',)},
+        'hfss'         :{'inputs': ('HFX',)},
+        'evspsbl'      :{'inputs': ('SFCEVP',), 'accumulated': True},
+        'mrso'         :{'inputs': ('SMSTOT',), 'statics': ('LANDMASK',)},
+        'potevp'       :{'inputs': ('POTEVP',), 'accumulated': True},
+        'rlus'         :{'inputs': ('TSK','EMISS')},
+        'snm'          :{'inputs': ('ACSNOM',)},
+        'snc'          :{'inputs': ('SNOWC',)},
+        'snw'          :{'inputs': ('SNOW',)},
+        'snd'          :{'inputs': ('SNOWH',)},
+        'psl'          :{'inputs': ('T','P','PB','PH','PHB','QVAPOR'), 'chunked': True},
+        'tasmeantstep' :{'inputs': ('T2MEAN',)},
+        'tasmintstep'  :{'inputs': ('T2MIN',)},
+        'tasmaxtstep'  :{'inputs': ('T2MAX',)},
+        'wssmaxtstep'  :{'inputs': ('SPDUV10MAX',)},
+        'pr5maxtstep'  :{'inputs': ('PRMAX5',)},
+        'pr10maxtstep' :{'inputs': ('PRMAX10',)},
+        'pr20maxtstep' :{'inputs': ('PRMAX20',)},
+        'pr30maxtstep' :{'inputs': ('PRMAX30',)},
+        'pr1Hmaxtstep' :{'inputs': ('PRMAX1H',)},
+        'wss5maxtstep' :{'inputs': ('UV10MAX5',)},
+        'wss10maxtstep':{'inputs': ('UV10MAX10',)},
+        'wss20maxtstep':{'inputs': ('UV10MAX20',)},
+        'wss30maxtstep':{'inputs': ('UV10MAX30',)},
+        'wss1Hmaxtstep':{'inputs': ('UV10MAX1H',)},
+        }
+
+    PLEVEL_INPUTS = {'ta' :{'inputs': ('T','P','PB')},
+                     'zg' :{'inputs': ('PH','PHB','P','PB')},
+                     'ua' :{'inputs': ('U','V','P','PB'), 'statics': ('SINALPHA','COSALPHA')},
+                     'va' :{'inputs': ('U','V','P','PB'), 'statics': ('SINALPHA','COSALPHA')},
+                     'hus':{'inputs': ('QVAPOR','P','PB')},
+                     }
+
+    for _name in PLEVEL_VARIABLES:
+        for _plev in PLEVELS:
+            RAW_SOURCE['wrfout']['%s%s' %(_name,_plev)] = {'D': ('mean',), 'M': ('mean',)}
+            VARIABLES['%s%s' %(_name,_plev)] = dict(PLEVEL_INPUTS[_name], chunked=True, plevel=(_name,_plev))
+    del _name, _plev
         
         
     def get_wrf_file_types(self):
@@ -73,6 +145,77 @@ class VariablesInfo(object):
 
         return False
 
+    def get_inputs(self, vname):
+        """ get the list of WRF fields needed to compute the variable 'vname'
+        """
+        return list(self.VARIABLES[vname]['inputs'])
+
+    def get_statics(self, vname):
+        """ get the list of static fields (LANDMASK, SINALPHA...) needed by 'vname'
+        """
+        return list(self.VARIABLES[vname].get('statics', ()))
+
+    def is_accumulated(self, vname):
+        """ whether the WRF fields of the variable are accumulated in time
+        """
+        return self.VARIABLES[vname].get('accumulated', False)
+
+    def is_nonnegative(self, vname):
+        """ whether negative values of the variable must be reported
+        """
+        return self.VARIABLES[vname].get('nonnegative', False)
+
+    def is_chunked(self, vname):
+        """ whether the variable is computed in chunks of files
+        """
+        return self.VARIABLES[vname].get('chunked', False)
+
+    def get_plevel(self, vname):
+        """ name and pressure level [hPa] of a pressure-level variable (e.g. ('ta', 850)
+            for ta850), None for the other variables
+        """
+        return self.VARIABLES[vname].get('plevel', None)
+
+    def get_group_inputs(self, vnames):
+        """ get the WRF fields needed to compute all variables in 'vnames' (without repetitions)
+        """
+        inputs = []
+        for vname in vnames:
+            for wrfv in self.get_inputs(vname):
+                if wrfv not in inputs:
+                    inputs.append(wrfv)
+        return inputs
+
+    def get_read_groups(self, vnames):
+        """ split the variables 'vnames' in groups that share WRF fields, so that the
+            fields of each group are read once for all its variables. The chunked variables
+            (from 3-D fields) are all in a single group of their own: their fields are read
+            chunk by chunk, once for all of them (see process_chunked).
+            The variables of each group keep the order of 'vnames'.
+        """
+        groups = []
+        for vname in vnames:
+            if self.is_chunked(vname):
+                chunked = [group for group in groups if self.is_chunked(group[0])]
+                if len(chunked) == 0:
+                    groups.append([vname])
+                else:
+                    chunked[0].append(vname)
+                continue
+            inputs = set(self.get_inputs(vname))
+            shared = [group for group in groups
+                      if not self.is_chunked(group[0]) and inputs & set(self.get_group_inputs(group))]
+            if len(shared) == 0:
+                groups.append([vname])
+            else:
+                # The variable joins the first group and merges the other groups it shares fields with
+                for group in shared[1:]:
+                    shared[0].extend(group)
+                    groups.remove(group)
+                shared[0].append(vname)
+                shared[0].sort(key=vnames.index)
+        return groups
+
     def get_daily_variable_stats(self, wrf_file_type, vname):
         """get the configured daily statistics to compute for a given variable 'vname'
         """